@@ -0,0 +1,82 @@
+"""
+Load benchmark for the ExplainerNlgService worker pools.
+
+Sends a batch of concurrent requests to the service with an increasing number of workers and reports the throughput
+for each. Run with
+
+    $ python benchmark.py --concurrency process --requests 200
+"""
+import argparse
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+from explainer.explainer_nlg_service import ExplainerNlgService
+
+EVENTS = [
+    {"id": 1, "task": {"name": "ExtractWords", "parameters": {"units": "stems"}}, "reason": {"name": "initialization"}},
+    {
+        "id": 2,
+        "task": {"name": "SplitByFacet", "parameters": {"facet": "NEWSPAPER_NAME"}},
+        "reason": {"name": "big_collection"},
+    },
+    {
+        "id": 3,
+        "task": {"name": "QueryTopicModel", "parameters": {"model_name": "m1", "model_type": "lda"}},
+        "reason": {"name": "path strategy", "strategy": "expansion"},
+    },
+    {
+        "id": 4,
+        "task": {"name": "ExtractNames", "parameters": {"sort_by": "salience", "max_number": 10}},
+        "reason": {"name": "brute_force"},
+    },
+    {"id": 5, "task": {"name": "Comparison", "parameters": {"facet": "LANGUAGE"}}, "reason": {"name": "brute_force"}},
+    {
+        "id": 6,
+        "task": {"name": "GenerateTimeSeries", "parameters": {"facet_name": "NEWSPAPER_NAME"}},
+        "reason": {"name": "not enough data"},
+    },
+]
+
+
+def benchmark(concurrency: str, workers: int, requests: int, languages: List[str]) -> float:
+    service = ExplainerNlgService(random_seed=4551546, concurrency=concurrency, max_workers=workers)
+    data = json.dumps(EVENTS)
+    try:
+        # Warm up the pool so that worker start-up is not included in the measurement
+        with ThreadPoolExecutor(max_workers=workers) as clients:
+            list(clients.map(lambda _: service.run_pipeline("en", "ol", data), range(workers)))
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers * 2) as clients:
+            list(
+                clients.map(lambda i: service.run_pipeline(languages[i % len(languages)], "ol", data), range(requests))
+            )
+        return requests / (time.perf_counter() - start)
+    finally:
+        service.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", choices=ExplainerNlgService.CONCURRENCY_MODES, default="process")
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--languages", nargs="+", default=["en", "fi"])
+    args = parser.parse_args()
+
+    logging.getLogger("root").setLevel(logging.WARNING)
+
+    baseline = None
+    print("{:>8} {:>12} {:>8}".format("workers", "requests/s", "speedup"))
+    for workers in range(1, args.max_workers + 1):
+        throughput = benchmark(args.concurrency, workers, args.requests, args.languages)
+        baseline = baseline or throughput
+        print("{:>8} {:>12.1f} {:>8.2f}".format(workers, throughput, throughput / baseline))
+
+
+if __name__ == "__main__":
+    main()
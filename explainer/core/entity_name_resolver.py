@@ -1,18 +1,18 @@
 import logging
 from abc import abstractmethod
 from collections import defaultdict
-from typing import DefaultDict, Set, Tuple
+from typing import Any, DefaultDict, Set, Tuple
 
 from numpy.random import Generator
 
-from .models import DocumentPlanNode, Slot
-from .pipeline import NLGPipelineComponent
+from .models import DocumentPlanNode, Message, Slot, iter_messages
+from .pipeline import MessageStage, RunContext
 from .registry import Registry
 
 log = logging.getLogger("root")
 
 
-class EntityNameResolver(NLGPipelineComponent):
+class EntityNameResolver(MessageStage):
     """
     A NLGPipelineComponent that transforms abstracted entity identifers to names.
 
@@ -46,14 +46,70 @@ class EntityNameResolver(NLGPipelineComponent):
         Run this pipeline component.
         """
         log.info("Running NER")
-
+        context = RunContext(registry, random, language)
+        language, previous_entities, encountered = self.start(context, document_plan)
+
+        # Only the slots that can contain entities, as given by the template metadata, are visited in document order
+        slots = [
+            message.children[idx]
+            for message in iter_messages(document_plan)
+            if message.template is not None
+            for idx in message.template.slot_metadata.entity_slots
+        ]
+        if not slots:
+            log.debug("No slots that could contain entities, skipping")
+            return (document_plan,)
+
+        for slot in slots:
+            encountered, previous_entities = self._recurse(
+                registry, random, language, slot, previous_entities, encountered
+            )
+
+        return self.finish(context, (language, previous_entities, encountered), document_plan)
+
+    def start(
+        self, context: RunContext, document_plan: DocumentPlanNode
+    ) -> Tuple[str, DefaultDict[str, None], Set[str]]:
+        language = context.language
         if language.endswith("-head"):
             language = language[:-5]
             log.debug("Language had suffix '-head', removing. Result: {}".format(language))
+        return language, defaultdict(lambda: None), set()
 
-        previous_entities = defaultdict(lambda: None)
-        self._recurse(registry, random, language, document_plan, previous_entities, set())
-
+    def run_message(
+        self, context: RunContext, state: Tuple[str, DefaultDict[str, None], Set[str]], message: Message
+    ) -> None:
+        # The entities previously encountered are updated in place, so they carry over to the next message
+        language, previous_entities, encountered = state
+        if message.template is None:
+            return
+        for idx in message.template.slot_metadata.entity_slots:
+            self._recurse(
+                context.registry, context.random, language, message.children[idx], previous_entities, encountered
+            )
+
+    def carried_state(
+        self, state: Tuple[str, DefaultDict[str, None], Set[str]]
+    ) -> Tuple[Tuple[Tuple[str, str], ...], Tuple[str, ...]]:
+        _, previous_entities, encountered = state
+        previous = tuple(sorted((key, entity) for key, entity in previous_entities.items() if entity is not None))
+        return previous, tuple(sorted(encountered))
+
+    def restore_state(
+        self,
+        state: Tuple[str, DefaultDict[str, None], Set[str]],
+        snapshot: Tuple[Tuple[Tuple[str, str], ...], Tuple[str, ...]],
+    ) -> None:
+        _, previous_entities, encountered = state
+        previous, encountered_snapshot = snapshot
+        previous_entities.clear()
+        previous_entities.update(previous)
+        encountered.clear()
+        encountered.update(encountered_snapshot)
+
+    def finish(
+        self, context: RunContext, state: Tuple[str, DefaultDict[str, None], Set[str]], document_plan: DocumentPlanNode
+    ) -> Tuple[DocumentPlanNode]:
         if log.isEnabledFor(logging.DEBUG):
             document_plan.print_tree()
 
@@ -111,7 +167,7 @@ class EntityNameResolver(NLGPipelineComponent):
         return encountered, previous_entities
 
     @abstractmethod
-    def is_entity(self, maybe_entity: str) -> bool:
+    def is_entity(self, maybe_entity: Any) -> bool:
         raise NotImplementedError("Not implemented")
 
     @abstractmethod
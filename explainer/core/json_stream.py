@@ -0,0 +1,172 @@
+import codecs
+import json
+import re
+from typing import IO, Any, Iterator, Optional, Union
+
+_decoder = json.JSONDecoder()
+_whitespace = re.compile(r"[ \t\n\r]*")
+_number = "0123456789+-.eE"
+_literals = ("true", "false", "null", "NaN", "Infinity", "-Infinity")
+
+# What the scanner of an item looks for inside and outside of strings, and what ends a number or a literal
+_string_special = re.compile(r'["\\]')
+_structure = re.compile(r'[\[\]{}"]')
+_scalar_end = re.compile(r"[ \t\n\r,\]]")
+
+
+class _ItemScanner(object):
+    """
+    Finds the end of a single JSON value in a buffer that is being filled chunk by chunk, without decoding it. The scan
+    is resumed from where it stopped when more of the value arrives, so each character is scanned only once.
+
+    The position of the scan is kept relative to the start of the value, as the buffer is compacted between chunks.
+    """
+
+    def __init__(self, first: str) -> None:
+        self.scalar = first not in '[{"'
+        self.depth = 0
+        self.in_string = False
+        self.offset = 0
+
+    def end(self, buffer: str, start: int, eof: bool) -> Optional[int]:
+        """
+        The index in buffer just after the value starting at start, or None if the value continues in the next chunk.
+        """
+        pos = start + self.offset
+        if self.scalar:
+            match = _scalar_end.search(buffer, pos)
+            if match:
+                return match.start()
+            self.offset = len(buffer) - start
+            return len(buffer) if eof else None
+
+        while True:
+            if self.in_string:
+                match = _string_special.search(buffer, pos)
+                if match is None:
+                    break
+                if match.group() == "\\":
+                    if match.end() >= len(buffer):
+                        # The escaped character is in the next chunk
+                        pos = match.start()
+                        break
+                    pos = match.end() + 1
+                    continue
+                self.in_string = False
+                pos = match.end()
+                if self.depth == 0:
+                    return pos
+                continue
+
+            match = _structure.search(buffer, pos)
+            if match is None:
+                break
+            pos = match.end()
+            char = match.group()
+            if char == '"':
+                self.in_string = True
+            elif char in "[{":
+                self.depth += 1
+            else:
+                self.depth -= 1
+                if self.depth <= 0:
+                    return pos
+
+        self.offset = min(pos, len(buffer)) - start
+        return len(buffer) if eof else None
+
+
+def _is_truncated(error: json.JSONDecodeError, buffer: str) -> bool:
+    # Whether decoding failed only because the buffer ends in the middle of the value, rather than on invalid JSON
+    rest = buffer[error.pos :]
+    if error.msg.startswith("Unterminated string"):
+        return True
+    if error.msg.startswith("Invalid \\uXXXX escape"):
+        # The decoder also needs the character after the escape
+        return len(rest) <= 5
+    return all(char in _number for char in rest) or any(literal.startswith(rest) for literal in _literals)
+
+
+def iter_json_array(stream: IO[Union[bytes, str]], chunk_size: int = 1 << 16) -> Iterator[Any]:
+    """
+    Decode a JSON array from a binary or text stream one item at a time, yielding each item as soon as it has been
+    read. Only the item being decoded is held in memory, not the whole document, so that arbitrarily long arrays can be
+    read. Binary streams must be UTF-8.
+
+    An item that is not whole in the buffer is scanned for its end as chunks are read, scanning each character once,
+    after which it is decoded once. While it is incomplete, it is also decoded each time its size doubles, so that
+    invalid JSON is detected without reading the rest of the stream.
+
+    Raises a json.JSONDecodeError if the stream does not contain exactly one JSON array.
+    """
+    decode = codecs.getincrementaldecoder("utf-8")().decode
+    buffer = ""
+    pos = 0
+    eof = False
+
+    def read() -> bool:
+        # Appends the next chunk of the stream to the buffer, dropping the part of it that has already been decoded
+        nonlocal buffer, pos, eof
+        chunk = stream.read(chunk_size)
+        eof = not chunk
+        if isinstance(chunk, bytes):
+            chunk = decode(chunk, final=eof)
+        buffer = buffer[pos:] + chunk
+        pos = 0
+        return not eof
+
+    def skip_whitespace() -> str:
+        # Returns the next non-whitespace character, or an empty string at the end of the stream
+        nonlocal pos
+        while True:
+            pos = _whitespace.match(buffer, pos).end()
+            if pos < len(buffer):
+                return buffer[pos]
+            if not read():
+                return ""
+
+    if skip_whitespace() != "[":
+        raise json.JSONDecodeError("Expecting '['", buffer, pos)
+    pos += 1
+    if skip_whitespace() == "]":
+        pos += 1
+    else:
+        while True:
+            first = skip_whitespace()
+            item = end = None
+            try:
+                # Most items are already in the buffer whole, and are decoded without scanning them
+                item, end = _decoder.raw_decode(buffer, pos)
+                if end == len(buffer) and first not in '[{"' and not eof:
+                    # A number or literal at the end of the buffer might continue in the next chunk
+                    end = None
+            except json.JSONDecodeError as ex:
+                if not _is_truncated(ex, buffer):
+                    raise
+
+            if end is None:
+                scanner = _ItemScanner(first)
+                checked_size = chunk_size
+                while scanner.end(buffer, pos, eof) is None:
+                    if len(buffer) - pos >= 2 * checked_size:
+                        checked_size = len(buffer) - pos
+                        try:
+                            _decoder.raw_decode(buffer, pos)
+                        except json.JSONDecodeError as ex:
+                            if not _is_truncated(ex, buffer):
+                                raise
+                    read()
+                # Valid JSON ends where the scan ended, so the decoding never needs the rest of the buffer
+                item, end = _decoder.raw_decode(buffer, pos)
+            pos = end
+            yield item
+
+            separator = skip_whitespace()
+            pos += 1
+            if separator == "]":
+                break
+            if separator != ",":
+                raise json.JSONDecodeError("Expecting ',' delimiter", buffer, pos - 1)
+
+    if skip_whitespace():
+        raise json.JSONDecodeError("Extra data", buffer, pos)
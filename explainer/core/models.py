@@ -4,7 +4,7 @@ import re
 from abc import ABC, abstractmethod
 from collections import namedtuple
 from enum import Enum
-from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Union
 
 log = logging.getLogger("root")
 
@@ -203,6 +203,36 @@ class Message(DocumentPlanNode):
 Fact = namedtuple("fact", ["type", "name", "parameters", "id"])
 
 
+class FactParameters(object):
+    """
+    Structured parameters of a fact, for the resources to emit instead of encoding the parameters into "[Name:...]"
+    tags. Realizers of the named task can read the fields directly, without parsing them out of a string.
+
+    str() gives the legacy string form, as produced by formatting legacy_format with the fields, so that the regex
+    realizers, template rules and anything else written against the string form keep working.
+    """
+
+    def __init__(self, name: str, fields: Dict[str, Any], legacy_format: str) -> None:
+        self.name = name
+        self.fields = fields
+        self.legacy_format = legacy_format
+
+    def __getitem__(self, field: str) -> Any:
+        return self.fields[field]
+
+    def __eq__(self, other: Any) -> bool:
+        return isinstance(other, FactParameters) and (self.name, self.fields) == (other.name, other.fields)
+
+    def __hash__(self) -> int:
+        return hash((self.name, tuple(self.fields.items())))
+
+    def __str__(self) -> str:
+        return self.legacy_format.format(**self.fields)
+
+    def __repr__(self) -> str:
+        return "FactParameters({!r}, {!r})".format(self.name, self.fields)
+
+
 class Template(DocumentPlanNode):
     """
     A template consisting of TemplateComponent elements and a list of rules about the facts that can be presented
@@ -214,17 +244,26 @@ class Template(DocumentPlanNode):
         components: List["TemplateComponent"],
         rules: Optional[List[Tuple[List["Matcher"], List[int]]]] = None,
         slot_map: Optional[Dict[str, "Slot"]] = None,
+        compiled_rules: Optional[List["CompiledRule"]] = None,
+        slot_metadata: Optional["SlotMetadata"] = None,
     ) -> None:
 
         super().__init__()
 
         self._rules = rules if rules is not None else []
+        # The Matchers are kept around for debugging and introspection, but the matching itself is done with
+        # the compiled versions. Copies of a template share the compiled rules of the original.
+        self._compiled_rules = (
+            compiled_rules if compiled_rules is not None else [CompiledRule(matchers) for matchers, _ in self._rules]
+        )
         self._facts = []
         self._slot_map = slot_map if slot_map is not None else {}
         self._components = components
         for c in self._components:
             c.parent = self
         self._slots = None
+        # Copies of a template have the same components, and so share the metadata of the original
+        self._slot_metadata = slot_metadata if slot_metadata is not None else SlotMetadata(self._components)
 
     def get_slot(self, slot_type: str) -> "Slot":
         """
@@ -248,32 +287,59 @@ class Template(DocumentPlanNode):
             self._components.append(slot)
         slot.parent = self
         self.slots.append(slot)
+        self.update_slot_metadata()
 
     def move_slot(self, from_idx: int, to_idx: int) -> None:
         self.components.insert(to_idx, self.components.pop(from_idx))
+        self.update_slot_metadata()
+
+    @property
+    def slot_metadata(self) -> "SlotMetadata":
+        return self._slot_metadata
+
+    def update_slot_metadata(self) -> None:
+        """Recompute the slot metadata. Needs to be called whenever the components are changed in place."""
+        self._slot_metadata = SlotMetadata(self._components)
 
     @property
     def components(self) -> List["TemplateComponent"]:
         return self._components
 
+    @property
+    def rules(self) -> List[Tuple[List["Matcher"], List[int]]]:
+        return self._rules
+
     @property
     def facts(self) -> List[Fact]:
         return self._facts
 
-    def check(self, primary_message: Message, all_messages: List[Message], fill_slots: bool = False) -> List[Fact]:
+    def matches_primary(self, fact: Fact) -> bool:
+        """
+        Whether the first rule of the template matches the fact. This depends on nothing but the fact, unlike the other
+        rules which might refer to the facts matched before them.
+        """
+        return self._compiled_rules[0](fact, [])
+
+    def check(
+        self,
+        primary_message: Message,
+        all_messages: List[Message],
+        fact_index: Optional["FactIndex"] = None,
+        primary_checked: bool = False,
+    ) -> Optional["TemplateMatch"]:
         """
-        Like fill(), but doesn't modify the template data structure, just checks whether the given message,
-        with the support from other messages, is compatible with the template.
+        Checks whether the given message, with the support from other messages, is compatible with the template.
+        Doesn't modify the template data structure, but the returned TemplateMatch can be passed to fill() on this
+        template (or any copy of it) to fill it without going through the messages again.
 
         :param primary_message: The message that the first rule in the template should match
         :param all_messages: A list of other available messages
-        :param fill_slots:
-        :return: True, if the template can be used for the primary_message. False otherwise.
+        :param fact_index: A FactIndex over all_messages, used to find the messages for the secondary rules without
+            going through all of the messages
+        :param primary_checked: whether the first rule is already known to match the primary message, as found by
+            matches_primary()
+        :return: A TemplateMatch, if the template can be used for the primary_message. None otherwise.
         """
-        # ToDo: Could we somehow cache the information about which messages to use in addition to the primary, so
-        #  that we could then fill the message straight away without going through the messages again?
-        # OR: Fill the templates in this phase and then just choose one of them. Filling shouldn't be that much
-        # slower than checking.
         primary_fact = primary_message.main_fact
 
         # TODO: Had these happen a few time, better to crash early and explicitly
@@ -282,53 +348,62 @@ class Template(DocumentPlanNode):
         used_facts = []
 
         # The first rule has to match the primary message
-        if not all(matcher(primary_fact, used_facts) for matcher in self._rules[0][0]):
-            return []
-
-        if fill_slots:
-            for slot_index in self._rules[0][1]:
-                component = self._components[slot_index]
-                if isinstance(component, Slot):
-                    component.fact = primary_fact
+        if not primary_checked and not self._compiled_rules[0](primary_fact, used_facts):
+            return None
 
         used_facts.append(primary_fact)
+        rule_facts = [primary_fact]
 
         # Check the other rules
-        if len(self._rules) > 1:
-            for (matchers, slot_indices) in self._rules[1:]:
-                # Try each message in turn
-                for mess in all_messages:
-                    if all(matcher(mess.main_fact, used_facts) for matcher in matchers):
-                        # Found a suitable message: fill the slots
-                        if fill_slots:
-                            for slot_index in slot_indices:
-                                component = self._components[slot_index]
-                                if isinstance(component, Slot):
-                                    component.fact = mess.main_fact
-                        if mess.main_fact not in used_facts:
-                            used_facts.append(mess.main_fact)
-                        # Move onto the next rule
-                        break
-                else:
-                    # No available message matched the rule: we can't use this template:
-                    return []
-
-        if fill_slots:
-            self._facts = used_facts
-
-        return used_facts
-
-    def fill(self, primary_message: Message, all_messages: List[Message]) -> List[Fact]:
+        for rule in self._compiled_rules[1:]:
+            candidates = fact_index.candidates(rule, used_facts) if fact_index is not None else None
+            if candidates is None:
+                candidates = (mess.main_fact for mess in all_messages)
+            # Try each message in turn
+            for fact in candidates:
+                if rule(fact, used_facts):
+                    # Found a suitable message
+                    rule_facts.append(fact)
+                    if fact not in used_facts:
+                        used_facts.append(fact)
+                    # Move onto the next rule
+                    break
+            else:
+                # No available message matched the rule: we can't use this template:
+                return None
+
+        slot_facts = [
+            (slot_index, fact)
+            for fact, (_, slot_indices) in zip(rule_facts, self._rules)
+            for slot_index in slot_indices
+        ]
+        return TemplateMatch(rule_facts, used_facts, slot_facts)
+
+    def fill(
+        self, primary_message: Message, all_messages: List[Message], match: Optional["TemplateMatch"] = None
+    ) -> List[Fact]:
         """
         Search for messages needed to fulfill all of the rules in the template, and link the Slot components to the
         matching Facts
 
         :param primary_message: The message that the first rule in the template should match
         :param all_messages: A list of other available messages
+        :param match: The result of a previous check() of the same message against this template or the template this
+            one was copied from. If given, the rules are not evaluated again.
         :return: A list of the Facts that match the rules in the template
         """
+        if match is None:
+            match = self.check(primary_message, all_messages)
+            if match is None:
+                return []
+
+        for slot_index, fact in match.slot_facts:
+            component = self._components[slot_index]
+            if isinstance(component, Slot):
+                component.fact = fact
 
-        return self.check(primary_message, all_messages, fill_slots=True)
+        self._facts = match.facts
+        return match.facts
 
     @property
     def slots(self) -> List["Slot"]:
@@ -344,7 +419,9 @@ class Template(DocumentPlanNode):
     def copy(self) -> "Template":
         """Makes a deep copy of this Template. The copy does not contain any messages."""
         component_copy = [c.copy() for c in self.components]
-        return Template(component_copy, self._rules)
+        return Template(
+            component_copy, self._rules, compiled_rules=self._compiled_rules, slot_metadata=self._slot_metadata
+        )
 
     def __str__(self) -> str:
         return "<Template: {}>".format(self.display_template())
@@ -357,6 +434,126 @@ class Template(DocumentPlanNode):
         return " ".join(str(c) for c in self.components)
 
 
+class SlotMetadata(object):
+    """
+    The indices of the components of a template that each of the pipeline stages after template selection needs to
+    look at, so that the stages can skip the rest of the components, and whole documents with none.
+
+    case_slots: the slots with a "case" attribute, to be inflected
+    entity_slots: the slots whose value can contain an "[ENTITY:...]" tag
+    realizable_slots: the slots whose value can contain a "[Name:...]" tag or a "PREFIX:value" to be realized
+
+    The value of a slot filled from a fact is only known once the template has been filled, so all of those are assumed
+    to contain anything. The value of a literal slot is known in advance, and is checked for the characters that
+    all tags contain.
+    """
+
+    def __init__(self, components: List["TemplateComponent"]) -> None:
+        case_slots: List[int] = []
+        entity_slots: List[int] = []
+        realizable_slots: List[int] = []
+        for idx, component in enumerate(components):
+            if not isinstance(component, Slot):
+                continue
+            if "case" in component.attributes:
+                case_slots.append(idx)
+            source = component.source
+            value = str(source.value) if isinstance(source, LiteralSource) else None
+            if value is None or "[" in value:
+                entity_slots.append(idx)
+            if value is None or "[" in value or ":" in value:
+                realizable_slots.append(idx)
+        self.case_slots: Tuple[int, ...] = tuple(case_slots)
+        self.entity_slots: Tuple[int, ...] = tuple(entity_slots)
+        self.realizable_slots: Tuple[int, ...] = tuple(realizable_slots)
+
+    def __repr__(self) -> str:
+        return "<SlotMetadata: case={}, entity={}, realizable={}>".format(
+            self.case_slots, self.entity_slots, self.realizable_slots
+        )
+
+
+def iter_messages(node: DocumentPlanNode) -> Iterator[Message]:
+    """The messages of the document plan rooted at the node, in document order."""
+    if isinstance(node, Message):
+        yield node
+        return
+    for child in node.children:
+        yield from iter_messages(child)
+
+
+class FactIndex(object):
+    """
+    An index over the main facts of a list of messages, used by Template.check() to find the facts matching secondary
+    rules without going through all of the messages. Meant to be built once per document.
+
+    The buckets are built lazily, the first time a rule pins the field in question, and list the facts in the same
+    order as the messages.
+    """
+
+    def __init__(self, messages: List[Message]) -> None:
+        self._facts = [message.main_fact for message in messages]
+        self._buckets = {}  # type: Dict[Tuple[str, bool], Optional[Dict[Any, List[Fact]]]]
+
+    def _bucket(self, field_name: str, as_string: bool) -> Optional[Dict[Any, List[Fact]]]:
+        key = (field_name, as_string)
+        if key not in self._buckets:
+            buckets = {}
+            try:
+                for fact in self._facts:
+                    value = getattr(fact, field_name)
+                    buckets.setdefault(str(value) if as_string else value, []).append(fact)
+            except TypeError:
+                # Unhashable values, can't be indexed
+                buckets = None
+            self._buckets[key] = buckets
+        return self._buckets[key]
+
+    def candidates(self, rule: "CompiledRule", used_facts: List[Fact]) -> Optional[List[Fact]]:
+        """
+        Returns, in message order, the facts that can possibly match the rule, or None if the rule does not pin any
+        indexed field to a known value. In the latter case, all the facts need to be checked.
+        """
+        best = None
+        for field_name, value in rule.pins:
+            if isinstance(value, ReferentialExpr):
+                try:
+                    value = value(None, used_facts)
+                except (IndexError, AttributeError):
+                    continue
+                # The "=" operator treats string values as regexes, so only plain strings can be looked up
+                if type(value) is str and not is_plain_literal(value):
+                    continue
+            bucket = self._bucket(field_name, type(value) is str)
+            if bucket is None:
+                continue
+            try:
+                facts = bucket.get(value, [])
+            except TypeError:
+                continue
+            if best is None or len(facts) < len(best):
+                best = facts
+        return best
+
+
+class TemplateMatch(object):
+    """
+    The facts that a Template was found to be compatible with by Template.check().
+
+    rule_facts: the fact matched by each of the rules of the template, in the order of the rules
+    facts: the distinct facts used by the template, primary fact first
+    slot_facts: (component index, fact) pairs telling which fact each of the slots of the template should be linked to
+    """
+
+    def __init__(self, rule_facts: List[Fact], facts: List[Fact], slot_facts: List[Tuple[int, Fact]]) -> None:
+        self.rule_facts = rule_facts
+        self.facts = facts
+        self.slot_facts = slot_facts
+
+    def __repr__(self) -> str:
+        return "<TemplateMatch: {}>".format(self.facts)
+
+
 class DefaultTemplate(Template):
     def __init__(self, canned_text: str) -> None:
         super().__init__(components=[Literal(canned_text)])
@@ -415,6 +612,10 @@ class Slot(TemplateComponent):
     def slot_type(self) -> str:
         return self._to_value.field_name
 
+    @property
+    def source(self) -> Union["SlotSource", Callable]:
+        return self._to_value
+
     @property
     def value(self) -> Union[str, int, float]:
         return self._to_value(self.fact)
@@ -564,6 +765,18 @@ class ReferentialExpr(object):
         return "all[{}].{}".format(self.reference_idx, self.field_name)
 
 
+# Characters that make a string RHS of an "=" constraint behave as a regex rather than as a literal
+REGEX_METACHARACTERS = frozenset(".^$*+?{}[]\\|()")
+
+
+def is_plain_literal(value: Any) -> bool:
+    """
+    Whether the RHS of an "=" constraint is guaranteed to match exactly the string representation of itself, i.e.
+    it's a string without any regex metacharacters.
+    """
+    return type(value) is str and not any(char in REGEX_METACHARACTERS for char in value)
+
+
 def _equal_op(a: Any, b: Any) -> bool:
     if type(b) is str:
         return re.match("^" + b + "$", str(a)) is not None
@@ -609,3 +822,89 @@ class Matcher(object):
 
     def __repr__(self):
         return str(self)
+
+
+def _compile_matcher(matcher: Matcher) -> Callable[[Fact, List[Fact]], bool]:
+    """
+    Turns a Matcher into an equivalent function, doing as much of the work as possible beforehand.
+    """
+    op = matcher.op
+    value = matcher.value
+
+    if not isinstance(matcher.lhs, FactField) or callable(value):
+        # The general case: the values on both sides need to be computed for each fact
+        lhs = matcher.lhs
+        op_func = Matcher.OPERATORS[op]
+        if callable(value):
+            return lambda fact, all_facts: op_func(lhs(fact, all_facts), value(fact, all_facts))
+        return lambda fact, all_facts: op_func(lhs(fact, all_facts), value)
+
+    get_field = operator.attrgetter(matcher.lhs.field_name)
+
+    if op == "=" and type(value) is str:
+        if is_plain_literal(value):
+            return lambda fact, all_facts: str(get_field(fact)) == value
+        pattern = re.compile("^" + value + "$")
+        return lambda fact, all_facts: pattern.match(str(get_field(fact))) is not None
+
+    if op == "=":
+        return lambda fact, all_facts: get_field(fact) == value
+
+    if op == "in" and isinstance(value, (set, frozenset)):
+        values = frozenset(value)
+        return lambda fact, all_facts: get_field(fact) in values
+
+    op_func = Matcher.OPERATORS[op]
+    return lambda fact, all_facts: op_func(get_field(fact), value)
+
+
+def _match_anything(fact: Fact, all_facts: List[Fact]) -> bool:
+    return True
+
+
+class CompiledRule(object):
+    """
+    A single predicate equivalent to requiring that all of the Matchers of a template rule match the fact.
+
+    Only the Matchers are pickled, the predicate is rebuilt when unpickling.
+    """
+
+    # Fields of a fact that a FactIndex can be used to look up
+    INDEXABLE_FIELDS = ("type", "name", "id")
+
+    def __init__(self, matchers: List[Matcher]) -> None:
+        self.matchers = matchers
+
+        # (field name, value) pairs for the equality constraints that pin an indexable field to a single known value
+        self.pins = [
+            (matcher.lhs.field_name, matcher.value)
+            for matcher in matchers
+            if matcher.op == "="
+            and isinstance(matcher.lhs, FactField)
+            and matcher.lhs.field_name in self.INDEXABLE_FIELDS
+            and (
+                is_plain_literal(matcher.value)
+                or isinstance(matcher.value, ReferentialExpr)
+                or (type(matcher.value) is not str and not callable(matcher.value))
+            )
+        ]
+
+        predicates = [_compile_matcher(matcher) for matcher in matchers]
+        if not predicates:
+            self._predicate = _match_anything
+        elif len(predicates) == 1:
+            self._predicate = predicates[0]
+        else:
+            self._predicate = lambda fact, all_facts: all(predicate(fact, all_facts) for predicate in predicates)
+
+    def __call__(self, fact: Fact, all_facts: List[Fact]) -> bool:
+        return self._predicate(fact, all_facts)
+
+    def __reduce__(self):
+        return CompiledRule, (self.matchers,)
+
+    def __str__(self) -> str:
+        return "<CompiledRule: {}>".format(", ".join(str(matcher) for matcher in self.matchers))
+
+    def __repr__(self) -> str:
+        return str(self)
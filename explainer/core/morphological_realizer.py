@@ -1,26 +1,157 @@
 import logging
+import os
+import sqlite3
+import threading
 from abc import ABC, abstractmethod
-from typing import Dict, Tuple
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Type
 
 from numpy.random import Generator
 
+from .cache import LRUCache
 from .models import DocumentPlanNode, Message, Slot
-from .pipeline import NLGPipelineComponent
+from .pipeline import MessageStage, RunContext
 from .registry import Registry
 
 log = logging.getLogger("root")
 
 
+class MorphologyCache(object):
+    """
+    A cache of inflected forms, keyed by (language, form, case).
+
+    Entries are kept in an in-memory LRU cache and, if a path is given, in an sqlite database on disk. The database can
+    be shared by all the workers on a host, so that a form inflected by one worker is known to all of them, also after
+    restarts. Failures of the database are logged and otherwise ignored, the cache then simply behaves as if it was
+    empty.
+    """
+
+    def __init__(self, maxsize: int = 4096, path: Optional[str] = None) -> None:
+        self.memory = LRUCache(maxsize)
+        self.path = path
+        # sqlite connections can not be shared between threads, nor survive a fork
+        self._local = threading.local()
+        if path is not None:
+            connection = self._connection()
+            if connection is not None:
+                with connection:
+                    connection.execute(
+                        "CREATE TABLE IF NOT EXISTS inflections (language TEXT, form TEXT, grammatical_case TEXT, "
+                        "inflected TEXT, PRIMARY KEY (language, form, grammatical_case))"
+                    )
+
+    def _connection(self) -> Optional[sqlite3.Connection]:
+        if getattr(self._local, "pid", None) != os.getpid():
+            self._local.pid = os.getpid()
+            try:
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                self._local.connection = sqlite3.connect(self.path, timeout=5)
+                self._local.connection.execute("PRAGMA journal_mode=WAL")
+            except sqlite3.Error as ex:
+                log.error("Unable to open morphology cache at {}: {}".format(self.path, ex))
+                self._local.connection = None
+        return self._local.connection
+
+    def get(self, language: str, form: str, case: str) -> Optional[str]:
+        key = (language, form, case)
+        inflected = self.memory.get(key)
+        if inflected is not None or self.path is None:
+            return inflected
+        connection = self._connection()
+        if connection is None:
+            return None
+        try:
+            row = connection.execute(
+                "SELECT inflected FROM inflections WHERE language = ? AND form = ? AND grammatical_case = ?", key
+            ).fetchone()
+        except sqlite3.Error as ex:
+            log.error("Unable to read morphology cache at {}: {}".format(self.path, ex))
+            return None
+        if row is None:
+            return None
+        self.memory.put(key, row[0])
+        return row[0]
+
+    def put(self, language: str, form: str, case: str, inflected: str) -> None:
+        self.memory.put((language, form, case), inflected)
+        if self.path is None:
+            return
+        connection = self._connection()
+        if connection is None:
+            return
+        try:
+            with connection:
+                connection.execute(
+                    "INSERT OR REPLACE INTO inflections VALUES (?, ?, ?, ?)", (language, form, case, inflected)
+                )
+        except sqlite3.Error as ex:
+            log.error("Unable to write morphology cache at {}: {}".format(self.path, ex))
+
+
 class LanguageSpecificMorphologicalRealizer(ABC):
-    def __init__(self, language):
+
+    # The exceptions raised by inflect() when the form can not be inflected at the moment, e.g. as a model could not be
+    # loaded. The form is then used uninflected. Any other exception is a bug, and is raised as is.
+    inflection_errors: Tuple[Type[Exception], ...] = ()
+
+    def __init__(self, language: str, cache: Optional[MorphologyCache] = None) -> None:
         self.language = language
+        self.cache = cache
 
-    @abstractmethod
     def realize(self, slot: Slot) -> str:
+        case: Optional[str] = slot.attributes.get("case")
+        if case is None:
+            return slot.value
+        return self.inflect_cached(slot.value, self.normalize_case(case))
+
+    def inflect_cached(self, form: str, case: str) -> str:
+        """
+        Inflect the form to the (normalized) case, using the cache if there is one.
+        """
+        if self.cache is not None:
+            inflected = self.cache.get(self.language, form, case)
+            if inflected is not None:
+                return inflected
+        try:
+            inflected = self.inflect(form, case)
+        except self.inflection_errors as ex:
+            # Not cached, as the failure might be temporary
+            log.exception("Failed to inflect {} to {} in {}: {}".format(form, case, self.language, ex))
+            return form
+        if self.cache is not None:
+            self.cache.put(self.language, form, case, inflected)
+        return inflected
+
+    def warm_up(self) -> None:
+        """
+        Load and exercise any models the realizer needs, so that the first request does not have to. Called once at
+        startup, before any worker processes are forked, so that the workers share the loaded models.
+        """
+        pass
+
+    @abstractmethod
+    def normalize_case(self, case: str) -> str:
+        """
+        Map a case attribute, as written in the templates, to the name of the case used by inflect().
+        """
         pass
 
+    @abstractmethod
+    def inflect(self, form: str, case: str) -> str:
+        """
+        Inflect the form to the case. Returns the form as is if it can not be inflected.
+        """
+        pass
+
+
+class MorphologicalRealizer(MessageStage):
+    """
+    Inflects the slots that have a case attribute.
+
+    The slots of a whole document, or of a whole batch of documents, are collected first, so that each distinct
+    (form, case) pair is inflected only once no matter how many times it occurs.
+    """
 
-class MorphologicalRealizer(NLGPipelineComponent):
     def __init__(self, language_realizers: Dict[str, LanguageSpecificMorphologicalRealizer]) -> None:
         self.language_realizers = language_realizers
 
@@ -32,29 +163,116 @@ class MorphologicalRealizer(NLGPipelineComponent):
         """
         log.info("Running Morphological Realizer")
 
-        if language.endswith("-head"):
-            language = language[:-5]
-            log.debug("Language had suffix '-head', removing. Result: {}".format(language))
-
+        language = self._strip_head(language)
         if language not in self.language_realizers:
             log.warning("No morphological realizer for language {}".format(language))
             return (document_plan,)
 
-        self._recurse(language, document_plan)
+        realizer = self.language_realizers[language]
+        self._inflect(realizer, self._inflection_requests(realizer, document_plan))
 
         if log.isEnabledFor(logging.DEBUG):
             document_plan.print_tree()
 
         return (document_plan,)
 
-    def _recurse(self, language: str, this: DocumentPlanNode) -> None:
-        log.debug("Visiting '{}'".format(this))
+    def start(
+        self, context: RunContext, document_plan: DocumentPlanNode
+    ) -> Tuple[Optional[LanguageSpecificMorphologicalRealizer], Dict[Tuple[Any, str], Any]]:
+        language = self._strip_head(context.language)
+        if language not in self.language_realizers:
+            log.warning("No morphological realizer for language {}".format(language))
+            return None, {}
+        return self.language_realizers[language], {}
+
+    def run_message(
+        self,
+        context: RunContext,
+        state: Tuple[Optional[LanguageSpecificMorphologicalRealizer], Dict[Tuple[Any, str], Any]],
+        message: Message,
+    ) -> None:
+        # The inflections are shared by all the messages of the document, so each form is still inflected only once
+        realizer, inflections = state
+        if realizer is not None:
+            self._inflect(realizer, self._inflection_requests(realizer, message), inflections)
+
+    def finish(self, context: RunContext, state: Any, document_plan: DocumentPlanNode) -> Tuple[DocumentPlanNode]:
+        if log.isEnabledFor(logging.DEBUG):
+            document_plan.print_tree()
+
+        return (document_plan,)
+
+    def run_batch(self, contexts: Sequence[RunContext], inputs: Sequence[Tuple[DocumentPlanNode]]) -> List[Any]:
+        """
+        Inflect the slots of all the documents of a language together, so that a form is inflected only once per batch.
+        """
+        log.info("Running Morphological Realizer for {} documents".format(len(inputs)))
+        outputs: List[Any] = []
+        requests_by_language: Dict[str, List[Tuple[Slot, Any, str]]] = defaultdict(list)
+        for context, (document_plan,) in zip(contexts, inputs):
+            language = self._strip_head(context.language)
+            if language not in self.language_realizers:
+                log.warning("No morphological realizer for language {}".format(language))
+                outputs.append((document_plan,))
+                continue
+            try:
+                requests = self._inflection_requests(self.language_realizers[language], document_plan)
+            except Exception as ex:
+                outputs.append(ex)
+                continue
+            requests_by_language[language].extend(requests)
+            outputs.append((document_plan,))
+
+        for language, requests in requests_by_language.items():
+            self._inflect(self.language_realizers[language], requests)
+        return outputs
+
+    @staticmethod
+    def _strip_head(language: str) -> str:
+        if language.endswith("-head"):
+            language = language[:-5]
+            log.debug("Language had suffix '-head', removing. Result: {}".format(language))
+        return language
+
+    def _collect_slots(self, this: DocumentPlanNode, slots: List[Slot]) -> None:
         if not isinstance(this, Message):
+            log.debug("Visiting '{}'".format(this))
             for child in this.children:
-                self._recurse(language, child)
+                self._collect_slots(child, slots)
             return
 
-        for template_component in this.template.components:
-            if isinstance(template_component, Slot):
-                realized_value = self.language_realizers[language].realize(template_component)
-                template_component.value = lambda x, realized_value=realized_value: realized_value
+        if this.template is not None:
+            components = this.template.components
+            slots.extend(components[idx] for idx in this.template.slot_metadata.case_slots)
+
+    def _inflection_requests(
+        self, realizer: LanguageSpecificMorphologicalRealizer, document_plan: DocumentPlanNode
+    ) -> List[Tuple[Slot, Any, str]]:
+        """
+        Find the form and the normalized case of each slot of the document that has a case, as given by the slot
+        metadata of the templates.
+        """
+        slots: List[Slot] = []
+        self._collect_slots(document_plan, slots)
+        return [(slot, slot.value, realizer.normalize_case(slot.attributes["case"])) for slot in slots]
+
+    def _inflect(
+        self,
+        realizer: LanguageSpecificMorphologicalRealizer,
+        requests: List[Tuple[Slot, Any, str]],
+        inflections: Optional[Dict[Tuple[Any, str], Any]] = None,
+    ) -> None:
+        """
+        Inflect each distinct (form, case) pair of the requests once, and set the values of the slots accordingly.
+        Inflections already in the given dictionary are reused, and new ones are added to it.
+        """
+        if inflections is None:
+            inflections = {}
+        for _, form, case in requests:
+            if (form, case) not in inflections:
+                inflections[(form, case)] = realizer.inflect_cached(form, case)
+        log.debug("Inflected {} distinct forms for {} slots".format(len(inflections), len(requests)))
+
+        for slot, form, case in requests:
+            realized_value = inflections[(form, case)]
+            slot.value = lambda x, realized_value=realized_value: realized_value
@@ -1,16 +1,41 @@
+import copy
+import hashlib
 import logging
 from abc import ABC
-from typing import Any, List, Optional, Tuple, Union
+from concurrent.futures import Executor
+from typing import Any, Dict, Hashable, Iterator, List, Optional, Sequence, Tuple, Union
 
 from numpy import random
 
+from .cache import LRUCache
+from .models import DocumentPlanNode, Message, iter_messages
 from .registry import Registry
 
 log = logging.getLogger("root")
 
 
+class RunContext(object):
+    """
+    Everything that is specific to a single run of a pipeline.
+
+    Pipelines and their components are built once and shared between runs, which might be executing concurrently in
+    different threads. Components must therefore not store any per-run state on themselves, but keep it in the run
+    context instead. The scratch dictionary is free for the components to use for such data.
+    """
+
+    def __init__(self, registry: Registry, random: random.Generator, language: str) -> None:
+        self.registry = registry
+        self.random = random
+        self.language = language
+        self.scratch: Dict[Any, Any] = {}
+
+
 class NLGPipelineComponent(ABC):
 
+    # Whether the output of the component depends only on its inputs, and neither on the language nor on the PRNG. The
+    # leading language independent components of a pipeline are only ran once when generating for multiple languages.
+    language_independent = False
+
     # TODO: We'd want this to be along the lines of "run(self, registry: Registry, ..., *args: Any) but that's not
     #  possible with the current implementation of
     def run(self, *args, **kwargs):
@@ -23,14 +48,97 @@ class NLGPipelineComponent(ABC):
         """
         raise NotImplementedError
 
+    def run_batch(self, contexts: Sequence[RunContext], inputs: Sequence[Tuple[Any, ...]]) -> List[Any]:
+        """
+        Run this component for a batch of documents at once. contexts[i] is the RunContext of the i'th document and
+        inputs[i] the output of the previous component for it.
+
+        Returns the outputs of the component in the same order as the inputs. An exception raised while processing a
+        document is returned in place of its output, so that a single failing document does not fail the whole batch.
+
+        The default implementation simply calls run() for each document in turn. Components that can share work
+        between documents, e.g. by deduplicating expensive lookups, should override this.
+        """
+        outputs: List[Any] = []
+        for context, args in zip(contexts, inputs):
+            try:
+                outputs.append(self.run(context.registry, context.random, context.language, *args))
+            except Exception as ex:
+                outputs.append(ex)
+        return outputs
+
     def __str__(self) -> str:
         return str(self.__class__.__name__)
 
 
+class MessageStage(NLGPipelineComponent):
+    """
+    A pipeline component whose work on a document can be done one message at a time, in document order.
+
+    Consecutive message stages can be fused by NLGPipeline.run() into a single pass over the messages, where each
+    message is taken through all of the stages before moving on to the next one. The fused stages must produce the
+    same output as run(), so that the two modes can be used interchangeably.
+
+    The first argument of the stage must be the document plan. All of the stages but the last must return the
+    document plan as their only output, as the later stages of a fused pass are started before the earlier ones finish.
+    """
+
+    def start(self, context: RunContext, document_plan: DocumentPlanNode, *args: Any) -> Any:
+        """
+        Prepare for processing the messages of the document. Returns the state of the stage for this document, which is
+        passed to the other methods.
+        """
+        raise NotImplementedError
+
+    def run_message(self, context: RunContext, state: Any, message: Message) -> None:
+        """
+        Process a single message. Called for each message of the document in order, after the previous stages of the
+        fused pass have processed it.
+        """
+        raise NotImplementedError
+
+    def finish(self, context: RunContext, state: Any, document_plan: DocumentPlanNode) -> Tuple[Any, ...]:
+        """
+        Finish processing the document, returning the output of the stage as run() would.
+        """
+        return (document_plan,)
+
+    def carried_state(self, state: Any) -> Hashable:
+        """
+        A hashable snapshot of the part of the state that carries over from one message to the next and affects the
+        output, such as the entities mentioned so far. None if the messages are processed independently of each other.
+        """
+        return None
+
+    def restore_state(self, state: Any, snapshot: Hashable) -> None:
+        """
+        Restore the part of the state returned by carried_state() from a snapshot.
+        """
+        pass
+
+    def finish_paragraph(self, context: RunContext, state: Any, paragraph: DocumentPlanNode) -> Any:
+        """
+        Return the output of the stage for a single paragraph whose messages have all been processed. Only needed of the
+        last stage of pipelines that are ran with NLGPipeline.run_by_paragraph().
+        """
+        raise NotImplementedError
+
+    def join_paragraphs(self, context: RunContext, paragraphs: List[Any]) -> Any:
+        """
+        Join the outputs of finish_paragraph() for all of the paragraphs of the document into the output of the stage.
+        """
+        raise NotImplementedError
+
+
 class NLGPipeline(object):
+    """
+    A sequence of NLGPipelineComponents. A pipeline holds no per-run state, so a single instance can be built once and
+    then ran any number of times, also concurrently from multiple threads.
+    """
+
     def __init__(self, registry: Registry, *components: NLGPipelineComponent) -> None:
         self._registry = registry
-        self._components = components
+        self._components = tuple(components)
 
     @property
     def registry(self) -> Registry:
@@ -40,19 +148,294 @@ class NLGPipeline(object):
     def components(self) -> Tuple[NLGPipelineComponent]:
         return self._components
 
-    def run(self, initial_inputs: Any, language: str, prng_seed: Optional[int] = None) -> Union[List[Any], Tuple[Any]]:
+    def run(
+        self, initial_inputs: Any, language: str, prng_seed: Optional[int] = None, fused: bool = False
+    ) -> Union[List[Any], Tuple[Any]]:
+        """
+        Run the pipeline for the inputs.
+
+        By default each component is ran in turn for the whole document. If fused is True, each run of consecutive
+        MessageStages is instead ran as a single pass over the messages of the document. The output is the same in
+        both modes, provided that the stages draw from the PRNG in the same order, which holds when at most the first
+        stage of each fused run draws from it.
+        """
         log.info("Starting NLG pipeline")
         log.debug("PRNG seed is {}".format(prng_seed))
-        prng = random.default_rng(prng_seed)  # type: random.Generator
-        log.info("First random is {}".format(prng.integers(0, 1000000)))
-        args = initial_inputs
-        for component in self.components:
-            log.info("Running component {}".format(component))
+        context = RunContext(self.registry, random.default_rng(prng_seed), language)
+        log.info("First random is {}".format(context.random.integers(0, 1000000)))
+        output = self._run_components(context, self.components, initial_inputs, fused)
+        log.info("NLG Pipeline completed")
+        return output
+
+    def stream(
+        self, initial_inputs: Any, language: str, prng_seed: Optional[int] = None, fused: bool = False
+    ) -> Iterator[Any]:
+        """
+        Run the pipeline as run() does, but yield the output of the last stage for each paragraph as soon as the
+        paragraph is done, instead of the output for the whole document. Joining the outputs of all the paragraphs with
+        join_paragraphs() gives the output of run() with the same fused.
+
+        The components before the trailing run of MessageStages are ran for the whole document first. If fused is True,
+        the messages are then taken through the stages one paragraph at a time, so only the paragraph being realized is
+        held as text. Otherwise all of the stages but the last are ran for the whole document in turn, as in run(), and
+        only the last stage is ran one paragraph at a time.
+        """
+        log.info("Starting NLG pipeline streaming")
+        log.debug("PRNG seed is {}".format(prng_seed))
+        context = RunContext(self.registry, random.default_rng(prng_seed), language)
+        log.info("First random is {}".format(context.random.integers(0, 1000000)))
+
+        first_stage = self._first_paragraph_stage()
+        if not fused:
+            first_stage = len(self.components) - 1
+        args = self._run_components(context, self.components[:first_stage], initial_inputs, False)
+        stages: Sequence[MessageStage] = self.components[first_stage:]
+        log.info("Streaming components {} by paragraph".format(", ".join(str(stage) for stage in stages)))
+        try:
+            document_plan = args[0]
+            states = [stages[0].start(context, *args)] + [stage.start(context, document_plan) for stage in stages[1:]]
+            for paragraph in document_plan.children:
+                for message in iter_messages(paragraph):
+                    for stage, state in zip(stages, states):
+                        stage.run_message(context, state, message)
+                yield stages[-1].finish_paragraph(context, states[-1], paragraph)
+        except Exception as ex:
+            log.exception(ex)
+            raise
+        log.info("NLG Pipeline completed")
+
+    def _run_components(
+        self, context: RunContext, components: Sequence[NLGPipelineComponent], args: Any, fused: bool
+    ) -> Any:
+        idx = 0
+        while idx < len(components):
+            end = idx + 1
+            if fused:
+                while end < len(components) and isinstance(components[idx], MessageStage):
+                    if not isinstance(components[end], MessageStage):
+                        break
+                    end += 1
             try:
-                output = component.run(self.registry, prng, language, *args)
+                if end - idx > 1:
+                    log.info("Running components {} fused".format(", ".join(str(c) for c in components[idx:end])))
+                    args = self._run_fused(context, components[idx:end], args)
+                else:
+                    log.info("Running component {}".format(components[idx]))
+                    args = components[idx].run(context.registry, context.random, context.language, *args)
             except Exception as ex:
                 log.exception(ex)
                 raise
-            args = output
+            idx = end
+        return args
+
+    @staticmethod
+    def _run_fused(context: RunContext, stages: Sequence[MessageStage], args: Tuple[Any, ...]) -> Tuple[Any, ...]:
+        document_plan = args[0]
+        # Only the first stage gets the extra inputs, the rest take just the document plan from the previous stage
+        states = [stages[0].start(context, *args)] + [stage.start(context, document_plan) for stage in stages[1:]]
+        for message in iter_messages(document_plan):
+            for stage, state in zip(stages, states):
+                stage.run_message(context, state, message)
+        for stage, state in zip(stages, states):
+            args = stage.finish(context, state, document_plan)
+        return args
+
+    def run_by_paragraph(
+        self,
+        initial_inputs: Any,
+        language: str,
+        prng_seed: Optional[int] = None,
+        cache: Optional[LRUCache] = None,
+        cache_namespace: Hashable = None,
+    ) -> Any:
+        """
+        Run the pipeline so that each paragraph of the document is realized independently of the PRNG draws of the
+        other paragraphs, and can thus be cached and reused in other documents.
+
+        The components before the trailing run of MessageStages are ran as usual by plan(), after which the paragraphs
+        are realized by realize_paragraphs() and joined by join_paragraphs().
+
+        The output differs from that of run(), as the PRNG is drawn from differently. The paragraphs must also be
+        independent of each other apart from the carried state: template selection must not look at the messages of
+        other paragraphs, so none of the templates may have more than one rule.
+        """
+        log.info("Starting NLG pipeline by paragraph")
+        args = self.plan(initial_inputs, language, prng_seed)
+        realized = self.realize_paragraphs(args, language, prng_seed, cache=cache, cache_namespace=cache_namespace)
+        output = self.join_paragraphs(language, [paragraph for paragraph, _ in realized])
         log.info("NLG Pipeline completed")
         return output
+
+    def plan(self, initial_inputs: Any, language: str, prng_seed: Optional[int] = None) -> Tuple[Any, ...]:
+        """
+        Run the components before the trailing run of MessageStages, returning their output. The first item of the
+        output is the document plan.
+        """
+        context = RunContext(self.registry, random.default_rng(prng_seed), language)
+        log.info("First random is {}".format(context.random.integers(0, 1000000)))
+        return self._run_components(context, self.components[: self._first_paragraph_stage()], initial_inputs, False)
+
+    def realize_paragraphs(
+        self,
+        args: Tuple[Any, ...],
+        language: str,
+        prng_seed: Optional[int] = None,
+        first: int = 0,
+        carried: Optional[Tuple[Hashable, ...]] = None,
+        cache: Optional[LRUCache] = None,
+        cache_namespace: Hashable = None,
+    ) -> Iterator[Tuple[Any, Tuple[Hashable, ...]]]:
+        """
+        Realize the paragraphs of the document planned by plan(), starting from the paragraph at index first.
+
+        The trailing MessageStages are ran fused for each paragraph in turn, with a PRNG seeded from a digest of the
+        seed and of the facts of the paragraph. The only thing carried from paragraph to paragraph is the
+        carried_state() of the stages, e.g. the entities mentioned so far. To continue from an earlier call, pass the
+        carried state after the paragraph before first.
+
+        The output of a paragraph is cached keyed by the namespace, the language, the digest and the carried state going
+        into the paragraph, so that the same paragraph in the same context is only realized once.
+
+        Yields, for each paragraph as soon as it is realized, the output of the last stage and the carried state after
+        it.
+        """
+        stages: Sequence[MessageStage] = self.components[self._first_paragraph_stage() :]
+        log.info("Running components {} by paragraph".format(", ".join(str(stage) for stage in stages)))
+        context = RunContext(self.registry, random.default_rng(prng_seed), language)
+        document_plan = args[0]
+        try:
+            states = [stages[0].start(context, *args)] + [stage.start(context, document_plan) for stage in stages[1:]]
+            if carried is not None:
+                for stage, state, snapshot in zip(stages, states, carried):
+                    stage.restore_state(state, snapshot)
+
+            for paragraph in document_plan.children[first:]:
+                digest = self._paragraph_digest(prng_seed, paragraph)
+                carried = tuple(stage.carried_state(state) for stage, state in zip(stages, states))
+                key = (cache_namespace, language, digest, carried)
+                cached = cache.get(key) if cache is not None else None
+                if cached is None:
+                    paragraph_context = RunContext(self.registry, random.default_rng(list(digest)), language)
+                    for message in iter_messages(paragraph):
+                        for stage, state in zip(stages, states):
+                            stage.run_message(paragraph_context, state, message)
+                    output = stages[-1].finish_paragraph(paragraph_context, states[-1], paragraph)
+                    cached = (output, tuple(stage.carried_state(state) for stage, state in zip(stages, states)))
+                    if cache is not None:
+                        cache.put(key, cached)
+                else:
+                    log.debug("Reusing cached paragraph {}".format(digest.hex()))
+                    for stage, state, snapshot in zip(stages, states, cached[1]):
+                        stage.restore_state(state, snapshot)
+                yield cached
+        except Exception as ex:
+            log.exception(ex)
+            raise
+
+    def join_paragraphs(self, language: str, paragraphs: List[Any]) -> Any:
+        """
+        Join the outputs of realize_paragraphs() for all the paragraphs of a document into the output of the pipeline.
+        """
+        context = RunContext(self.registry, random.default_rng(), language)
+        return self.components[-1].join_paragraphs(context, paragraphs)
+
+    def _first_paragraph_stage(self) -> int:
+        first_stage = len(self.components)
+        while first_stage > 0 and isinstance(self.components[first_stage - 1], MessageStage):
+            first_stage -= 1
+        if first_stage == len(self.components):
+            raise ValueError("Pipeline {} does not end in message stages".format(self))
+        return first_stage
+
+    @staticmethod
+    def _paragraph_digest(prng_seed: Optional[int], paragraph: DocumentPlanNode) -> bytes:
+        digest = hashlib.sha256("seed:{}".format(prng_seed).encode("utf-8"))
+        # The main facts are used, as template selection replaces the facts of the messages with the facts it used
+        for message in iter_messages(paragraph):
+            digest.update("\0{!r}".format(tuple(message.main_fact)).encode("utf-8"))
+        return digest.digest()
+
+    def run_batch(self, jobs: Sequence[Tuple[Any, str, Optional[int]]]) -> List[Any]:
+        """
+        Run the pipeline for a batch of (initial_inputs, language, prng_seed) jobs. Instead of running the whole
+        pipeline for each job in turn, each component is ran for the whole batch before moving on to the next one.
+
+        Each job gets its own RunContext, seeded exactly as in run(), so the output of a job does not depend on the
+        other jobs in the batch. Returns the outputs in the order of the jobs. A job that failed has the exception it
+        raised in place of its output, and is not processed further.
+        """
+        log.info("Starting NLG pipeline for a batch of {} jobs".format(len(jobs)))
+        contexts: List[RunContext] = []
+        results: List[Any] = []
+        for initial_inputs, language, prng_seed in jobs:
+            context = RunContext(self.registry, random.default_rng(prng_seed), language)
+            # Consume the same random number as run() does
+            context.random.integers(0, 1000000)
+            contexts.append(context)
+            results.append(initial_inputs)
+
+        for component in self.components:
+            pending = [idx for idx, result in enumerate(results) if not isinstance(result, Exception)]
+            if not pending:
+                break
+            log.info("Running component {} for {} jobs".format(component, len(pending)))
+            outputs = component.run_batch([contexts[idx] for idx in pending], [results[idx] for idx in pending])
+            for idx, output in zip(pending, outputs):
+                if isinstance(output, Exception):
+                    log.exception(output, exc_info=output)
+                results[idx] = output
+        log.info("NLG Pipeline completed for the batch")
+        return results
+
+    def run_fanout(
+        self,
+        initial_inputs: Any,
+        languages: Sequence[str],
+        prng_seed: Optional[int] = None,
+        executor: Optional[Executor] = None,
+    ) -> Dict[str, Any]:
+        """
+        Run the pipeline for the same inputs in multiple languages. The leading language independent components are ran
+        only once, after which the pipeline branches into a run of the remaining components for each language. If an
+        executor is given, the branches are ran in it.
+
+        Each branch starts from a copy of the PRNG state and of the output of the shared components, so the output for
+        a language is the same as that of run() for it. Returns the outputs keyed by language. A language for which the
+        pipeline failed has the exception in place of its output.
+        """
+        log.info("Starting NLG pipeline for languages {}".format(", ".join(languages)))
+        context = RunContext(self.registry, random.default_rng(prng_seed), languages[0])
+        log.info("First random is {}".format(context.random.integers(0, 1000000)))
+
+        shared = 0
+        while shared < len(self.components) and self.components[shared].language_independent:
+            shared += 1
+
+        args = initial_inputs
+        try:
+            for component in self.components[:shared]:
+                log.info("Running component {} for all languages".format(component))
+                args = component.run(context.registry, context.random, context.language, *args)
+        except Exception as ex:
+            log.exception(ex)
+            return {language: ex for language in languages}
+
+        def run_branch(language: str, prng: random.Generator, args: Any) -> Any:
+            branch_context = RunContext(self.registry, prng, language)
+            try:
+                for component in self.components[shared:]:
+                    log.info("Running component {} for language {}".format(component, language))
+                    args = component.run(branch_context.registry, branch_context.random, branch_context.language, *args)
+            except Exception as ex:
+                log.exception(ex)
+                return ex
+            return args
+
+        # The branches must be copied before any of them is started, as they modify their inputs in place
+        branches = [(language, copy.deepcopy(context.random), copy.deepcopy(args)) for language in languages]
+        if executor is None:
+            results = [run_branch(*branch) for branch in branches]
+        else:
+            results = [future.result() for future in [executor.submit(run_branch, *branch) for branch in branches]]
+        log.info("NLG Pipeline completed for languages {}".format(", ".join(languages)))
+        return dict(zip(languages, results))
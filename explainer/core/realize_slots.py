@@ -1,68 +1,270 @@
+import heapq
 import logging
 import re
 from abc import ABC, abstractmethod
+from collections import defaultdict
 from numbers import Number
-from typing import Callable, Iterable, List, Optional, Tuple, Union
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    FrozenSet,
+    Hashable,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Union,
+)
 
 from numpy.random import Generator
 
-from .models import DocumentPlanNode, Message, Slot, TemplateComponent
-from .pipeline import NLGPipelineComponent
+from .cache import LRUCache
+from .models import DocumentPlanNode, FactParameters, LiteralSource, Message, Slot, TemplateComponent, iter_messages
+from .pipeline import MessageStage, RunContext
 from .registry import Registry
 
 log = logging.getLogger("root")
 
+# The start of a "[Name:KEY:VALUE]" tag, as emitted by the resources into the fact parameters. Matching this is linear
+# in the length of the string, as the name can not contain the "[" that starts the next candidate.
+TAG_START = re.compile(r"\[(\w+):")
 
-class SlotRealizer(NLGPipelineComponent):
-    def __init__(self) -> None:
-        self._random = None
-        self._registry = None
+# The tag of the slots a regex can match, if the regex requires one. Only regexes that start with the tag, optionally
+# preceded by "(.*)" and whitespace, are recognized. Other regexes can give their tag to the RegexRealizer explicitly.
+REGEX_TAG = re.compile(r"^(?:\(\.\*\)(?:\\s[?*]?)?)?\\\[(\w+):")
+
+
+def text_before_tag(tag: str) -> str:
+    """
+    A regex group matching the text before the first "[tag" in a value. Unlike "(.*)" followed by the tag, the group can
+    not overlap with the tag, so matching takes time linear in the length of the value however many times it contains
+    the start of the tag.
+    """
+    return r"((?:[^\[]|\[(?!{}))*)".format(re.escape(tag))
+
+
+def find_tags(value: str) -> Set[str]:
+    """
+    Find the names of all the "[Name:...]" tags in the value.
+    """
+    return set(TAG_START.findall(value))
+
+
+class SlotRealizer(MessageStage):
+
+    # Number of distinct slots whose realizations are cached for a batch, when the table has no cache of its own
+    BATCH_CACHE_SIZE = 4096
 
     def run(
         self, registry: Registry, random: Generator, language: str, document_plan: DocumentPlanNode
     ) -> Tuple[DocumentPlanNode]:
         """
         Run this pipeline component.
+
+        Realizing a slot can produce new slots, which might need to be realized in turn. The slots are processed level
+        by level: first all the slots of the document in order, then all the slots produced by those in order, and so
+        on until a level produces no new slots. Only newly produced slots are revisited, as a slot that could not be
+        realized once can never be realized later. The components of each message are rebuilt once at the end, and the
+        slot metadata of its template is updated to match.
+
+        Of the slots of the templates, only the ones listed in their metadata as realizable are visited.
+
+        When fused with the other stages, the slots of each message are instead realized level by level on their own.
         """
         log.info("Realizing slots")
-        self._registry = registry
-        self._random = random
-        while self._recurse(document_plan, language.split("-")[0]):
-            pass  # Repeat until no more changes
+        context = RunContext(registry, random, language)
+        self._realize_messages(context, self.start(context, document_plan), list(iter_messages(document_plan)))
         return (document_plan,)
 
-    def _recurse(self, this: DocumentPlanNode, language: str) -> bool:
-        if not isinstance(this, Message):
-            log.debug("Visiting '{}'".format(this))
-            return any(self._recurse(child, language) for child in this.children)
-        else:
-            log.debug("Visiting {}".format(this))
-            any_modified = False
-            # Use indexes to iterate through the children since the template slots may be edited, added or replaced
-            # during iteration. Ugly, but will do for now.
-            idx = 0
-            while idx < len(this.children):
-                child = this.children[idx]
-                log.debug("Visiting child {}".format(child))
-                if not isinstance(child, Slot):
-                    idx += 1
+    def start(self, context: RunContext, document_plan: DocumentPlanNode) -> "SlotRealizerTable":
+        language = context.language.split("-")[0]
+        # Registries without prebuilt tables only list the realizers, so the table is then built on demand
+        table = None
+        if "slot-realizer-table" in context.registry:
+            table = context.registry.get("slot-realizer-table").get(language)
+        if table is None:
+            table = SlotRealizerTable.for_language(context.registry.get("slot-realizers"), language)
+        return table
+
+    def run_message(self, context: RunContext, table: "SlotRealizerTable", message: Message) -> None:
+        self._realize_messages(context, table, [message])
+
+    def run_batch(self, contexts: Sequence[RunContext], inputs: Sequence[Tuple[DocumentPlanNode]]) -> List[Any]:
+        """
+        Realize the slots of a batch of documents. The table of each language is found only once per batch. A table that
+        has to be built, or that has no cache, gets a cache of its own for the batch, so that each distinct slot is
+        dispatched to the realizers only once per batch.
+        """
+        log.info("Realizing slots for {} documents".format(len(inputs)))
+        tables: Dict[str, SlotRealizerTable] = {}
+        outputs: List[Any] = []
+        for context, (document_plan,) in zip(contexts, inputs):
+            try:
+                language = context.language.split("-")[0]
+                if language not in tables:
+                    table = self.start(context, document_plan)
+                    if table.cache is None:
+                        table = SlotRealizerTable(table.realizers, language, LRUCache(self.BATCH_CACHE_SIZE))
+                    tables[language] = table
+                self._realize_messages(context, tables[language], list(iter_messages(document_plan)))
+                outputs.append((document_plan,))
+            except Exception as ex:
+                outputs.append(ex)
+        return outputs
+
+    def _realize_messages(self, context: RunContext, table: "SlotRealizerTable", messages: List[Message]) -> None:
+        # Only the slots that can contain something to realize are visited, as given by the template metadata
+        worklist: List[Tuple[Message, Slot]] = [
+            (message, message.children[idx])
+            for message in messages
+            if message.template is not None
+            for idx in message.template.slot_metadata.realizable_slots
+        ]
+        expansions: Dict[int, List[TemplateComponent]] = {}
+        expanded_messages: Dict[int, Message] = {}
+        while worklist:
+            produced: List[Tuple[Message, Slot]] = []
+            for message, slot in worklist:
+                log.debug("Visiting slot {}".format(slot))
+                components = self._realize_slot(context, table, slot)
+                if len(components) == 1 and components[0] is slot:
                     continue
-                modified_components = self._realize_slot(language, child)
-                if modified_components != [child]:
-                    any_modified = True
-                this.children[idx : idx + 1] = modified_components
-                idx += len(modified_components)
-            return any_modified
-
-    def _realize_slot(self, language: str, slot: Slot) -> List[TemplateComponent]:
-        for slot_realizer in self._registry.get("slot-realizers"):
-            assert isinstance(slot_realizer, SlotRealizerComponent)
-            if language in slot_realizer.supported_languages() or "ANY" in slot_realizer.supported_languages():
-                success, components = slot_realizer.realize(slot, self._random)
+                expansions[id(slot)] = components
+                expanded_messages[id(message)] = message
+                produced.extend((message, component) for component in components if isinstance(component, Slot))
+            worklist = produced
+
+        for message in expanded_messages.values():
+            message.children[:] = self._expand(message.children, expansions)
+            message.template.update_slot_metadata()
+
+    def _expand(
+        self, components: List[TemplateComponent], expansions: Dict[int, List[TemplateComponent]]
+    ) -> List[TemplateComponent]:
+        expanded: List[TemplateComponent] = []
+        for component in components:
+            replacement = expansions.get(id(component))
+            if replacement is None:
+                expanded.append(component)
+            else:
+                expanded.extend(self._expand(replacement, expansions))
+        return expanded
+
+    def _realize_slot(self, context: RunContext, table: "SlotRealizerTable", slot: Slot) -> List[TemplateComponent]:
+        components = table.realize(slot, context.random)
+        if components is not None:
+            return components
+        log.debug("Unable to realize slot {} in language {} with any realizer".format(slot, table.language))
+        return [slot]
+
+
+class SlotRealizerTable(object):
+    """
+    The slot realizers of a single language, indexed by the tag they realize.
+
+    Most realizers can only realize slots that contain a specific "[Name:...]" tag, so there is no point in trying them
+    on any other slots. For each slot, only the realizers of the tags the slot contains and the realizers that do not
+    declare a tag are tried, in their original order.
+    """
+
+    # Cached in place of the realizations of slots that can not be realized
+    UNREALIZABLE = "UNREALIZABLE"
+
+    def __init__(
+        self, realizers: Sequence["SlotRealizerComponent"], language: str = None, cache: Optional[LRUCache] = None
+    ) -> None:
+        """
+        :param realizers: the realizers, in order of priority
+        :param language: the language of the realizers, used to key the cache
+        :param cache: cache for the realizations of slots, can be shared between the tables of different languages
+        """
+        self.language = language
+        self.cache = cache
+        self.realizers = list(realizers)
+        self._tagged: Dict[str, List[Tuple[int, SlotRealizerComponent]]] = defaultdict(list)
+        self._untagged: List[Tuple[int, SlotRealizerComponent]] = []
+        for position, realizer in enumerate(realizers):
+            assert isinstance(realizer, SlotRealizerComponent)
+            tag = realizer.tag()
+            if tag is None:
+                self._untagged.append((position, realizer))
+            else:
+                self._tagged[tag].append((position, realizer))
+        self._tagged = dict(self._tagged)
+
+    @staticmethod
+    def for_language(
+        realizers: Iterable["SlotRealizerComponent"], language: str, cache: Optional[LRUCache] = None
+    ) -> "SlotRealizerTable":
+        return SlotRealizerTable(
+            [
+                realizer
+                for realizer in realizers
+                if language in realizer.supported_languages() or "ANY" in realizer.supported_languages()
+            ],
+            language,
+            cache,
+        )
+
+    def realize(self, slot: Slot, random: Generator) -> Optional[List[TemplateComponent]]:
+        """
+        Realize the slot with the first realizer able to realize it. Returns None if none of them is.
+
+        The alternative realizations of a slot depend only on its value and attributes for most realizers, so they are
+        cached and shared between slots with the same value and attributes. The PRNG still chooses between them anew for
+        each slot.
+        """
+        key = self._cache_key(slot)
+        if key is not None:
+            realizations = self.cache.get(key)
+            if realizations is self.UNREALIZABLE:
+                return None
+            if realizations is not None:
+                return realizations[random.integers(len(realizations))].apply(slot)
+
+        for realizer in self.candidates(slot):
+            if not realizer.cacheable():
+                # The result might depend on more than the value and the attributes of the slot
+                key = None
+                success, components = realizer.realize(slot, random)
                 if success:
                     return components
-        log.debug("Unable to realize slot {} in language {} with any realizer".format(slot, language))
-        return [slot]
+                continue
+            realizations = realizer.realizations(slot)
+            if realizations is not None:
+                if key is not None:
+                    self.cache.put(key, realizations)
+                return realizations[random.integers(len(realizations))].apply(slot)
+
+        if key is not None:
+            self.cache.put(key, self.UNREALIZABLE)
+        return None
+
+    def _cache_key(self, slot: Slot) -> Optional[Hashable]:
+        if self.cache is None:
+            return None
+        key = (self.language, slot.value, frozenset(slot.attributes.items()))
+        try:
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
+    def candidates(self, slot: Slot) -> Iterator["SlotRealizerComponent"]:
+        value = slot.value
+        buckets = []
+        if isinstance(value, FactParameters):
+            # Both the typed realizers of the task and the regex realizers of its legacy string form are tagged by it
+            buckets = [self._tagged[value.name]] if value.name in self._tagged else []
+        elif isinstance(value, str) and self._tagged:
+            buckets = [self._tagged[tag] for tag in find_tags(value) if tag in self._tagged]
+        if not buckets:
+            return (realizer for _, realizer in self._untagged)
+        return (realizer for _, realizer in heapq.merge(self._untagged, *buckets, key=lambda entry: entry[0]))
 
 
 class SlotRealizerComponent(ABC):
@@ -74,11 +276,70 @@ class SlotRealizerComponent(ABC):
     def realize(self, slot: Slot, random: Generator) -> Tuple[bool, List[TemplateComponent]]:
         pass
 
+    def tag(self) -> Optional[str]:
+        """
+        The name of the "[Name:...]" tag that a slot must contain for this realizer to be able to realize it, or None
+        if the realizer might realize any slot.
+        """
+        return None
+
+    def draws_random(self) -> bool:
+        """
+        Whether realize() might draw from the PRNG, i.e. choose between alternative realizations. Stages that draw from
+        the PRNG after template selection change the order of the draws when the stages are fused.
+        """
+        return True
+
+    def cacheable(self) -> bool:
+        """
+        Whether the realizations() of a slot depend only on the value and the attributes of the slot, in which case they
+        can be cached and reused for other slots with the same value and attributes.
+        """
+        return False
+
+    def realizations(self, slot: Slot) -> Optional[List["Realization"]]:
+        """
+        All the alternative ways of realizing the slot, one of which realize() chooses at random, or None if this
+        realizer is unable to realize the slot. Must be implemented by realizers that are cacheable().
+        """
+        raise NotImplementedError
+
+
+class Realization(object):
+    """
+    A realization of a slot as a sequence of tokens. Each token becomes a copy of the realized slot, which keeps the
+    attributes of the realized slot only if its index is in attach_attributes_to.
+    """
+
+    def __init__(self, tokens: Sequence[str], attach_attributes_to: FrozenSet[int] = frozenset()) -> None:
+        self.tokens = tuple(tokens)
+        self.attach_attributes_to = attach_attributes_to
+
+    def apply(self, slot: Slot) -> List[TemplateComponent]:
+        components: List[TemplateComponent] = []
+        for idx, token in enumerate(self.tokens):
+            new_slot = slot.copy(include_fact=True)
+
+            # By default, copy copies the attributes too. In case attach_attributes_to was set,
+            # we need to explicitly reset the attributes for all those slots NOT explicitly mentioned
+            if idx not in self.attach_attributes_to:
+                new_slot.attributes = {}
+
+            new_slot.value = LiteralSource(token)
+            components.append(new_slot)
+        return components
+
+    def __str__(self) -> str:
+        return " ".join(self.tokens)
+
 
 class NumberRealizer(SlotRealizerComponent):
     def supported_languages(self) -> List[str]:
         return ["ANY"]
 
+    def draws_random(self) -> bool:
+        return False
+
     def realize(self, slot: Slot, random: Generator) -> Tuple[bool, List[TemplateComponent]]:
         if not isinstance(slot.value, Number):
             return False, []
@@ -96,10 +357,13 @@ class RegexRealizer(SlotRealizerComponent):
         group_requirements: Optional[Callable[..., bool]] = None,
         slot_requirements: Optional[Callable[[Slot], bool]] = None,
         attach_attributes_to: Optional[Iterable[int]] = None,
+        tag: Optional[str] = None,
     ) -> None:
         self.registry = registry
         self.languages = languages if isinstance(languages, list) else [languages]
         self.regex = regex
+        self._tag = tag
+        self._pattern = re.compile(regex)
         self.extracted_groups = extracted_groups if isinstance(extracted_groups, Iterable) else [extracted_groups]
         self.templates = [template] if isinstance(template, str) else template
         self.group_requirements = group_requirements
@@ -109,46 +373,108 @@ class RegexRealizer(SlotRealizerComponent):
     def supported_languages(self) -> List[str]:
         return self.languages
 
+    def tag(self) -> Optional[str]:
+        if self._tag is not None:
+            return self._tag
+        match = REGEX_TAG.match(self.regex)
+        return match.group(1) if match else None
+
+    def cacheable(self) -> bool:
+        return self.slot_requirements is None
+
+    def draws_random(self) -> bool:
+        return len(self.templates) > 1
+
     def realize(self, slot: Slot, random: Generator) -> Tuple[bool, List[TemplateComponent]]:
-        # We can only parse the slot contents with a regex if the slot contents are a string
-        if not isinstance(slot.value, str):
+        realizations = self.realizations(slot)
+        if realizations is None:
             return False, []
 
-        match = re.fullmatch(self.regex, slot.value)
+        realization = realizations[random.integers(len(realizations))]
+        log.debug("Realization: {}".format(realization))
+        return True, realization.apply(slot)
+
+    def realizations(self, slot: Slot) -> Optional[List[Realization]]:
+        # We can only parse the slot contents with a regex if the slot contents are a string, or have a string form
+        value = slot.value
+        if isinstance(value, FactParameters):
+            value = str(value)
+        elif not isinstance(value, str):
+            return None
+
+        match = self._pattern.fullmatch(value)
 
         if not match:
-            return False, []
+            return None
 
         groups = [match.group(i) for i in self.extracted_groups]
 
         # Check that the requirements placed on the groups are fulfilled
         if self.group_requirements is not None and not self.group_requirements(*groups):
-            return False, []
+            return None
 
         # Check that the requirements placed on the slot are fulfilled
         if self.slot_requirements is not None and not self.slot_requirements(slot):
-            return False, []
+            return None
 
-        template = random.choice(self.templates)
-        log.info("Template: {}".format(template))
+        attach_attributes_to = frozenset(self.attach_attributes_to)
+        return [Realization(template.format(*groups).split(), attach_attributes_to) for template in self.templates]
 
-        string_realization = template.format(*groups)
-        log.info("String realization: {}".format(string_realization))
 
-        components = []
-        for idx, realization_token in enumerate(string_realization.split()):
-            new_slot = slot.copy(include_fact=True)
+class TypedRealizer(SlotRealizerComponent):
+    """
+    Realizes slots whose value is the FactParameters of a task, by formatting the templates with the fields of the
+    parameters by name. Unlike a RegexRealizer, nothing needs to be parsed out of a string, so field values may contain
+    any characters.
+    """
 
-            # By default, copy copies the attributes too. In case attach_attributes_to was set,
-            # we need to explicitly reset the attributes for all those slots NOT explicitly mentioned
-            if idx not in self.attach_attributes_to:
-                new_slot.attributes = {}
+    def __init__(
+        self,
+        registry: Registry,
+        languages: Union[str, List[str]],
+        name: str,
+        template: Union[str, Iterable[str]],
+        field_requirements: Optional[Callable[[Dict[str, Any]], bool]] = None,
+        attach_attributes_to: Optional[Iterable[int]] = None,
+    ) -> None:
+        self.registry = registry
+        self.languages = languages if isinstance(languages, list) else [languages]
+        self.name = name
+        self.templates = [template] if isinstance(template, str) else template
+        self.field_requirements = field_requirements
+        self.attach_attributes_to = attach_attributes_to if attach_attributes_to is not None else []
 
-            # An ugly hack that ensures the lambda correctly binds to the value of realization_token at this
-            # time. Without this, all the lambdas bind to the final value of the realization_token variable, ie.
-            # the final value at the end of the loop.  See https://stackoverflow.com/a/10452819
-            new_slot.value = lambda f, realization_token=realization_token: realization_token
-            components.append(new_slot)
-        log.info("Components: {}".format([str(c) for c in components]))
+    def supported_languages(self) -> List[str]:
+        return self.languages
+
+    def tag(self) -> Optional[str]:
+        return self.name
+
+    def cacheable(self) -> bool:
+        return True
+
+    def draws_random(self) -> bool:
+        return len(self.templates) > 1
+
+    def realize(self, slot: Slot, random: Generator) -> Tuple[bool, List[TemplateComponent]]:
+        realizations = self.realizations(slot)
+        if realizations is None:
+            return False, []
+
+        realization = realizations[random.integers(len(realizations))]
+        log.debug("Realization: {}".format(realization))
+        return True, realization.apply(slot)
+
+    def realizations(self, slot: Slot) -> Optional[List[Realization]]:
+        value = slot.value
+        if not isinstance(value, FactParameters) or value.name != self.name:
+            return None
+
+        # Check that the requirements placed on the fields are fulfilled
+        if self.field_requirements is not None and not self.field_requirements(value.fields):
+            return None
 
-        return True, components
+        attach_attributes_to = frozenset(self.attach_attributes_to)
+        return [
+            Realization(template.format(**value.fields).split(), attach_attributes_to) for template in self.templates
+        ]
@@ -24,3 +24,6 @@ class Registry(object):
             raise UnknownComponentException("No component named '{}'".format(name))
         else:
             return self._registry[name]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._registry
@@ -1,16 +1,17 @@
 import logging
 import re
+from typing import Dict, Iterable, List, Optional, Tuple
 
 from numpy import random
 
-from .models import DocumentPlanNode
-from .pipeline import NLGPipelineComponent
+from .models import DocumentPlanNode, Message, Template, TemplateComponent
+from .pipeline import MessageStage, RunContext
 from .registry import Registry
 
 log = logging.getLogger("root")
 
 
-class SurfaceRealizer(NLGPipelineComponent):
+class SurfaceRealizer(MessageStage):
     """
     Realizes a DocumentPlan as surface text.
 
@@ -52,34 +53,96 @@ class SurfaceRealizer(NLGPipelineComponent):
         Run this pipeline component.
         """
         log.info("Realizing to text")
+        static_sentences = registered_static_sentences(registry, language)
         sequences = [c for c in document_plan.children]
-        paragraphs = [self.realize(s) for s in sequences]
-        output = ""
-        for p in paragraphs:
-            output += self.paragraph_start + p + self.paragraph_end
-        return output
+        paragraphs = [self.realize(s, static_sentences) for s in sequences]
+        return self._join_paragraphs(paragraphs)
 
-    def realize(self, sequence: DocumentPlanNode) -> str:
+    def start(self, context: RunContext, document_plan: DocumentPlanNode) -> Tuple[Dict[Template, str], Dict[int, str]]:
+        log.info("Realizing to text")
+        return registered_static_sentences(context.registry, context.language), {}
+
+    def run_message(
+        self, context: RunContext, state: Tuple[Dict[Template, str], Dict[int, str]], message: Message
+    ) -> None:
+        static_sentences, sentences = state
+        sentences[id(message)] = self.realize_sentence(message, static_sentences)
+
+    def finish(
+        self, context: RunContext, state: Tuple[Dict[Template, str], Dict[int, str]], document_plan: DocumentPlanNode
+    ) -> str:
+        paragraphs = [self.finish_paragraph(context, state, sequence) for sequence in document_plan.children]
+        return self.join_paragraphs(context, paragraphs)
+
+    def finish_paragraph(
+        self, context: RunContext, state: Tuple[Dict[Template, str], Dict[int, str]], paragraph: DocumentPlanNode
+    ) -> str:
+        # The sentences of a paragraph are only needed once, so that streaming holds just the current paragraph
+        _, sentences = state
+        return self._join_sentences(sentences.pop(id(message)) for message in paragraph.children)
+
+    def join_paragraphs(self, context: RunContext, paragraphs: List[str]) -> str:
+        return self._join_paragraphs(paragraphs)
+
+    def realize(self, sequence: DocumentPlanNode, static_sentences: Optional[Dict[Template, str]] = None) -> str:
         """Realizes a single paragraph."""
-        output = ""
-        for message in sequence.children:
-            template = message.template
-            component_values = [str(component.value) for component in template.components]
-
-            sent = " ".join([component_value for component_value in component_values if component_value != ""]).rstrip()
-            # Temp fix: remove extra spaces occurring with braces and sometimes before commas.
-            sent = re.sub(r"\(\s", r"(", sent)
-            sent = re.sub(r"\s\)", r")", sent)
-            sent = re.sub(r"\s,", r",", sent)
-
-            if not sent:
-                if self.fail_on_empty:
-                    raise Exception("Empty sentence in surface realization")
-                else:
-                    continue
+        return self._join_sentences(self.realize_sentence(message, static_sentences) for message in sequence.children)
+
+    def realize_sentence(self, message: Message, static_sentences: Optional[Dict[Template, str]] = None) -> str:
+        """
+        Realizes a single message. Returns an empty string for an empty sentence that is to be skipped.
+
+        If the template of the message has been realized in advance, as found in static_sentences, that text is used.
+        """
+        template = message.template
+        sent = static_sentences.get(template) if static_sentences else None
+        if sent is None:
+            sent = self.realize_text(template.components)
+
+        if not sent:
+            if self.fail_on_empty:
+                raise Exception("Empty sentence in surface realization")
+            else:
+                return ""
+        return self.sentence_start + sent + self.sentence_end
+
+    @staticmethod
+    def realize_text(components: Iterable[TemplateComponent]) -> str:
+        """Realizes the text of a sentence from its template components."""
+        component_values = [str(component.value) for component in components]
+
+        sent = " ".join([component_value for component_value in component_values if component_value != ""]).rstrip()
+        # Temp fix: remove extra spaces occurring with braces and sometimes before commas.
+        sent = re.sub(r"\(\s", r"(", sent)
+        sent = re.sub(r"\s\)", r")", sent)
+        sent = re.sub(r"\s,", r",", sent)
+
+        if sent:
             sent = sent[0].upper() + sent[1:]
-            output += self.sentence_start + sent + self.sentence_end
-        return self.doc_start + output + self.doc_end
+        return sent
+
+    def _join_sentences(self, sentences: Iterable[str]) -> str:
+        return self.doc_start + "".join(sentences) + self.doc_end
+
+    def _join_paragraphs(self, paragraphs: Iterable[str]) -> str:
+        return "".join(self.paragraph_start + p + self.paragraph_end for p in paragraphs)
+
+
+def static_sentences(templates: List[Template]) -> Dict[Template, str]:
+    """
+    Realize the text of each of the templates without slots in advance. Nothing in the pipeline can change the text of
+    such a template, so it is the same every time the template is used.
+    """
+    return {template: SurfaceRealizer.realize_text(template.components) for template in templates if not template.slots}
+
+
+def registered_static_sentences(registry: Registry, language: str) -> Dict[Template, str]:
+    """
+    The static sentences of the language in the registry, or none if the registry has no static sentences.
+    """
+    if "static-sentences" not in registry:
+        return {}
+    return registry.get("static-sentences").get(language, {})
 
 
 class HeadlineHTMLSurfaceRealizer(SurfaceRealizer):
@@ -54,6 +54,11 @@ from .models import (
 
 log = logging.getLogger("root")
 
+# Version of the templates produced by this reader. Caches of read templates are keyed by this and by the source of the
+# reader and of the template models, so it only needs to be increased when a change elsewhere changes the result of
+# reading the same templates.
+TEMPLATE_READER_VERSION = 2
+
 
 def canonical_map(map_dict):
     return dict(
@@ -1,12 +1,26 @@
+import heapq
 import logging
+from collections import defaultdict
 from functools import lru_cache
-from typing import Iterator, List, Tuple
+from typing import Any, Container, Dict, Iterator, List, Optional, Sequence, Tuple
 
 from numpy.random import Generator
 
-from .models import DefaultTemplate, DocumentPlanNode, Message, Template
-from .pipeline import NLGPipelineComponent
+from .models import (
+    DefaultTemplate,
+    DocumentPlanNode,
+    Fact,
+    FactField,
+    FactIndex,
+    Message,
+    Template,
+    TemplateMatch,
+    is_plain_literal,
+    iter_messages,
+)
+from .pipeline import MessageStage, RunContext
 from .registry import Registry
+from .surface_realizer import registered_static_sentences
 
 log = logging.getLogger("root")
 
@@ -15,7 +29,7 @@ log = logging.getLogger("root")
 LOC_IF_NOT_SINCE = 6
 
 
-class TemplateSelector(NLGPipelineComponent):
+class TemplateSelector(MessageStage):
     """
     Adds a matching Template to each Message in the DocumentPlan.
 
@@ -36,10 +50,12 @@ class TemplateSelector(NLGPipelineComponent):
             document_plan.print_tree()
 
         templates = registry.get("templates")[language]
+        template_index = self._template_index(registry, language)
 
-        template_checker = TemplateMessageChecker(templates, all_messages)
+        template_checker = TemplateMessageChecker(templates, all_messages, template_index)
+        static_templates = registered_static_sentences(registry, language)
         log.info("Selecting templates from {} templates".format(len(templates)))
-        self._recurse(random, language, document_plan, all_messages, template_checker)
+        self._recurse(random, language, document_plan, all_messages, template_checker, static_templates)
 
         return (document_plan,)
 
@@ -50,6 +66,7 @@ class TemplateSelector(NLGPipelineComponent):
         this: DocumentPlanNode,
         all_messages: List[Message],
         template_checker: "TemplateMessageChecker",
+        static_templates: Container[Template],
     ) -> None:
         """
         Recursively works through the tree, adding Templates to Messages.
@@ -57,22 +74,92 @@ class TemplateSelector(NLGPipelineComponent):
         # Check all children of this root
         for child in this.children:
             if isinstance(child, Message):
-                templates = list(template_checker.all_templates_for_message(child))
-                if len(templates) == 0:
-                    # If there are no templates, something's gone horribly wrong
-                    # The document planner should have made sure this didn't happen, but the only thing we can
-                    #  at this point is skip the fact
-                    log.error("Found no templates to express {}".format(child))
-                else:
-                    random.shuffle(templates)
-                    template = templates[0]
-                    self._add_template_to_message(child, template, all_messages)
+                self._select_template(random, child, all_messages, template_checker, static_templates)
             else:
                 # This child is NOT a message and we should just recurse
-                self._recurse(random, language, child, all_messages, template_checker)
+                self._recurse(random, language, child, all_messages, template_checker, static_templates)
+
+    def start(
+        self,
+        context: RunContext,
+        document_plan: DocumentPlanNode,
+        all_messages: List[Message],
+        primary_matches: Optional[Dict[Fact, List[Template]]] = None,
+    ) -> Tuple[List[Message], "TemplateMessageChecker", Container[Template]]:
+        templates = context.registry.get("templates")[context.language]
+        template_index = self._template_index(context.registry, context.language)
+        static_templates = registered_static_sentences(context.registry, context.language)
+        log.info("Selecting templates from {} templates".format(len(templates)))
+        template_checker = TemplateMessageChecker(templates, all_messages, template_index, primary_matches)
+        return all_messages, template_checker, static_templates
+
+    def run_batch(
+        self, contexts: Sequence[RunContext], inputs: Sequence[Tuple[DocumentPlanNode, List[Message]]]
+    ) -> List[Any]:
+        """
+        Select the templates for a batch of documents. The templates whose first rule matches a fact are found only once
+        per batch for each distinct main fact of a language, so for each document only the other rules are checked.
+        """
+        log.info("Selecting templates for {} documents".format(len(inputs)))
+        primary_matches: Dict[str, Dict[Fact, List[Template]]] = defaultdict(dict)
+        outputs: List[Any] = []
+        for context, (document_plan, all_messages) in zip(contexts, inputs):
+            try:
+                state = self.start(context, document_plan, all_messages, primary_matches[context.language])
+                for message in iter_messages(document_plan):
+                    self.run_message(context, state, message)
+                outputs.append(self.finish(context, state, document_plan))
+            except Exception as ex:
+                outputs.append(ex)
+        return outputs
+
+    @staticmethod
+    def _template_index(registry: Registry, language: str) -> Optional["TemplateIndex"]:
+        # Without an index, the checker goes through all of the templates as before
+        if "template-index" not in registry:
+            return None
+        return registry.get("template-index").get(language)
+
+    def run_message(
+        self,
+        context: RunContext,
+        state: Tuple[List[Message], "TemplateMessageChecker", Container[Template]],
+        message: Message,
+    ) -> None:
+        all_messages, template_checker, static_templates = state
+        self._select_template(context.random, message, all_messages, template_checker, static_templates)
+
+    def _select_template(
+        self,
+        random: Generator,
+        message: Message,
+        all_messages: List[Message],
+        template_checker: "TemplateMessageChecker",
+        static_templates: Container[Template],
+    ) -> None:
+        matches = list(template_checker.all_matches_for_message(message))
+        if len(matches) == 0:
+            # If there are no templates, something's gone horribly wrong
+            # The document planner should have made sure this didn't happen, but the only thing we can
+            #  at this point is skip the fact
+            log.error("Found no templates to express {}".format(message))
+        else:
+            template, match = matches[random.integers(len(matches))]
+            if template in static_templates:
+                # A template without slots is never modified by the later stages, so it is used as is instead of a copy
+                # and the text realized for it in advance is used by the surface realizer
+                message.template = template
+                message.facts = match.facts
+            else:
+                self._add_template_to_message(message, template, all_messages, match)
 
     @staticmethod
-    def _add_template_to_message(message: Message, template_original: Template, all_messages: List[Message]) -> None:
+    def _add_template_to_message(
+        message: Message,
+        template_original: Template,
+        all_messages: List[Message],
+        match: Optional[TemplateMatch] = None,
+    ) -> None:
         """
         Adds a matching template to a message, also adding the facts used by the template to the message.
 
@@ -80,10 +167,11 @@ class TemplateSelector(NLGPipelineComponent):
         :param template_original: The template to be added to the message.
         :param all_messages: Other available messages, some of which will be needed to match possible secondary rules
                in the template.
+        :param match: The result of checking the message against template_original, if already known
         :return: Nothing
         """
         template = template_original.copy()
-        used_facts = template.fill(message, all_messages)
+        used_facts = template.fill(message, all_messages, match)
         if used_facts:
             log.debug("Successfully linked template to message")
         else:
@@ -101,15 +189,27 @@ class TemplateMessageChecker(object):
     Doesn't actually fill in templates, but just checks, for a given message (and a list of other available messages),
     whether there is a template that can be used to realise it.
 
-    Init with templates taken from the registry for the relevant language.
+    Init with templates taken from the registry for the relevant language. If a TemplateIndex for the same templates
+    is given, only the templates it deems possible for a message are checked. If a primary_matches dictionary is given,
+    the templates whose first rule matches a main fact are stored in it, so that checkers of other documents sharing it
+    do not need to check the first rules again.
 
     The checks are cached on message and location_required.
 
     """
 
-    def __init__(self, templates: List[Template], all_messages: List[Message]) -> None:
+    def __init__(
+        self,
+        templates: List[Template],
+        all_messages: List[Message],
+        index: Optional["TemplateIndex"] = None,
+        primary_matches: Optional[Dict[Fact, List[Template]]] = None,
+    ) -> None:
         self.all_messages = all_messages
         self.templates = templates
+        self.index = index
+        self.primary_matches = primary_matches
+        self.fact_index = FactIndex(all_messages)
         self._cache = {}
 
     @lru_cache(maxsize=1024)
@@ -127,8 +227,95 @@ class TemplateMessageChecker(object):
         return True
 
     def all_templates_for_message(self, message: Message) -> Iterator[Template]:
-        for template in self.templates:
+        for template, _ in self.all_matches_for_message(message):
+            yield template
+
+    def all_matches_for_message(self, message: Message) -> Iterator[Tuple[Template, TemplateMatch]]:
+        candidates = self.index.candidates(message) if self.index is not None else self.templates
+        primary_checked = False
+        if self.primary_matches is not None:
+            try:
+                matching = self.primary_matches.get(message.main_fact)
+            except TypeError:
+                # The fact is not hashable, so its templates can not be shared
+                matching = None
+            else:
+                if matching is None:
+                    matching = [template for template in candidates if template.matches_primary(message.main_fact)]
+                    self.primary_matches[message.main_fact] = matching
+            if matching is not None:
+                candidates = matching
+                primary_checked = True
+
+        for template in candidates:
             # See if the template can express this message (with the help of the other available messages)
-            if template.check(message, self.all_messages):
+            match = template.check(message, self.all_messages, self.fact_index, primary_checked)
+            if match is not None:
                 # Got a matching template: this message can be expressed
-                yield template
+                yield template, match
+
+
+class TemplateIndex(object):
+    """
+    Narrows down the templates that can possibly express a message, so that Template.check() needs to be ran only
+    on a handful of templates instead of all the templates of the language.
+
+    Templates are keyed on a literal equality constraint on the fact name (or, failing that, on the fact type) in
+    their first rule. Templates with no such constraint, e.g. those whose constraints are regexes or refer to other
+    facts, are always returned as candidates.
+
+    The candidates are returned in the same order as they appear in the original list of templates, so using the index
+    does not change which template gets selected.
+    """
+
+    INDEXED_FIELDS = ("name", "type")
+
+    def __init__(self, templates: List[Template]) -> None:
+        self._by_field: Dict[str, Dict[str, List[Tuple[int, Template]]]] = {
+            field: defaultdict(list) for field in self.INDEXED_FIELDS
+        }
+        self._unindexed: List[Tuple[int, Template]] = []
+
+        for position, template in enumerate(templates):
+            key = self._key(template)
+            if key is None:
+                self._unindexed.append((position, template))
+            else:
+                field, value = key
+                self._by_field[field][value].append((position, template))
+
+        # Drop the defaultdict behaviour so that lookups don't insert empty lists
+        self._by_field = {field: dict(buckets) for field, buckets in self._by_field.items()}
+
+        log.debug("Indexed {} templates, {} of which could not be indexed".format(len(templates), len(self._unindexed)))
+
+    @classmethod
+    def _key(cls, template: Template) -> Optional[Tuple[str, str]]:
+        if not template.rules:
+            return None
+        constraints = {
+            matcher.lhs.field_name: matcher.value
+            for matcher in template.rules[0][0]
+            if matcher.op == "="
+            and isinstance(matcher.lhs, FactField)
+            and matcher.lhs.field_name in cls.INDEXED_FIELDS
+            and is_plain_literal(matcher.value)
+        }
+        for field in cls.INDEXED_FIELDS:
+            if field in constraints:
+                return field, constraints[field]
+        return None
+
+    def candidates(self, message: Message) -> Iterator[Template]:
+        """
+        Returns, in their original order, all the templates that might be able to express the message. The templates
+        still need to be checked against the message.
+        """
+        fact = message.main_fact
+        buckets = [self._unindexed]
+        for field in self.INDEXED_FIELDS:
+            bucket = self._by_field[field].get(str(getattr(fact, field)))
+            if bucket:
+                buckets.append(bucket)
+        for _, template in heapq.merge(*buckets, key=lambda entry: entry[0]):
+            yield template
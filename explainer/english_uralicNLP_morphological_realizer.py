@@ -3,43 +3,49 @@ from typing import Dict, Optional
 
 from uralicNLP import uralicApi
 
-from explainer.core.models import Slot
-from explainer.core.morphological_realizer import LanguageSpecificMorphologicalRealizer
+from explainer.core.morphological_realizer import LanguageSpecificMorphologicalRealizer, MorphologyCache
 
 log = logging.getLogger("root")
 
 
 class EnglishUralicNLPMorphologicalRealizer(LanguageSpecificMorphologicalRealizer):
-    def __init__(self):
-        super().__init__("fi")
+    # uralicNLP raises an OSError for missing or unreadable transducers
+    inflection_errors = (OSError, uralicApi.ModelNotFound, uralicApi.UnsupportedModel, uralicApi.HFSTRequired)
+
+    def __init__(self, cache: Optional[MorphologyCache] = None):
+        super().__init__("en", cache)
 
         self.case_map: Dict[str, str] = {"genitive": "GEN"}
 
-    def realize(self, slot: Slot) -> str:
-        case: Optional[str] = slot.attributes.get("case")
-        if case is None:
-            return slot.value
+    def warm_up(self) -> None:
+        # uralicNLP loads the transducers on first use
+        self.inflect("cat", "GEN")
 
-        log.debug("Realizing {} to Finnish")
+    def normalize_case(self, case: str) -> str:
+        normalized = self.case_map.get(case.lower(), case.upper())
+        log.debug("Normalized case {} to {}".format(case, normalized))
+        return normalized
 
-        case = self.case_map.get(case.lower(), case.upper())
-        log.debug("Normalized case {} to {}".format(slot.attributes.get("case"), case))
+    def inflect(self, form: str, case: str) -> str:
+        log.debug("Realizing {} to English".format(form))
 
-        possible_analyses = uralicApi.analyze(slot.value, "eng")
+        possible_analyses = uralicApi.analyze(form, "eng")
         log.debug("Identified {} possible analyses".format(len(possible_analyses)))
         if len(possible_analyses) == 0:
-            log.warning(
-                "No valid morphological analysis for {}, unable to realize despite case attribute".format(slot.value)
-            )
-            return slot.value
+            log.warning("No valid morphological analysis for {}, unable to realize despite case attribute".format(form))
+            return form
 
         analysis = possible_analyses[0][0]
-        log.debug("Picked {} as the morphological analysis of {}".format(analysis, slot.value))
+        log.debug("Picked {} as the morphological analysis of {}".format(analysis, form))
 
         analysis = "{}+{}".format(analysis, case)
         log.debug("Modified analysis to {}".format(analysis))
 
-        modified_value = uralicApi.generate(analysis, "eng")[0][0]
+        generated = uralicApi.generate(analysis, "eng")
+        if len(generated) == 0:
+            log.warning("No form generated for {}, unable to realize despite case attribute".format(analysis))
+            return form
+        modified_value = generated[0][0]
         log.debug("Realized value is {}".format(modified_value))
 
         return modified_value
@@ -11,6 +11,8 @@ log = logging.getLogger("root")
 
 
 class ExplainerDocumentPlanner(DocumentPlanner):
+    language_independent = True
+
     def run(
         self, registry: Registry, random: Generator, language: str, messages: List[Message]
     ) -> Tuple[DocumentPlanNode, List[Message]]:
@@ -29,3 +31,21 @@ class ExplainerDocumentPlanner(DocumentPlanner):
         document_plan.children.append(paragraph)
 
         return (document_plan, messages)
+
+    @staticmethod
+    def extend(document_plan: DocumentPlanNode, appended: DocumentPlanNode) -> int:
+        """
+        Add to document_plan the plan of messages that come after all of its messages, so that the result is the same
+        as if all of the messages had been planned at once. The appended plan is consumed.
+
+        Returns the index of the first paragraph of document_plan that was either added or changed.
+        """
+        paragraphs = appended.children
+        first = len(document_plan.children)
+        # Only a task starts a new paragraph, anything else continues the last paragraph of the document
+        if first > 0 and paragraphs and paragraphs[0].children[0].main_fact.type != "task":
+            document_plan.children[-1].children.extend(paragraphs[0].children)
+            paragraphs = paragraphs[1:]
+            first -= 1
+        document_plan.children.extend(paragraphs)
+        return first
@@ -1,15 +1,21 @@
 import json
 import logging
-from typing import Any, Callable, Dict, List, Tuple, Optional
+from itertools import islice
+from typing import IO, Any, Callable, Dict, List, Tuple, Optional, Union
 
 from numpy.random import Generator
 
 from explainer.core.message_generator import NoMessagesForSelectionException
+from explainer.core.json_stream import iter_json_array
 from explainer.core.models import Fact, Message
 from explainer.core.pipeline import NLGPipelineComponent, Registry
 
 log = logging.getLogger("root")
 
+# The input of the pipeline: the events either as JSON, encoded or not, as a list of already decoded events, or as a
+# list of Events read with read_events()
+EventData = Union[str, bytes, List[Dict[str, Any]], List["Event"]]
+
 
 class Task:
     def __init__(self, name: str, parameters: Dict[str, Any]) -> None:
@@ -45,27 +51,48 @@ class Event:
         return Event(task, reason, int(dict.get("id")))
 
 
+def read_events(stream: IO[Union[bytes, str]]) -> List[Event]:
+    """
+    Read the JSON array of events from a stream, one event at a time, so that neither the JSON nor the decoded events
+    are ever held in memory as a whole. Only the Events are kept.
+    """
+    return [Event.from_dict(event) for event in iter_json_array(stream)]
+
+
+def parse_events(data: EventData) -> List[Event]:
+    """
+    The Events of the data, decoding it first if it is still JSON.
+    """
+    if isinstance(data, (str, bytes, bytearray)):
+        data = json.loads(data)
+    return [event if isinstance(event, Event) else Event.from_dict(event) for event in data]
+
+
 class ExplainerMessageGenerator(NLGPipelineComponent):
-    def run(
-        self, registry: Registry, random: Generator, language: str, data: List[Dict[str, str]]
-    ) -> Tuple[List[Message]]:
+    language_independent = True
+
+    def run(self, registry: Registry, random: Generator, language: str, data: EventData) -> Tuple[List[Message]]:
         """
-        Run this pipeline component.
+        Run this pipeline component. The data is only decoded here if it is still JSON, so callers that have already
+        decoded it should pass the decoded events rather than encode them again.
         """
 
         if not data:
             raise NoMessagesForSelectionException("No data at all!")
 
-        task_parsers: List[Callable[[Event], List[Message]]] = registry.get("task-parsers")
-        reason_parsers: List[Callable[[Event], List[Message]]] = registry.get("reason-parsers")
-        events: List[Event] = [Event.from_dict(event) for event in json.loads(data)]
-        events.sort(key=lambda event: event.id)  # Smaller ID indicates earlier event
+        # Parsers keyed by the names of the tasks and reasons they are able to parse
+        task_parsers: Dict[str, List[Callable[[Event], List[Message]]]] = registry.get("task-parsers")
+        reason_parsers: Dict[str, List[Callable[[Event], List[Message]]]] = registry.get("reason-parsers")
+        events = parse_events(data)
+        # Smaller ID indicates earlier event. Logs usually come in order, in which case there is nothing to sort.
+        if any(later.id < earlier.id for earlier, later in zip(events, islice(events, 1, None))):
+            events.sort(key=lambda event: event.id)
 
         messages: List[Message] = []
 
         for event in events:
             task_generation_succeeded = False
-            for task_parser in task_parsers:
+            for task_parser in task_parsers.get(event.task.name, []) if event.task else []:
                 try:
                     new_messages = task_parser(event)
                     for message in new_messages:
@@ -83,7 +110,7 @@ class ExplainerMessageGenerator(NLGPipelineComponent):
                 log.error("Failed to parse a Message from {}".format(event.task))
 
             reason_generation_succeeded = False
-            for reason_parser in reason_parsers:
+            for reason_parser in reason_parsers.get(event.reason.name, []) if event.reason else []:
                 try:
                     new_messages = reason_parser(event)
                     for message in new_messages:
@@ -1,6 +1,6 @@
 import logging
 import re
-from typing import Tuple
+from typing import Any, Tuple
 
 from numpy.random import Generator
 
@@ -17,12 +17,11 @@ class ExplainerEntityNameResolver(EntityNameResolver):
         # [ENTITY:<group1>:<group2>] where group1 and group2 can contain anything but square brackets or double colon
         self._matcher = re.compile(r"\[ENTITY:([^\]:]*):([^\]]*)\]")
 
-    def is_entity(self, maybe_entity: str) -> bool:
-        # Match and convert the result to boolean
-        try:
-            return self._matcher.fullmatch(maybe_entity) is not None
-        except TypeError:
-            log.error("EntityNameResolver got a number: {} instead of a string".format(maybe_entity))
+    def is_entity(self, maybe_entity: Any) -> bool:
+        # Numbers and structured fact parameters are never entities
+        if not isinstance(maybe_entity, str):
+            return False
+        return self._matcher.fullmatch(maybe_entity) is not None
 
     def parse_entity(self, entity: str) -> Tuple[str, str]:
         groups: Tuple[str, str] = tuple(self._matcher.match(entity).groups())
@@ -1,25 +1,42 @@
 import datetime
+import glob
 import gzip
+import hashlib
 import logging
+import multiprocessing
 import os
 import pickle
 import random
+import sys
+import tempfile
 from collections import defaultdict
-from typing import Callable, Dict, Iterable, List, Optional, Tuple, TypeVar
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import IO, Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, TypeVar, Union
 
 from explainer.constants import CONJUNCTIONS, get_error_message
+from explainer.core import models, realize_slots, template_reader
+from explainer.core.cache import LRUCache
 from explainer.core.document_planner import NoInterestingMessagesException
-from explainer.core.models import Template
-from explainer.core.morphological_realizer import MorphologicalRealizer
+from explainer.core.models import Slot, Template
+from explainer.core.morphological_realizer import MorphologicalRealizer, MorphologyCache
 from explainer.core.pipeline import NLGPipeline, NLGPipelineComponent
-from explainer.core.realize_slots import SlotRealizer
+from explainer.core.realize_slots import SlotRealizer, SlotRealizerTable
 from explainer.core.registry import Registry
-from explainer.core.template_reader import read_templates
-from explainer.core.template_selector import TemplateSelector
+from explainer.core.surface_realizer import static_sentences
+from explainer.core.template_reader import TEMPLATE_READER_VERSION, read_templates
+from explainer.core.template_selector import TemplateIndex, TemplateSelector
 from explainer.english_uralicNLP_morphological_realizer import EnglishUralicNLPMorphologicalRealizer
 from explainer.explainer_document_planner import ExplainerDocumentPlanner
-from explainer.explainer_message_generator import ExplainerMessageGenerator, NoMessagesForSelectionException
+from explainer.explainer_message_generator import (
+    Event,
+    EventData,
+    ExplainerMessageGenerator,
+    NoMessagesForSelectionException,
+    parse_events,
+    read_events,
+)
 from explainer.explainer_named_entity_resolver import ExplainerEntityNameResolver
+from explainer.explainer_session import ExplainerSession, ExplainerSessionStore
 from explainer.explainer_surface_realizer import (
     ExplainerBodySurfaceOrderedRealizer,
     ExplainerBodySurfaceUnorderedRealizer,
@@ -61,19 +78,97 @@ from explainer.resources.unknown_task_resource import UnknownTaskResource
 
 log = logging.getLogger("root")
 
+# The modules whose classes make up the templates, as cached by _load_templates
+TEMPLATE_MODULES = (models, realize_slots, template_reader)
+
+# The services used by the current process when it is a worker of process pools, keyed by the options they were built
+# with, so that the pools of differently configured services never share a service
+_worker_services: Dict[Tuple[Tuple[str, Any], ...], "ExplainerNlgService"] = {}
+
+
+def _worker_service(options: Dict[str, Any]) -> "ExplainerNlgService":
+    key = tuple(sorted(options.items()))
+    if key not in _worker_services:
+        # The templates are read from the cache written by the parent, and the morphological models are loaded on first
+        # use, with the inflections of the template literals found in the persistent cache filled by the parent
+        _worker_services[key] = ExplainerNlgService(warm_up=False, **options)
+    return _worker_services[key]
+
+
+def _init_worker(options: Dict[str, Any]) -> None:
+    # Build the service when the worker starts, rather than on its first job
+    _worker_service(options)
+
+
+def _run_in_worker(options: Dict[str, Any], method: str, *args: Any) -> Any:
+    return getattr(_worker_service(options), method)(*args)
+
 
 class ExplainerNlgService(object):
 
     processor_resources: List[ProcessorResource] = []
 
-    # These are (re)initialized every time run_pipeline is called
-    body_pipeline = None
-    headline_pipeline = None
+    # Output formats with a dedicated surface realizer. Any other format is realized as an unordered list.
+    OUTPUT_FORMATS = ("ol", "ul")
+
+    # Supported values for the concurrency parameter, in addition to None which runs everything in the calling thread
+    CONCURRENCY_MODES = ("thread", "process")
 
-    def __init__(self, random_seed: int = None) -> None:
+    def __init__(
+        self,
+        random_seed: int = None,
+        concurrency: Optional[str] = None,
+        max_workers: int = None,
+        realization_cache_size: int = 4096,
+        morphology_cache_size: int = 4096,
+        morphology_cache_path: Optional[str] = None,
+        fused: bool = False,
+        paragraph_seeding: bool = False,
+        paragraph_cache_size: int = 1024,
+        session_idle_timeout: float = 1800.0,
+        max_sessions: int = 1000,
+        warm_up: bool = True,
+    ) -> None:
         """
         :param random_seed: seed for random number generation, for repeatability
+        :param concurrency: None to run the pipelines in the calling thread, "thread" to run them in a thread pool or
+            "process" to run them in a process pool. Processes are needed to use more than one core, as the pipelines
+            are CPU-bound and hold the GIL.
+        :param max_workers: size of the worker pool, defaults to the number of cores
+        :param realization_cache_size: number of distinct slots whose realizations are cached between requests
+        :param morphology_cache_size: number of inflected forms cached in memory
+        :param morphology_cache_path: path of an sqlite database in which to also cache the inflected forms, can be
+            shared between all the workers on a host. If given, the cased literals of the templates are inflected into
+            it at startup.
+        :param fused: run the stages of the pipelines that process one message at a time as a single pass over the
+            messages, instead of one stage after another. Ignored if any of the slot realizers has alternative
+            realizations.
+        :param paragraph_seeding: realize each paragraph with a PRNG seeded from its facts, and cache the realized
+            paragraphs, so that documents sharing events only need to realize the new ones. Changes the output, and is
+            ignored if any of the templates has more than one rule.
+        :param paragraph_cache_size: number of realized paragraphs cached when paragraph_seeding is on, or by sessions
+        :param session_idle_timeout: seconds after which an unused session is closed
+        :param max_sessions: number of sessions that can be open at once, opening more closes the least recently used
+        :param warm_up: load the morphological models at startup, and inflect the template literals into the persistent
+            morphology cache. Off in the workers of a process pool, which leave that to the service that started them.
         """
+        # Everything but the pool itself, for building identical services in the workers of a process pool
+        self._worker_options: Dict[str, Any] = {
+            "random_seed": random_seed,
+            "realization_cache_size": realization_cache_size,
+            "morphology_cache_size": morphology_cache_size,
+            "morphology_cache_path": morphology_cache_path,
+            "fused": fused,
+            "paragraph_seeding": paragraph_seeding,
+            "paragraph_cache_size": paragraph_cache_size,
+            "session_idle_timeout": session_idle_timeout,
+            "max_sessions": max_sessions,
+        }
+
+        if concurrency is not None and concurrency not in self.CONCURRENCY_MODES:
+            raise ValueError(
+                "Unknown concurrency mode {}, expected one of {}".format(concurrency, self.CONCURRENCY_MODES)
+            )
 
         # New registry and result importer
         self.registry = Registry()
@@ -118,23 +213,42 @@ class ExplainerNlgService(object):
             TrackNameSentimentResource(),
         ]
 
-        # Templates
+        # Templates, cached under a name derived from the template definitions so that a changed definition can never
+        # be served from the cache
         self.registry.register(
             "templates",
-            self._get_cached_or_compute("../data/templates.cache", self._load_templates, force_cache_refresh=True),
+            self._get_cached_or_compute(
+                "../data/templates-{}.cache".format(self._templates_digest()),
+                self._load_templates,
+                prune_pattern="templates-*.cache",
+            ),
+        )
+
+        # Templates, indexed by the facts they can express
+        self.registry.register(
+            "template-index",
+            {language: TemplateIndex(templates) for language, templates in self.registry.get("templates").items()},
+        )
+
+        # Text of the templates without slots, realized in advance
+        self.registry.register(
+            "static-sentences",
+            {language: static_sentences(templates) for language, templates in self.registry.get("templates").items()},
         )
 
         # Misc language data
         self.registry.register("CONJUNCTIONS", CONJUNCTIONS)
 
-        # Task and Reason parsers
-        self.registry.register("task-parsers", [])
-        self.registry.register("reason-parsers", [])
+        # Task and Reason parsers, keyed by the names of the tasks and reasons they parse
+        self.registry.register("task-parsers", defaultdict(list))
+        self.registry.register("reason-parsers", defaultdict(list))
         for resource in self.processor_resources:
             if isinstance(resource, TaskResource):
-                self.registry.get("task-parsers").append(resource.parse_task)
+                for task_name in resource.task_names():
+                    self.registry.get("task-parsers")[task_name].append(resource.parse_task)
             if isinstance(resource, ReasonResource):
-                self.registry.get("reason-parsers").append(resource.parse_reason)
+                for reason_name in resource.reason_names():
+                    self.registry.get("reason-parsers")[reason_name].append(resource.parse_reason)
 
         # PRNG seed
         self._set_seed(seed_val=random_seed)
@@ -145,10 +259,91 @@ class ExplainerNlgService(object):
             components = [component(self.registry) for component in processor_resource.slot_realizer_components()]
             self.registry.get("slot-realizers").extend(components)
 
+        # Slot Realizers of each language, indexed by the tags they realize and sharing a cache of realizations
+        self.registry.register("slot-realization-cache", LRUCache(realization_cache_size))
+        self.registry.register(
+            "slot-realizer-table",
+            {
+                language: SlotRealizerTable.for_language(
+                    self.registry.get("slot-realizers"), language, self.registry.get("slot-realization-cache")
+                )
+                for language in self.registry.get("templates")
+            },
+        )
+
+        # The language-specific morphological realizers are expensive to construct, so they are shared by all pipelines
+        self.morphology_cache = MorphologyCache(morphology_cache_size, morphology_cache_path)
+        self.morphological_realizers = {
+            "fi": FinnishUralicNLPMorphologicalRealizer(self.morphology_cache),
+            "en": EnglishUralicNLPMorphologicalRealizer(self.morphology_cache),
+        }
+        if warm_up:
+            warmed_up = self._warm_up_morphology()
+            # Without a persistent cache, the inflections would only live as long as this process, so they are not worth
+            # computing in advance
+            if morphology_cache_path is not None:
+                self._prepopulate_morphology_cache(warmed_up)
+
+        # Pipelines are built once and hold no per-run state, so they can be shared between concurrent requests
+        self.pipelines: Dict[str, NLGPipeline] = {
+            output_format: NLGPipeline(self.registry, *self._get_components(output_format))
+            for output_format in self.OUTPUT_FORMATS
+        }
+
+        # Fused stages only give the same output as staged ones if no stage after template selection draws from the
+        # PRNG, which slot realizers choosing between alternative realizations would
+        self.fused = fused and not any(realizer.draws_random() for realizer in self.registry.get("slot-realizers"))
+        if fused and not self.fused:
+            log.warning("Some slot realizers have alternative realizations, not fusing the stages of the pipelines")
+
+        # Paragraphs can only be realized independently of each other if template selection does not look at the
+        # messages of other paragraphs, which only templates with secondary rules do
+        self.paragraphs_independent = not any(
+            len(template.rules) > 1 for templates in self.registry.get("templates").values() for template in templates
+        )
+        self.paragraph_seeding = paragraph_seeding and self.paragraphs_independent
+        if paragraph_seeding and not self.paragraphs_independent:
+            log.warning("Some templates have more than one rule, not realizing paragraphs independently")
+        self.paragraph_cache = LRUCache(paragraph_cache_size)
+
+        # Incremental explanation sessions
+        self.sessions = ExplainerSessionStore(session_idle_timeout, max_sessions)
+
+        # Worker pool
+        self.concurrency = concurrency
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self._executor: Optional[Executor] = None
+        if concurrency == "thread":
+            log.info("Running pipelines in a pool of {} threads".format(self.max_workers))
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        elif concurrency == "process":
+            log.info("Running pipelines in a pool of {} processes".format(self.max_workers))
+            # The workers must use the seed chosen here, not choose their own
+            self._worker_options["random_seed"] = self.registry.get("seed")
+            if sys.version_info >= (3, 7):
+                # Forking a process that runs other threads, as uwsgi workers with threads do, can deadlock the child on
+                # locks held by those threads, so the workers are started from a clean process instead
+                start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context(start_method),
+                    initializer=_init_worker,
+                    initargs=(self._worker_options,),
+                )
+            else:
+                # Python 3.6 can neither choose the start method of a pool nor initialize its workers, so the workers
+                # are forked and build their service on their first job
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+
     T = TypeVar("T")
 
     def _get_cached_or_compute(
-        self, cache: str, compute: Callable[..., T], force_cache_refresh: bool = False, relative_path: bool = True
+        self,
+        cache: str,
+        compute: Callable[..., T],
+        force_cache_refresh: bool = False,
+        relative_path: bool = True,
+        prune_pattern: Optional[str] = None,
     ) -> T:  # noqa: F821 -- Needed until https://github.com/PyCQA/pyflakes/issues/427 reaches a release
         if relative_path:
             cache = os.path.abspath(os.path.join(os.path.dirname(__file__), cache))
@@ -156,18 +351,67 @@ class ExplainerNlgService(object):
             log.info("force_cache_refresh is True, deleting previous cache from {}".format(cache))
             if os.path.exists(cache):
                 os.remove(cache)
-        if not os.path.exists(cache):
+        if os.path.exists(cache):
+            log.info("Found cache at {}, decompressing and loading".format(cache))
+            try:
+                with gzip.open(cache, "rb") as f:
+                    return pickle.load(f)
+            except Exception as ex:
+                log.warning("Failed to load cache from {}, computing: {}".format(cache, ex))
+        else:
             log.info("No cache at {}, computing".format(cache))
-            result = compute()
-            if not os.path.exists(os.path.dirname(cache)):
-                os.makedirs(os.path.dirname(cache))
-            with gzip.open(cache, "wb") as f:
+        result = compute()
+        os.makedirs(os.path.dirname(cache), exist_ok=True)
+        # Write to a temporary file and move it in place, so that other processes never see a partially written cache
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(cache), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as raw, gzip.GzipFile(fileobj=raw, mode="wb") as f:
                 pickle.dump(result, f)
-            return result
-        else:
-            log.info("Found cache at {}, decompressing and loading".format(cache))
-            with gzip.open(cache, "rb") as f:
-                return pickle.load(f)
+            # mkstemp creates the file readable by its owner only, give it the permissions a new file would normally get
+            umask = os.umask(0)
+            os.umask(umask)
+            os.chmod(temp_path, 0o666 & ~umask)
+            os.replace(temp_path, cache)
+        except Exception:
+            os.remove(temp_path)
+            raise
+        if prune_pattern is not None:
+            self._prune_caches(cache, prune_pattern)
+        return result
+
+    @staticmethod
+    def _prune_caches(cache: str, pattern: str) -> None:
+        """
+        Remove the files in the directory of the cache that match the glob pattern, other than the cache itself.
+        """
+        for path in glob.glob(os.path.join(os.path.dirname(cache), pattern)):
+            if os.path.abspath(path) == os.path.abspath(cache):
+                continue
+            log.info("Removing stale cache {}".format(path))
+            try:
+                os.remove(path)
+            except OSError as ex:
+                log.warning("Failed to remove stale cache {}: {}".format(path, ex))
+
+    def _templates_digest(self) -> str:
+        """
+        A digest of everything that determines the result of _load_templates. Besides the template definitions, this
+        includes the source of the modules defining the classes of the pickled templates, so that a change to them can
+        never load objects of their old versions.
+        """
+        digest = hashlib.sha256("reader-version:{}".format(TEMPLATE_READER_VERSION).encode("utf-8"))
+        for module in TEMPLATE_MODULES:
+            with open(module.__file__, "rb") as f:
+                source = f.read()
+            digest.update(b"\0")
+            digest.update(hashlib.sha256(source).digest())
+        for resource in self.processor_resources:
+            templates_string = resource.templates_string().encode("utf-8")
+            digest.update(b"\0")
+            digest.update(str(len(templates_string)).encode("utf-8"))
+            digest.update(b"\0")
+            digest.update(templates_string)
+        return digest.hexdigest()
 
     def _load_templates(self) -> Dict[str, List[Template]]:
         log.info("Loading templates")
@@ -177,6 +421,48 @@ class ExplainerNlgService(object):
                 templates[language].extend(new_templates)
         return templates
 
+    def _warm_up_morphology(self) -> List[str]:
+        """
+        Load the morphological models now rather than on the first request that needs them. As this happens before uwsgi
+        forks its workers, they share the loaded models copy-on-write. The workers of a process pool load their own
+        when they start.
+
+        Returns the languages whose models were loaded.
+        """
+        warmed_up = []
+        for language, realizer in self.morphological_realizers.items():
+            start_time = datetime.datetime.now().timestamp()
+            try:
+                realizer.warm_up()
+            except Exception as ex:
+                log.exception("Failed to warm up the morphological realizer for {}: {}".format(language, ex))
+                continue
+            end_time = datetime.datetime.now().timestamp()
+            log.info(
+                "Warmed up the morphological realizer for {} in {} seconds".format(language, end_time - start_time)
+            )
+            warmed_up.append(language)
+        return warmed_up
+
+    def _prepopulate_morphology_cache(self, languages: Iterable[str]) -> None:
+        """
+        Inflect the cased literal slots of the templates of the languages in advance, as their values are known before
+        any request, and store them in the morphology cache.
+        """
+        for language in languages:
+            realizer = self.morphological_realizers.get(language)
+            templates = self.registry.get("templates").get(language)
+            if realizer is None or templates is None:
+                continue
+            for template in templates:
+                for component in template.components:
+                    if (
+                        isinstance(component, Slot)
+                        and "case" in component.attributes
+                        and component.slot_type == "literal"
+                    ):
+                        realizer.realize(component)
+
     def _get_components(self, realizer: str) -> Iterable[NLGPipelineComponent]:
         yield ExplainerMessageGenerator()
         yield ExplainerDocumentPlanner()
@@ -184,46 +470,293 @@ class ExplainerNlgService(object):
         yield SlotRealizer()
         yield ExplainerEntityNameResolver()
 
-        yield MorphologicalRealizer(
-            {"fi": FinnishUralicNLPMorphologicalRealizer(), "en": EnglishUralicNLPMorphologicalRealizer()}
-        )
+        yield MorphologicalRealizer(self.morphological_realizers)
 
         if realizer == "ol":
             yield ExplainerBodySurfaceOrderedRealizer()
         else:
             yield ExplainerBodySurfaceUnorderedRealizer()
 
-    def run_pipeline(self, language: str, output_format: str, data: str) -> Tuple[str, Optional[str]]:
+    def _get_pipeline(self, output_format: str) -> NLGPipeline:
+        return self.pipelines.get(output_format, self.pipelines["ul"])
+
+    def run_pipeline(self, language: str, output_format: str, data: EventData) -> Tuple[str, Optional[str]]:
+        """
+        Generate a report from the data, in the worker pool if the service has one. Safe to call from multiple threads.
+
+        The data is either the JSON encoded list of events, as str or bytes, or the already decoded list of events.
+        """
+        return self._run_in_pool("_run_pipeline", language, output_format, data)
+
+    def run_pipeline_from_stream(
+        self, language: str, output_format: str, stream: IO[Union[bytes, str]]
+    ) -> Tuple[str, Optional[str]]:
+        """
+        Generate a report from a stream of the JSON encoded list of events, as run_pipeline would from the JSON. The
+        events are read one at a time in the calling thread, so that the JSON is never held in memory as a whole, and
+        only the parsed events are handed to the worker pool.
+        """
+        try:
+            events = read_events(stream)
+        except Exception as ex:
+            return self._handle_error(language, ex)
+        return self.run_pipeline(language, output_format, events)
+
+    def run_batch(self, jobs: Sequence[Tuple[str, str, EventData]]) -> List[Tuple[str, Optional[str]]]:
+        """
+        Generate reports for a batch of (language, output_format, data) jobs. The jobs are ran through the pipeline one
+        stage at a time, which lets the stages share work between the documents.
+
+        Returns a (body, error) tuple for each job, in the same order as the jobs and exactly as run_pipeline would.
+        """
+        return self._run_in_pool("_run_batch", list(jobs))
+
+    def run_fanout(
+        self, languages: Sequence[str], output_format: str, data: EventData, parallel: bool = False
+    ) -> Dict[str, Tuple[str, Optional[str]]]:
+        """
+        Generate a report from the same data in multiple languages. The data is parsed and the document planned only
+        once, after which the generation branches into each language. If parallel is True, the languages are generated
+        in parallel threads.
+
+        Returns a (body, error) tuple for each language, exactly as run_pipeline would, keyed by language.
+        """
+        return self._run_in_pool("_run_fanout", list(languages), output_format, data, parallel)
+
+    def stream_pipeline(
+        self, language: str, output_format: str, data: EventData
+    ) -> Iterator[Tuple[str, Optional[str]]]:
+        """
+        Generate a report from the data one paragraph at a time, yielding a (body, error) tuple for each paragraph as
+        soon as it is realized. The bodies of all the paragraphs concatenated are the body run_pipeline would give.
+
+        On error, a last tuple is yielded with the error message as the body, as run_pipeline would give it. Streaming
+        is always ran in the calling thread.
+        """
+        log.info("Starting streaming generation")
+        start_time = datetime.datetime.now().timestamp()
+        pipeline = self._get_pipeline(output_format)
+        seed = self.registry.get("seed")
+
+        log.info("Running NLG pipeline streaming: language={}".format(language))
+        try:
+            if self.paragraph_seeding:
+                paragraphs = (
+                    paragraph
+                    for paragraph, _ in pipeline.realize_paragraphs(
+                        pipeline.plan((data,), language, seed),
+                        language,
+                        seed,
+                        cache=self.paragraph_cache,
+                        cache_namespace=pipeline,
+                    )
+                )
+            else:
+                paragraphs = pipeline.stream((data,), language, seed, fused=self.fused)
+            for paragraph in paragraphs:
+                yield pipeline.join_paragraphs(language, [paragraph]), None
+            log.info("Body pipeline complete")
+        except Exception as ex:
+            yield self._handle_error(language, ex)
+
+        end_time = datetime.datetime.now().timestamp()
+        log.info("Streaming generation complete. Time taken in seconds: {}".format(end_time - start_time))
+
+    def open_session(self, language: str, output_format: str) -> str:
+        """
+        Open a session for explaining a growing event log incrementally, returning its id.
+
+        The paragraphs of a session are realized as with paragraph_seeding, whether or not it is on, so that the
+        existing paragraphs do not change when more events are appended. Sessions live in the memory of this process,
+        and are always ran in the calling thread.
+        """
+        return self.sessions.open(language, output_format).id
+
+    def append_to_session(self, session_id: str, data: EventData) -> Tuple[int, List[str], Optional[str]]:
+        """
+        Append events to a session. Only the new events are parsed and planned, and only the paragraphs they add or
+        change are realized. If an appended event is not newer than all of the previous events, the session is instead
+        rebuilt from all of its events.
+
+        Returns the index of the first paragraph that was added or changed, the realized paragraphs from that index on
+        and an error, if any. On error the session is left as it was. Raises a KeyError for an unknown session.
+        """
+        session = self.sessions.get(session_id)
+        with session.lock:
+            previous_events = list(session.events)
+            try:
+                events = parse_events(data)
+                if not events:
+                    return len(session.paragraphs), [], None
+                if session.last_event_id is not None and min(event.id for event in events) <= session.last_event_id:
+                    log.info("Events out of order in session {}, rebuilding".format(session.id))
+                    events = previous_events + events
+                    session.reset()
+                first = self._extend_session(session, events)
+            except Exception as ex:
+                _, err = self._handle_error(session.language, ex)
+                session.reset()
+                if previous_events:
+                    self._extend_session(session, previous_events)
+                return len(session.paragraphs), [], err
+            return first, session.paragraphs[first:], None
+
+    def get_session_document(self, session_id: str) -> str:
+        """
+        The whole document of a session so far. Raises a KeyError for an unknown session.
+        """
+        session = self.sessions.get(session_id)
+        with session.lock:
+            return self._get_pipeline(session.output_format).join_paragraphs(session.language, session.paragraphs)
+
+    def close_session(self, session_id: str) -> None:
+        """
+        Close a session. Raises a KeyError for an unknown session.
+        """
+        self.sessions.close(session_id)
+
+    def _extend_session(self, session: ExplainerSession, events: List[Event]) -> int:
+        pipeline = self._get_pipeline(session.output_format)
+        seed = self.registry.get("seed")
+
+        document_plan, messages = pipeline.plan((events,), session.language, seed)
+        session.messages.extend(messages)
+        first = ExplainerDocumentPlanner.extend(session.document_plan, document_plan)
+        if not self.paragraphs_independent:
+            first = 0
+
+        realized = pipeline.realize_paragraphs(
+            (session.document_plan, session.messages),
+            session.language,
+            seed,
+            first,
+            session.carried[first - 1] if first > 0 else None,
+            self.paragraph_cache,
+            pipeline,
+        )
+        del session.paragraphs[first:]
+        del session.carried[first:]
+        for paragraph, carried in realized:
+            session.paragraphs.append(paragraph)
+            session.carried.append(carried)
+
+        session.events.extend(events)
+        session.last_event_id = max(event.id for event in session.events)
+        return first
+
+    def _run_in_pool(self, method: str, *args: Any) -> Any:
+        if self._executor is None:
+            return getattr(self, method)(*args)
+        if self.concurrency == "process":
+            future = self._executor.submit(_run_in_worker, self._worker_options, method, *args)
+        else:
+            future = self._executor.submit(getattr(self, method), *args)
+        return future.result()
+
+    def close(self) -> None:
+        """
+        Shut down the worker pool, if any.
+        """
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def _run_pipeline(self, language: str, output_format: str, data: EventData) -> Tuple[str, Optional[str]]:
         log.info("Starting generation")
         start_time = datetime.datetime.now().timestamp()
-        log.info("Configuring Body NLG Pipeline")
-        self.body_pipeline = NLGPipeline(self.registry, *self._get_components(output_format))
-        self.headline_pipeline = NLGPipeline(self.registry, *self._get_components("headline"))
+        pipeline = self._get_pipeline(output_format)
 
         err = None
 
         log.info("Running NLG pipeline: language={}".format(language))
         try:
-            body = self.body_pipeline.run((data,), language, prng_seed=self.registry.get("seed"))
+            if self.paragraph_seeding:
+                body = pipeline.run_by_paragraph(
+                    (data,), language, self.registry.get("seed"), self.paragraph_cache, cache_namespace=pipeline
+                )
+            else:
+                body = pipeline.run((data,), language, prng_seed=self.registry.get("seed"), fused=self.fused)
             log.info("Body pipeline complete")
-        except NoMessagesForSelectionException as ex:
-            log.error("%s", ex)
-            body = get_error_message(language, "no-messages-for-selection")
-            err = "NoMessagesForSelectionException"
-        except NoInterestingMessagesException as ex:
-            log.info("%s", ex)
-            err = "NoInterestingMessagesException"
-            body = get_error_message(language, "no-interesting-messages-for-selection")
         except Exception as ex:
-            log.exception("%s", ex)
-            body = get_error_message(language, "general-error")
-            err = "{}: {}".format(ex.__class__.__name__, str(ex))
+            body, err = self._handle_error(language, ex)
 
         end_time = datetime.datetime.now().timestamp()
         log.info("Generation complete. Time taken in seconds: {}".format(end_time - start_time))
 
         return body, err
 
+    def _run_batch(self, jobs: List[Tuple[str, str, EventData]]) -> List[Tuple[str, Optional[str]]]:
+        if self.paragraph_seeding:
+            # Paragraphs are realized and cached one document at a time
+            return [self._run_pipeline(*job) for job in jobs]
+
+        log.info("Starting batch generation of {} jobs".format(len(jobs)))
+        start_time = datetime.datetime.now().timestamp()
+
+        # Jobs with different output formats need different pipelines, so each format is ran as a batch of its own
+        jobs_by_pipeline: Dict[int, List[int]] = defaultdict(list)
+        for idx, (_, output_format, _) in enumerate(jobs):
+            jobs_by_pipeline[id(self._get_pipeline(output_format))].append(idx)
+
+        results: List[Tuple[str, Optional[str]]] = [None] * len(jobs)
+        for indices in jobs_by_pipeline.values():
+            pipeline = self._get_pipeline(jobs[indices[0]][1])
+            outputs = pipeline.run_batch(
+                [((jobs[idx][2],), jobs[idx][0], self.registry.get("seed")) for idx in indices]
+            )
+            for idx, output in zip(indices, outputs):
+                if isinstance(output, Exception):
+                    results[idx] = self._handle_error(jobs[idx][0], output)
+                else:
+                    results[idx] = (output, None)
+
+        end_time = datetime.datetime.now().timestamp()
+        log.info("Batch generation complete. Time taken in seconds: {}".format(end_time - start_time))
+
+        return results
+
+    def _run_fanout(
+        self, languages: List[str], output_format: str, data: EventData, parallel: bool
+    ) -> Dict[str, Tuple[str, Optional[str]]]:
+        if self.paragraph_seeding:
+            # Paragraphs are realized and cached one document at a time
+            return {language: self._run_pipeline(language, output_format, data) for language in languages}
+
+        log.info("Starting generation for languages {}".format(", ".join(languages)))
+        start_time = datetime.datetime.now().timestamp()
+        pipeline = self._get_pipeline(output_format)
+
+        if parallel and len(languages) > 1:
+            with ThreadPoolExecutor(max_workers=len(languages)) as executor:
+                outputs = pipeline.run_fanout((data,), languages, self.registry.get("seed"), executor)
+        else:
+            outputs = pipeline.run_fanout((data,), languages, self.registry.get("seed"))
+
+        results: Dict[str, Tuple[str, Optional[str]]] = {}
+        for language, output in outputs.items():
+            if isinstance(output, Exception):
+                results[language] = self._handle_error(language, output)
+            else:
+                results[language] = (output, None)
+
+        end_time = datetime.datetime.now().timestamp()
+        log.info("Generation complete. Time taken in seconds: {}".format(end_time - start_time))
+
+        return results
+
+    def _handle_error(self, language: str, ex: Exception) -> Tuple[str, str]:
+        if isinstance(ex, NoMessagesForSelectionException):
+            log.error("%s", ex)
+            return get_error_message(language, "no-messages-for-selection"), "NoMessagesForSelectionException"
+        if isinstance(ex, NoInterestingMessagesException):
+            log.info("%s", ex)
+            return (
+                get_error_message(language, "no-interesting-messages-for-selection"),
+                "NoInterestingMessagesException",
+            )
+        log.exception("%s", ex, exc_info=ex)
+        return get_error_message(language, "general-error"), "{}: {}".format(ex.__class__.__name__, str(ex))
+
     def _set_seed(self, seed_val: Optional[int] = None) -> None:
         log.info("Selecting seed for NLG pipeline")
         if not seed_val:
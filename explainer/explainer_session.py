@@ -0,0 +1,92 @@
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Hashable, List, Optional, Tuple
+
+from explainer.core.models import DocumentPlanNode, Message
+from explainer.explainer_message_generator import Event
+
+log = logging.getLogger("root")
+
+
+class ExplainerSession(object):
+    """
+    The state of an incremental explanation of a growing event log: the events received so far, the messages and the
+    document plan generated from them, and the realized paragraphs together with the state carried over from each of
+    them to the next.
+
+    Appends to a session must hold its lock.
+    """
+
+    def __init__(self, session_id: str, language: str, output_format: str) -> None:
+        self.id = session_id
+        self.language = language
+        self.output_format = output_format
+        self.lock = threading.Lock()
+        self.last_used = time.monotonic()
+        self.reset()
+
+    def reset(self) -> None:
+        self.events: List[Event] = []
+        self.last_event_id: Optional[int] = None
+        self.messages: List[Message] = []
+        self.document_plan = DocumentPlanNode(children=[])
+        self.paragraphs: List[Any] = []
+        self.carried: List[Tuple[Hashable, ...]] = []
+
+
+class ExplainerSessionStore(object):
+    """
+    The open sessions, by id. Sessions that have not been used for idle_timeout seconds are evicted, as is the least
+    recently used session when opening a session would make more than max_sessions open.
+    """
+
+    def __init__(self, idle_timeout: float = 1800.0, max_sessions: int = 1000) -> None:
+        if max_sessions <= 0:
+            raise ValueError("Maximum number of sessions must be positive, got {}".format(max_sessions))
+        self.idle_timeout = idle_timeout
+        self.max_sessions = max_sessions
+        # Ordered from the least recently used to the most recently used
+        self._sessions: "OrderedDict[str, ExplainerSession]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def open(self, language: str, output_format: str) -> ExplainerSession:
+        session = ExplainerSession(uuid.uuid4().hex, language, output_format)
+        with self._lock:
+            self._evict_idle()
+            while len(self._sessions) >= self.max_sessions:
+                _, evicted = self._sessions.popitem(last=False)
+                log.info("Evicting least recently used session {}".format(evicted.id))
+            self._sessions[session.id] = session
+        log.info("Opened session {}".format(session.id))
+        return session
+
+    def get(self, session_id: str) -> ExplainerSession:
+        """
+        Get an open session, marking it as used. Raises a KeyError if there is no such session, or it has expired.
+        """
+        with self._lock:
+            self._evict_idle()
+            session = self._sessions[session_id]
+            session.last_used = time.monotonic()
+            self._sessions.move_to_end(session_id)
+            return session
+
+    def close(self, session_id: str) -> None:
+        with self._lock:
+            del self._sessions[session_id]
+        log.info("Closed session {}".format(session_id))
+
+    def _evict_idle(self) -> None:
+        deadline = time.monotonic() - self.idle_timeout
+        while self._sessions:
+            session = next(iter(self._sessions.values()))
+            if session.last_used > deadline:
+                break
+            log.info("Evicting idle session {}".format(session.id))
+            del self._sessions[session.id]
+
+    def __len__(self) -> int:
+        return len(self._sessions)
@@ -18,6 +18,9 @@ class CrosslingualcomparisonResource(ReasonResource):
     def templates_string(self) -> str:
         return TEMPLATE
 
+    def reason_names(self) -> List[str]:
+        return ["crosslingual comparison"]
+
     def parse_reason(self, event: Event) -> List[Message]:
         task = event.reason
         if not task or task.name != "crosslingual comparison":
@@ -21,6 +21,9 @@ class ExtractBigramsResource(TaskResource):
     def templates_string(self) -> str:
         return TEMPLATE
 
+    def task_names(self) -> List[str]:
+        return ["ExtractBigrams"]
+
     def parse_task(self, event: Event) -> List[Message]:
         task = event.task
         if not task or task.name != "ExtractBigrams":
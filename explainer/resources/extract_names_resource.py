@@ -1,8 +1,8 @@
 import logging
 from typing import List, Type
 
-from explainer.core.models import Fact, Message
-from explainer.core.realize_slots import SlotRealizerComponent, RegexRealizer
+from explainer.core.models import Fact, FactParameters, Message
+from explainer.core.realize_slots import SlotRealizerComponent, TypedRealizer
 from explainer.explainer_message_generator import Event
 from explainer.resources.processor_resource import TaskResource
 
@@ -21,6 +21,9 @@ class ExtractNamesResource(TaskResource):
     def templates_string(self) -> str:
         return TEMPLATE
 
+    def task_names(self) -> List[str]:
+        return ["ExtractNames"]
+
     def parse_task(self, event: Event) -> List[Message]:
         task = event.task
         if not task or task.name != "ExtractNames":
@@ -31,8 +34,13 @@ class ExtractNamesResource(TaskResource):
                 Fact(
                     "task",
                     "ExtractNames",
-                    "[ExtractNames:{}:{}]".format(
-                        event.task.parameters.get("sort_by"), event.task.parameters.get("max_number")
+                    FactParameters(
+                        "ExtractNames",
+                        {
+                            "sort_by": event.task.parameters.get("sort_by"),
+                            "max_number": event.task.parameters.get("max_number"),
+                        },
+                        "[ExtractNames:{sort_by}:{max_number}]",
                     ),
                     event.id,
                 )
@@ -51,29 +59,33 @@ class ExtractNamesResource(TaskResource):
         ]
 
 
-class EnglishExtractNamesParameterRealizer(RegexRealizer):
+def _sorted_by_salience(fields):
+    return fields["sort_by"] == "salience"
+
+
+class EnglishExtractNamesParameterRealizer(TypedRealizer):
     def __init__(self, registry):
         super().__init__(
-            registry, "en", r"\[ExtractNames:salience:([^\]]*)\]", [1], "{} most salient",
+            registry, "en", "ExtractNames", "{max_number} most salient", _sorted_by_salience,
         )
 
 
-class FinnishExtractNamesParameterRealizer(RegexRealizer):
+class FinnishExtractNamesParameterRealizer(TypedRealizer):
     def __init__(self, registry):
         super().__init__(
-            registry, "fi", r"\[ExtractNames:salience:([^\]]*)\]", [1], "{} tärkeintä",
+            registry, "fi", "ExtractNames", "{max_number} tärkeintä", _sorted_by_salience,
         )
 
 
-class GermanExtractNamesParameterRealizer(RegexRealizer):
+class GermanExtractNamesParameterRealizer(TypedRealizer):
     def __init__(self, registry):
         super().__init__(
-            registry, "de", r"\[ExtractNames:salience:([^\]]*)\]", [1], "{} auffälligsten benannten",
+            registry, "de", "ExtractNames", "{max_number} auffälligsten benannten", _sorted_by_salience,
         )
 
 
-class FrenchExtractNamesParameterRealizer(RegexRealizer):
+class FrenchExtractNamesParameterRealizer(TypedRealizer):
     def __init__(self, registry):
         super().__init__(
-            registry, "fr", r"\[ExtractNames:salience:([^\]]*)\]", [1], "Les {} entités nommées les plus saillantes",
+            registry, "fr", "ExtractNames", "Les {max_number} entités nommées les plus saillantes", _sorted_by_salience,
         )
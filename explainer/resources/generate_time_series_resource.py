@@ -22,6 +22,9 @@ class GenerateTimeSeriesResource(TaskResource):
     def templates_string(self) -> str:
         return TEMPLATE
 
+    def task_names(self) -> List[str]:
+        return ["GenerateTimeSeries"]
+
     def parse_task(self, event: Event) -> List[Message]:
         task = event.task
         if not task or task.name != "GenerateTimeSeries":
@@ -18,6 +18,9 @@ class ImpossibleToSplitResource(ReasonResource):
     def templates_string(self) -> str:
         return TEMPLATE
 
+    def reason_names(self) -> List[str]:
+        return ["impossible to split"]
+
     def parse_reason(self, event: Event) -> List[Message]:
         task = event.reason
         if not task or task.name != "impossible to split":
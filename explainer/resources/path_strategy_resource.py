@@ -24,6 +24,9 @@ class PathStrategyResource(ReasonResource):
     def templates_string(self) -> str:
         return TEMPLATE
 
+    def reason_names(self) -> List[str]:
+        return ["path strategy"]
+
     def parse_reason(self, event: Event) -> List[Message]:
         reason = event.reason
         if not reason or reason.name != "path strategy":
@@ -20,12 +20,23 @@ class ProcessorResource(ABC):
 
 
 class TaskResource(ProcessorResource):
+    @abstractmethod
+    def task_names(self) -> List[str]:
+        """Names of the tasks that parse_task() is able to parse. It is only ever called with events of these tasks."""
+        pass
+
     @abstractmethod
     def parse_task(self, event: Event) -> List[Message]:
         pass
 
 
 class ReasonResource(ProcessorResource):
+    @abstractmethod
+    def reason_names(self) -> List[str]:
+        """Names of the reasons that parse_reason() is able to parse. It is only ever called with events of these
+        reasons."""
+        pass
+
     @abstractmethod
     def parse_reason(self, event: Event) -> List[Message]:
         pass
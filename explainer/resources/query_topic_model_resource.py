@@ -1,8 +1,8 @@
 import logging
 from typing import List, Type
 
-from explainer.core.models import Fact, Message
-from explainer.core.realize_slots import RegexRealizer, SlotRealizerComponent
+from explainer.core.models import Fact, FactParameters, Message
+from explainer.core.realize_slots import SlotRealizerComponent, TypedRealizer
 from explainer.explainer_message_generator import Event
 from explainer.resources.processor_resource import TaskResource
 
@@ -22,6 +22,9 @@ class QueryTopicModelResource(TaskResource):
     def templates_string(self) -> str:
         return TEMPLATE
 
+    def task_names(self) -> List[str]:
+        return ["QueryTopicModel"]
+
     def parse_task(self, event: Event) -> List[Message]:
         task = event.task
         if not task or task.name != "QueryTopicModel":
@@ -32,8 +35,13 @@ class QueryTopicModelResource(TaskResource):
                 Fact(
                     "task",
                     "QueryTopicModel",
-                    "[QueryTopicModel:NAME:{}] [QueryTopicModel:TYPE:{}]".format(
-                        task.parameters.get("model_name"), task.parameters.get("model_type")
+                    FactParameters(
+                        "QueryTopicModel",
+                        {
+                            "model_name": task.parameters.get("model_name"),
+                            "model_type": task.parameters.get("model_type"),
+                        },
+                        "[QueryTopicModel:NAME:{model_name}] [QueryTopicModel:TYPE:{model_type}]",
                     ),
                     event.id,
                 )
@@ -41,18 +49,11 @@ class QueryTopicModelResource(TaskResource):
         ]
 
     def slot_realizer_components(self) -> List[Type[SlotRealizerComponent]]:
-        return [EnglishTopicModelTypeRealizer, EnglishTopicModelNameRealizer]
-
-
-class EnglishTopicModelTypeRealizer(RegexRealizer):
-    def __init__(self, registry):
-        super().__init__(
-            registry, "en", r"(.*)\s?\[QueryTopicModel:TYPE:([^\]]*)\]\s?(.*)", (1, 2, 3), "{} of the {} variety {}",
-        )
+        return [EnglishTopicModelRealizer]
 
 
-class EnglishTopicModelNameRealizer(RegexRealizer):
+class EnglishTopicModelRealizer(TypedRealizer):
     def __init__(self, registry):
         super().__init__(
-            registry, "en", r"(.*)\s?\[QueryTopicModel:NAME:([^\]]*)\]\s?(.*)", (1, 2, 3), "{} called {} {}",
+            registry, "en", "QueryTopicModel", "called {model_name} of the {model_type} variety",
         )
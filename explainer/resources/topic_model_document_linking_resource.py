@@ -2,7 +2,7 @@ import logging
 from typing import List, Type
 
 from explainer.core.models import Fact, Message
-from explainer.core.realize_slots import RegexRealizer, SlotRealizerComponent
+from explainer.core.realize_slots import RegexRealizer, SlotRealizerComponent, text_before_tag
 from explainer.explainer_message_generator import Event
 from explainer.resources.processor_resource import TaskResource
 
@@ -22,6 +22,9 @@ class TopicModelDocumentLinkingResource(TaskResource):
     def templates_string(self) -> str:
         return TEMPLATE
 
+    def task_names(self) -> List[str]:
+        return ["TopicModelDocumentLinking"]
+
     def parse_task(self, event: Event) -> List[Message]:
         task = event.task
         if not task or task.name != "TopicModelDocumentLinking":
@@ -49,14 +52,20 @@ class EnglishTopicModelTypeRealizer(RegexRealizer):
         super().__init__(
             registry,
             "en",
-            r"(.*)\s?\[TopicModelDocumentLinking:TYPE:([^\]]*)\]\s?(.*)",
+            text_before_tag("TopicModelDocumentLinking:TYPE:") + r"\[TopicModelDocumentLinking:TYPE:([^\]]*)\]\s?(.*)",
             (1, 2, 3),
             "{} of the {} variety {}",
+            tag="TopicModelDocumentLinking",
         )
 
 
 class EnglishTopicModelNameRealizer(RegexRealizer):
     def __init__(self, registry):
         super().__init__(
-            registry, "en", r"(.*)\s?\[TopicModelDocumentLinking:NAME:([^\]]*)\]\s?(.*)", (1, 2, 3), "{} called {} {}",
+            registry,
+            "en",
+            text_before_tag("TopicModelDocumentLinking:NAME:") + r"\[TopicModelDocumentLinking:NAME:([^\]]*)\]\s?(.*)",
+            (1, 2, 3),
+            "{} called {} {}",
+            tag="TopicModelDocumentLinking",
         )
@@ -22,6 +22,9 @@ class TopicModelDocumentSetComparisonResource(TaskResource):
     def templates_string(self) -> str:
         return TEMPLATE
 
+    def task_names(self) -> List[str]:
+        return ["TopicModelDocsetComparison"]
+
     def parse_task(self, event: Event) -> List[Message]:
         task = event.task
         if not task or task.name != "TopicModelDocsetComparison":
@@ -18,6 +18,9 @@ class UnknownReasonResource(ReasonResource):
     def templates_string(self) -> str:
         return TEMPLATE
 
+    def reason_names(self) -> List[str]:
+        return []
+
     def parse_reason(self, event: Event) -> List[Message]:
         return []
 
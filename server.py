@@ -1,11 +1,12 @@
 import json
 import logging.handlers
 import os
-from typing import Callable, Dict, List, Optional, Tuple
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
 
 import bottle
 from bottle import TEMPLATE_PATH, Bottle, request, response, run
 
+from explainer.explainer_message_generator import EventData
 from explainer.explainer_nlg_service import ExplainerNlgService
 
 #
@@ -35,7 +36,16 @@ log.addHandler(rotating_file_handler)
 # Bottle
 bottle.BaseRequest.MEMFILE_MAX = 10 * 1024 * 1024  # Allow up to 10MBB requests
 app = Bottle()
-service = ExplainerNlgService(random_seed=4551546)
+# Concurrency of the NLG service: unset to run in the request thread, "thread" or "process" to use a worker pool
+service = ExplainerNlgService(
+    random_seed=4551546,
+    concurrency=os.environ.get("EXPLAINER_CONCURRENCY") or None,
+    max_workers=int(os.environ.get("EXPLAINER_MAX_WORKERS", 0)) or None,
+    morphology_cache_path=os.environ.get("EXPLAINER_MORPHOLOGY_CACHE") or None,
+    paragraph_seeding=os.environ.get("EXPLAINER_PARAGRAPH_SEEDING", "").lower() in ("1", "true", "yes"),
+    session_idle_timeout=float(os.environ.get("EXPLAINER_SESSION_IDLE_TIMEOUT", 1800)),
+    max_sessions=int(os.environ.get("EXPLAINER_MAX_SESSIONS", 1000)),
+)
 TEMPLATE_PATH.insert(0, os.path.dirname(os.path.realpath(__file__)) + "/../views/")
 static_root = os.path.dirname(os.path.realpath(__file__)) + "/../static/"
 
@@ -57,18 +67,34 @@ def allow_cors(func: Callable) -> Callable:
     return wrapper
 
 
-def generate(language: str, format: str = None, data: str = None) -> Tuple[str, Optional[str]]:
+def generate(language: str, format: str = None, data: EventData = None) -> Tuple[str, Optional[str]]:
     return service.run_pipeline(language, format, data)
 
 
 @app.route("/api/report/json", method="POST")
 @allow_cors
-def api_generate_json() -> Dict[str, str]:
+def api_generate_json() -> Dict[str, Any]:
     body = json.loads(request.body.read())
-    language = body["language"]
     format = body["format"]
-    data = json.dumps(body["data"])
+    data = body["data"]
+
+    # Generating for a list of languages at once, the response is keyed by language
+    if "languages" in body:
+        languages = body["languages"]
+        if not languages or any(language not in LANGUAGES for language in languages) or format not in FORMATS:
+            response.status = 400
+            return {"error": "unsupported language or format"}
+
+        outputs = service.run_fanout(languages, format, data, parallel=body.get("parallel", False))
+        results = {}
+        for language, (text, err) in outputs.items():
+            output = {"language": language, "body": text}
+            if err:
+                output["error"] = err
+            results[language] = output
+        return {"results": results}
 
+    language = body["language"]
     if language not in LANGUAGES or format not in FORMATS:
         response.status = 400
         return {"error": "unsupported language or format"}
@@ -80,6 +106,69 @@ def api_generate_json() -> Dict[str, str]:
     return output
 
 
+@app.route("/api/report/events", method="POST")
+@allow_cors
+def api_generate_from_events() -> Dict[str, Any]:
+    # The body is just the JSON list of events, which is read incrementally, so it is not limited by MEMFILE_MAX
+    language = request.query.get("language")
+    format = request.query.get("format")
+
+    if language not in LANGUAGES or format not in FORMATS:
+        response.status = 400
+        return {"error": "unsupported language or format"}
+
+    body, err = service.run_pipeline_from_stream(language, format, request.body)
+    output = {"language": language, "body": body}
+    if err:
+        output["error"] = err
+    return output
+
+
+@app.route("/api/report/batch", method="POST")
+@allow_cors
+def api_generate_batch() -> Dict[str, Any]:
+    body = json.loads(request.body.read())
+    jobs = [(job["language"], job["format"], job["data"]) for job in body["jobs"]]
+
+    if any(language not in LANGUAGES or format not in FORMATS for language, format, _ in jobs):
+        response.status = 400
+        return {"error": "unsupported language or format"}
+
+    results = []
+    for (language, _, _), (body, err) in zip(jobs, service.run_batch(jobs)):
+        output = {"language": language, "body": body}
+        if err:
+            output["error"] = err
+        results.append(output)
+    return {"results": results}
+
+
+@app.route("/api/report/stream", method="POST")
+@allow_cors
+def api_generate_stream() -> Iterator[str]:
+    body = json.loads(request.body.read())
+    language = body["language"]
+    format = body["format"]
+
+    if language not in LANGUAGES or format not in FORMATS:
+        response.status = 400
+        return iter([json.dumps({"error": "unsupported language or format"})])
+
+    # One JSON record per line, written to the client as soon as each paragraph is realized
+    response.content_type = "application/x-ndjson"
+
+    data = body["data"]
+
+    def records() -> Iterator[str]:
+        for paragraph, (text, err) in enumerate(service.stream_pipeline(language, format, data)):
+            output = {"language": language, "paragraph": paragraph, "body": text}
+            if err:
+                output["error"] = err
+            yield json.dumps(output) + "\n"
+
+    return records()
+
+
 @app.route("/api/report", method="POST")
 @allow_cors
 def api_generate() -> Dict[str, str]:
@@ -98,6 +187,66 @@ def api_generate() -> Dict[str, str]:
     return output
 
 
+@app.route("/api/session", method="POST")
+@allow_cors
+def api_open_session() -> Dict[str, str]:
+    body = json.loads(request.body.read())
+    language = body["language"]
+    format = body["format"]
+
+    if language not in LANGUAGES or format not in FORMATS:
+        response.status = 400
+        return {"error": "unsupported language or format"}
+
+    return {"session": service.open_session(language, format)}
+
+
+@app.route("/api/session/<session_id>/events", method="POST")
+@allow_cors
+def api_append_to_session(session_id: str) -> Dict[str, Any]:
+    try:
+        body = json.loads(request.body.read())
+    except ValueError:
+        body = None
+    if not isinstance(body, dict) or not isinstance(body.get("data"), (list, str)):
+        response.status = 400
+        return {"error": "expected a JSON object with the events as data"}
+
+    # Only the paragraphs from index "first" on are returned, they replace those the client already has
+    try:
+        first, paragraphs, err = service.append_to_session(session_id, body["data"])
+        output = {"session": session_id, "first": first, "paragraphs": paragraphs}
+        if body.get("document", False):
+            output["body"] = service.get_session_document(session_id)
+    except KeyError:
+        response.status = 404
+        return {"error": "unknown session"}
+    if err:
+        output["error"] = err
+    return output
+
+
+@app.route("/api/session/<session_id>", method="GET")
+@allow_cors
+def api_get_session(session_id: str) -> Dict[str, str]:
+    try:
+        return {"session": session_id, "body": service.get_session_document(session_id)}
+    except KeyError:
+        response.status = 404
+        return {"error": "unknown session"}
+
+
+@app.route("/api/session/<session_id>", method="DELETE")
+@allow_cors
+def api_close_session(session_id: str) -> Dict[str, str]:
+    try:
+        service.close_session(session_id)
+    except KeyError:
+        response.status = 404
+        return {"error": "unknown session"}
+    return {"session": session_id}
+
+
 @app.route("/api/languages")
 @allow_cors
 def get_languages() -> Dict[str, List[str]]:
@@ -111,6 +260,9 @@ def get_formats() -> Dict[str, List[str]]:
 
 
 def main() -> None:
+    if service.concurrency is not None:
+        # Requests block the event loop of meinheld while they wait for the pool, so the pool adds no concurrency
+        log.warning("Worker pools only add request concurrency when ran in uwsgi, see explainer.ini")
     log.info("Starting server at 8080")
     run(app, server="meinheld", host="0.0.0.0", port=8080)
     log.info("Stopping")
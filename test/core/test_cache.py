@@ -0,0 +1,60 @@
+from threading import Thread
+from unittest import TestCase, main
+
+from explainer.core.cache import LRUCache
+
+
+class TestLRUCache(TestCase):
+    def test_get_and_put(self):
+        cache = LRUCache(2)
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual("default", cache.get("a", "default"))
+        cache.put("a", 1)
+        self.assertEqual(1, cache.get("a"))
+        self.assertIn("a", cache)
+
+    def test_least_recently_used_is_evicted(self):
+        cache = LRUCache(2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        cache.get("a")
+        cache.put("c", 3)
+        self.assertIn("a", cache)
+        self.assertNotIn("b", cache)
+        self.assertIn("c", cache)
+        self.assertEqual(2, len(cache))
+
+    def test_counts_hits_and_misses(self):
+        cache = LRUCache(2)
+        cache.get("a")
+        cache.put("a", 1)
+        cache.get("a")
+        cache.get("a")
+        self.assertEqual(2, cache.hits)
+        self.assertEqual(1, cache.misses)
+        cache.clear()
+        self.assertEqual((0, 0, 0), (cache.hits, cache.misses, len(cache)))
+
+    def test_size_must_be_positive(self):
+        with self.assertRaises(ValueError):
+            LRUCache(0)
+
+    def test_concurrent_use(self):
+        cache = LRUCache(10)
+
+        def work(offset):
+            for idx in range(1000):
+                cache.put((offset + idx) % 20, idx)
+                cache.get(idx % 20)
+
+        threads = [Thread(target=work, args=(offset,)) for offset in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(10, len(cache))
+        self.assertEqual(4000, cache.hits + cache.misses)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+import io
+import json
+from unittest import TestCase, main
+
+from explainer.core.json_stream import iter_json_array
+
+
+class TestIterJsonArray(TestCase):
+    def _items(self, text, chunk_size=3):
+        return list(iter_json_array(io.BytesIO(text.encode("utf-8")), chunk_size))
+
+    def test_items_match_json_loads(self):
+        text = ' [ {"id": 1, "name": "ä[,]"}, 12345, -1.5e3, "x\\u00e4", [], true , null, {"a": [1, {"b": 2}]}]\n'
+        for chunk_size in (1, 2, 3, 7, 1 << 16):
+            self.assertListEqual(json.loads(text), self._items(text, chunk_size), chunk_size)
+
+    def test_text_streams(self):
+        self.assertListEqual([1, "ö"], list(iter_json_array(io.StringIO('[1, "ö"]'), 1)))
+
+    def test_empty_array(self):
+        self.assertListEqual([], self._items(" [ ] "))
+
+    def test_items_are_yielded_as_they_are_read(self):
+        stream = io.BytesIO(b'[{"id": 1}, ' + b" " * 1000 + b"{")
+        items = iter_json_array(stream, 16)
+        self.assertDictEqual({"id": 1}, next(items))
+        self.assertLess(stream.tell(), 100)
+
+    def test_malformed_input_raises(self):
+        for text in ("", "{}", "[1 2]", "[1,]", "[1", "[1] 2", '["a'):
+            with self.assertRaises(json.JSONDecodeError, msg=text):
+                self._items(text)
+
+    def test_malformed_items_raise_before_the_end_of_the_stream(self):
+        for head in (b'[{"a": x', b'[{"a": "' + b"x" * 1000 + b'", "b": x', b"[[1, 2 3"):
+            stream = io.BytesIO(head + b" " * 100000)
+            with self.assertRaises(json.JSONDecodeError, msg=head):
+                list(iter_json_array(stream, 16))
+            self.assertLess(stream.tell(), 10000, head)
+
+    def test_items_longer_than_the_chunks(self):
+        text = json.dumps([{"a": 'x\\"]}' * 1000, "b": list(range(1000))}, -1.5e3 * 10**300, "ä\U0001F600" * 500])
+        for chunk_size in (1, 16, 1 << 16):
+            self.assertListEqual(json.loads(text), self._items(text, chunk_size), chunk_size)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,16 @@
 from unittest import TestCase, main
 
 from explainer.core.models import (
+    CompiledRule,
     Document,
+    FactIndex,
     DocumentPlanNode,
     Fact,
     FactField,
     FactFieldSource,
+    FactParameters,
     LhsExpr,
+    Literal,
     LiteralSlot,
     LiteralSource,
     Matcher,
@@ -14,6 +18,7 @@ from explainer.core.models import (
     ReferentialExpr,
     Relation,
     Slot,
+    SlotMetadata,
     SlotSource,
     Template,
     TemplateComponent,
@@ -31,6 +36,26 @@ class TestFact(TestCase):
         self.assertEqual(self.fact.id, "id")
 
 
+class TestFactParameters(TestCase):
+    def setUp(self):
+        self.parameters = FactParameters("Task", {"a": 1, "b": "x]"}, "[Task:{a}:{b}]")
+
+    def test_string_form(self):
+        self.assertEqual("[Task:1:x]]", str(self.parameters))
+        self.assertEqual("x]", self.parameters["b"])
+
+    def test_equality(self):
+        same = FactParameters("Task", {"a": 1, "b": "x]"}, "[Task:{a}:{b}]")
+        self.assertEqual(self.parameters, same)
+        self.assertEqual(hash(self.parameters), hash(same))
+        self.assertNotEqual(self.parameters, FactParameters("Task", {"a": 2, "b": "x]"}, "[Task:{a}:{b}]"))
+        self.assertNotEqual(self.parameters, str(self.parameters))
+
+    def test_rules_match_the_string_form(self):
+        fact = Fact("task", "Task", self.parameters, 1)
+        self.assertTrue(Matcher(FactField("parameters"), "=", r"\[Task:1:.*")(fact, [fact]))
+
+
 class TestMessage(TestCase):
     def setUp(self):
         self.fact1 = Fact("action", "action1", "parameters", "id",)
@@ -338,6 +363,95 @@ class TestMatcher(TestCase):
         self.assertFalse(matcher(self.fact1, self.all_facts))
 
 
+class TestCompiledRule(TestCase):
+    def setUp(self):
+        self.fact1 = Fact("action", "action1", "parameters", 1,)
+        self.fact2 = Fact("action", "action2", "parameters", 2,)
+        self.facts = [self.fact1, self.fact2]
+
+    def assertAgreesWithMatchers(self, matchers):
+        rule = CompiledRule(matchers)
+        for fact in self.facts:
+            self.assertEqual(rule(fact, self.facts), all(matcher(fact, self.facts) for matcher in matchers))
+
+    def test_empty_rule_matches_everything(self):
+        rule = CompiledRule([])
+        self.assertTrue(rule(self.fact1, self.facts))
+
+    def test_plain_string_equality(self):
+        self.assertAgreesWithMatchers([Matcher(FactField("name"), "=", "action1")])
+        self.assertAgreesWithMatchers([Matcher(FactField("id"), "=", "1")])
+
+    def test_regex_equality(self):
+        self.assertAgreesWithMatchers([Matcher(FactField("name"), "=", "action.*")])
+        self.assertAgreesWithMatchers([Matcher(FactField("name"), "=", "act|action2")])
+
+    def test_non_string_equality(self):
+        self.assertAgreesWithMatchers([Matcher(FactField("id"), "=", 2)])
+
+    def test_set_membership(self):
+        self.assertAgreesWithMatchers([Matcher(FactField("name"), "in", {"action2", "action3"})])
+
+    def test_referential_value(self):
+        self.assertAgreesWithMatchers([Matcher(FactField("name"), "=", ReferentialExpr(1, "name"))])
+
+    def test_multiple_matchers(self):
+        self.assertAgreesWithMatchers([Matcher(FactField("type"), "=", "action"), Matcher(FactField("id"), ">", 1)])
+
+    def test_survives_pickling(self):
+        import pickle
+
+        rule = pickle.loads(pickle.dumps(CompiledRule([Matcher(FactField("name"), "=", "action1")])))
+        self.assertTrue(rule(self.fact1, self.facts))
+        self.assertFalse(rule(self.fact2, self.facts))
+
+
+class TestFactIndex(TestCase):
+    def setUp(self):
+        self.messages = [
+            Message(Fact("task", "split", "facet", 1)),
+            Message(Fact("reason", "big", None, 1)),
+            Message(Fact("task", "extract", "words", 2)),
+            Message(Fact("reason", "small", None, 2)),
+            Message(Fact("reason", "other", None, 2)),
+        ]
+        self.index = FactIndex(self.messages)
+
+    def test_literal_pin(self):
+        rule = CompiledRule([Matcher(FactField("type"), "=", "reason"), Matcher(FactField("name"), "=", "small")])
+        self.assertListEqual(self.index.candidates(rule, []), [self.messages[3].main_fact])
+
+    def test_referential_pin(self):
+        same_id = Matcher(FactField("id"), "=", ReferentialExpr(0, "id"))
+        rule = CompiledRule([Matcher(FactField("type"), "=", "reason"), same_id])
+        used_facts = [self.messages[2].main_fact]
+        candidates = self.index.candidates(rule, used_facts)
+        self.assertLess(len(candidates), len(self.messages))
+        matching = [fact for fact in candidates if rule(fact, used_facts)]
+        self.assertListEqual(matching, [self.messages[3].main_fact, self.messages[4].main_fact])
+
+    def test_unpinned_rule_has_no_candidates(self):
+        rule = CompiledRule([Matcher(FactField("name"), "=", "sm.*")])
+        self.assertIsNone(self.index.candidates(rule, []))
+
+    def test_template_check_agrees_with_scan(self):
+        same_id = Matcher(FactField("id"), "=", ReferentialExpr(0, "id"))
+        template = Template(
+            [Slot(FactFieldSource("name")), Slot(FactFieldSource("name"))],
+            [
+                ([Matcher(FactField("type"), "=", "task")], [0]),
+                ([Matcher(FactField("type"), "=", "reason"), same_id], [1]),
+            ],
+        )
+        for message in self.messages:
+            scanned = template.check(message, self.messages)
+            indexed = template.check(message, self.messages, self.index)
+            if scanned is None:
+                self.assertIsNone(indexed)
+            else:
+                self.assertListEqual(scanned.rule_facts, indexed.rule_facts)
+
+
 class TestTemplate(TestCase):
     def setUp(self):
         self.fact1 = Fact("action", "action1", "parameters", "id",)
@@ -404,9 +518,12 @@ class TestTemplate(TestCase):
         self.assertListEqual(self.template.components, [self.slot, new_slot, self.literal])
 
     def test_template_check_success(self):
-        used_facts = self.template.check(self.message1, [self.message1])
-        self.assertEqual(len(used_facts), 1)
-        self.assertIn(self.fact1, used_facts)
+        match = self.template.check(self.message1, [self.message1])
+        self.assertIsNotNone(match)
+        self.assertEqual(len(match.facts), 1)
+        self.assertIn(self.fact1, match.facts)
+        self.assertListEqual(match.rule_facts, [self.fact1])
+        self.assertListEqual(match.slot_facts, [(0, self.fact1)])
 
     def test_template_check_success_does_not_fill(self):
         self.template.check(self.message1, [self.message1])
@@ -415,9 +532,8 @@ class TestTemplate(TestCase):
         self.assertIsNone(self.slot.fact)
 
     def test_template_check_failure(self):
-        used_facts = self.template.check(self.message2, [self.message2])
-        self.assertEqual(len(used_facts), 0)
-        self.assertNotIn(self.fact2, used_facts)
+        match = self.template.check(self.message2, [self.message2])
+        self.assertIsNone(match)
 
     def test_template_check_failure_does_not_fill(self):
         self.template.check(self.message2, [self.message2])
@@ -445,6 +561,49 @@ class TestTemplate(TestCase):
         self.assertEqual(len(self.template.facts), 0)
         self.assertIsNone(self.slot.fact)
 
+    def test_template_fill_with_match_fills_copy(self):
+        match = self.template.check(self.message1, [self.message1])
+        copy = self.template.copy()
+        used_facts = copy.fill(self.message1, [], match)
+        self.assertListEqual(used_facts, [self.fact1])
+        self.assertEqual(copy.components[0].fact, self.fact1)
+        self.assertIsNone(self.slot.fact)
+
+    def test_template_check_secondary_rule(self):
+        matcher = Matcher(FactField("name"), "=", "action2")
+        template = Template(
+            [Slot(FactFieldSource("name")), Slot(FactFieldSource("name"))], [([self.matcher], [0]), ([matcher], [1])]
+        )
+        match = template.check(self.message1, [self.message1, self.message2])
+        self.assertListEqual(match.rule_facts, [self.fact1, self.fact2])
+        self.assertListEqual(match.slot_facts, [(0, self.fact1), (1, self.fact2)])
+        self.assertIsNone(template.check(self.message1, [self.message1]))
+
+    def test_template_slot_metadata(self):
+        template = Template(
+            [
+                Literal("x"),
+                Slot(FactFieldSource("name"), {"case": "genitive"}),
+                LiteralSlot("plain", {"case": "genitive"}),
+                LiteralSlot("UNKNOWN_TASK:foo"),
+                LiteralSlot("[ENTITY:NAME:foo]"),
+            ]
+        )
+        metadata = template.slot_metadata
+        self.assertTupleEqual((1, 2), metadata.case_slots)
+        self.assertTupleEqual((1, 4), metadata.entity_slots)
+        self.assertTupleEqual((1, 3, 4), metadata.realizable_slots)
+        self.assertIs(metadata, template.copy().slot_metadata)
+
+    def test_template_slot_metadata_follows_components(self):
+        template = Template([Literal("x")])
+        self.assertTupleEqual((), template.slot_metadata.realizable_slots)
+        template.add_slot(0, Slot(FactFieldSource("name")))
+        self.assertTupleEqual((0,), template.slot_metadata.realizable_slots)
+        template.move_slot(0, 1)
+        self.assertTupleEqual((1,), template.slot_metadata.realizable_slots)
+        self.assertIsInstance(template.slot_metadata, SlotMetadata)
+
     # TODO: Add tests for more complex templates, i.e. \w multiple Matchers and multiple Messages
 
 
@@ -0,0 +1,132 @@
+import os
+import tempfile
+from unittest import TestCase, main
+
+from numpy.random import default_rng
+
+from explainer.core.models import DocumentPlanNode, Fact, Literal, LiteralSlot, Message, Relation, Template
+from explainer.core.morphological_realizer import (
+    LanguageSpecificMorphologicalRealizer,
+    MorphologicalRealizer,
+    MorphologyCache,
+)
+from explainer.core.pipeline import RunContext
+
+
+class CountingRealizer(LanguageSpecificMorphologicalRealizer):
+    inflection_errors = (LookupError,)
+
+    def __init__(self, cache=None):
+        super().__init__("xx", cache)
+        self.calls = []
+
+    def normalize_case(self, case):
+        return case.upper()
+
+    def inflect(self, form, case):
+        self.calls.append((form, case))
+        if form == "broken":
+            raise LookupError("no analyser")
+        if form == "bug":
+            raise RuntimeError("bug")
+        return "{}+{}".format(form, case)
+
+
+class TestMorphologyCache(TestCase):
+    def test_memory_tier(self):
+        cache = MorphologyCache(4)
+        self.assertIsNone(cache.get("fi", "kissa", "Gen"))
+        cache.put("fi", "kissa", "Gen", "kissan")
+        self.assertEqual("kissan", cache.get("fi", "kissa", "Gen"))
+        self.assertIsNone(cache.get("en", "kissa", "Gen"))
+
+    def test_disk_tier_is_shared(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "morphology.sqlite")
+            MorphologyCache(4, path).put("fi", "kissa", "Gen", "kissan")
+            other = MorphologyCache(4, path)
+            self.assertEqual("kissan", other.get("fi", "kissa", "Gen"))
+            self.assertEqual(1, len(other.memory))
+
+    def test_unusable_disk_tier_is_ignored(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = MorphologyCache(4, directory)
+            cache.put("fi", "kissa", "Gen", "kissan")
+            self.assertEqual("kissan", cache.get("fi", "kissa", "Gen"))
+            self.assertIsNone(cache.get("fi", "koira", "Gen"))
+
+
+class TestCachedInflection(TestCase):
+    def setUp(self):
+        self.realizer = CountingRealizer(MorphologyCache(4))
+
+    def test_uncased_slots_are_left_as_is(self):
+        self.assertEqual("cat", self.realizer.realize(LiteralSlot("cat")))
+        self.assertListEqual([], self.realizer.calls)
+
+    def test_inflections_are_cached(self):
+        self.assertEqual("cat+GENITIVE", self.realizer.realize(LiteralSlot("cat", {"case": "genitive"})))
+        self.assertEqual("cat+GENITIVE", self.realizer.realize(LiteralSlot("cat", {"case": "Genitive"})))
+        self.assertListEqual([("cat", "GENITIVE")], self.realizer.calls)
+
+    def test_failures_are_not_cached(self):
+        self.assertEqual("broken", self.realizer.realize(LiteralSlot("broken", {"case": "genitive"})))
+        self.assertEqual("broken", self.realizer.realize(LiteralSlot("broken", {"case": "genitive"})))
+        self.assertEqual(2, len(self.realizer.calls))
+
+    def test_other_errors_are_raised(self):
+        with self.assertRaises(RuntimeError):
+            self.realizer.realize(LiteralSlot("bug", {"case": "genitive"}))
+
+
+class TestMorphologicalRealizer(TestCase):
+    def setUp(self):
+        self.realizer = CountingRealizer()
+        self.stage = MorphologicalRealizer({"xx": self.realizer})
+
+    def _document(self, *words):
+        messages = []
+        for word in words:
+            message = Message(Fact("task", "name", None, 1))
+            message.template = Template([Literal("of"), LiteralSlot(word, {"case": "genitive"}), LiteralSlot(word)])
+            messages.append(message)
+        return DocumentPlanNode([DocumentPlanNode(messages, Relation.SEQUENCE)], Relation.SEQUENCE)
+
+    def _values(self, document_plan):
+        return [
+            [component.value for component in message.template.components]
+            for paragraph in document_plan.children
+            for message in paragraph.children
+        ]
+
+    def test_each_form_is_inflected_once(self):
+        document_plan = self._document("cat", "dog", "cat", "cat")
+        self.stage.run(None, default_rng(0), "xx", document_plan)
+        self.assertListEqual(
+            [
+                ["of", "cat+GENITIVE", "cat"],
+                ["of", "dog+GENITIVE", "dog"],
+                ["of", "cat+GENITIVE", "cat"],
+                ["of", "cat+GENITIVE", "cat"],
+            ],
+            self._values(document_plan),
+        )
+        self.assertListEqual([("cat", "GENITIVE"), ("dog", "GENITIVE")], self.realizer.calls)
+
+    def test_batch_inflects_each_form_once_across_documents(self):
+        documents = [self._document("cat", "dog"), self._document("dog"), self._document("cat")]
+        contexts = [RunContext(None, default_rng(0), "xx") for _ in documents]
+        outputs = self.stage.run_batch(contexts, [(document,) for document in documents])
+        self.assertListEqual([(document,) for document in documents], outputs)
+        self.assertListEqual([["of", "dog+GENITIVE", "dog"]], self._values(documents[1]))
+        self.assertEqual(2, len(self.realizer.calls))
+
+    def test_unknown_language_is_left_as_is(self):
+        document_plan = self._document("cat")
+        self.stage.run(None, default_rng(0), "yy", document_plan)
+        self.assertListEqual([["of", "cat", "cat"]], self._values(document_plan))
+        self.assertListEqual([], self.realizer.calls)
+
+
+if __name__ == "__main__":
+    main()
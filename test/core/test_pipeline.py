@@ -0,0 +1,130 @@
+from unittest import TestCase, main
+
+from explainer.core.models import DocumentPlanNode, Fact, Message, Relation, iter_messages
+from explainer.core.pipeline import MessageStage, NLGPipeline, NLGPipelineComponent, RunContext
+from explainer.core.registry import Registry
+
+
+class Planner(NLGPipelineComponent):
+    def run(self, registry, random, language, count):
+        messages = [Message(Fact("task", str(idx), None, idx)) for idx in range(count)]
+        paragraphs = [
+            DocumentPlanNode(messages[:2], Relation.SEQUENCE),
+            DocumentPlanNode(messages[2:], Relation.SEQUENCE),
+        ]
+        return DocumentPlanNode(paragraphs, Relation.SEQUENCE), "extra"
+
+
+class Recorder(MessageStage):
+    def __init__(self, name, calls):
+        self.name = name
+        self.calls = calls
+
+    def run(self, registry, random, language, document_plan, *args):
+        state = self.start(None, document_plan, *args)
+        for paragraph in document_plan.children:
+            for message in paragraph.children:
+                self.run_message(None, state, message)
+        return self.finish(None, state, document_plan)
+
+    def start(self, context, document_plan, *args):
+        self.calls.append((self.name, "start") + args)
+        return []
+
+    def run_message(self, context, state, message):
+        state.append(message.main_fact.name)
+        self.calls.append((self.name, message.main_fact.name))
+
+    def finish(self, context, state, document_plan):
+        self.calls.append((self.name, "finish"))
+        return (document_plan,) if self.name != "last" else " ".join(state)
+
+    def finish_paragraph(self, context, state, paragraph):
+        return " ".join(message.main_fact.name for message in paragraph.children)
+
+
+class Drawer(MessageStage):
+    def __init__(self, last):
+        self.last = last
+
+    def run(self, registry, random, language, document_plan, *args):
+        context = RunContext(registry, random, language)
+        state = self.start(context, document_plan, *args)
+        for message in iter_messages(document_plan):
+            self.run_message(context, state, message)
+        return self.finish(context, state, document_plan)
+
+    def start(self, context, document_plan, *args):
+        return {}
+
+    def run_message(self, context, state, message):
+        state[id(message)] = str(context.random.integers(1000))
+
+    def finish(self, context, state, document_plan):
+        if not self.last:
+            return (document_plan,)
+        return "|".join(self.finish_paragraph(context, state, paragraph) for paragraph in document_plan.children)
+
+    def finish_paragraph(self, context, state, paragraph):
+        return " ".join(state[id(message)] for message in paragraph.children)
+
+    def join_paragraphs(self, context, paragraphs):
+        return "|".join(paragraphs)
+
+
+class TestFusedPipeline(TestCase):
+    def setUp(self):
+        self.calls = []
+        self.pipeline = NLGPipeline(Registry(), Planner(), Recorder("first", self.calls), Recorder("last", self.calls))
+
+    def test_fused_stages_process_one_message_at_a_time(self):
+        self.assertEqual("0 1 2", self.pipeline.run((3,), "en", fused=True))
+        self.assertListEqual(
+            [
+                ("first", "start", "extra"),
+                ("last", "start"),
+                ("first", "0"),
+                ("last", "0"),
+                ("first", "1"),
+                ("last", "1"),
+                ("first", "2"),
+                ("last", "2"),
+                ("first", "finish"),
+                ("last", "finish"),
+            ],
+            self.calls,
+        )
+
+    def test_staged_mode_runs_stages_in_turn(self):
+        self.assertEqual("0 1 2", self.pipeline.run((3,), "en"))
+        self.assertListEqual(
+            [("first", "start", "extra"), ("first", "0"), ("first", "1"), ("first", "2"), ("first", "finish")],
+            self.calls[:5],
+        )
+
+    def test_stream_yields_each_paragraph_when_done(self):
+        paragraphs = self.pipeline.stream((3,), "en", fused=True)
+        self.assertEqual("0 1", next(paragraphs))
+        self.assertNotIn(("first", "2"), self.calls)
+        self.assertListEqual(["2"], list(paragraphs))
+        self.assertIn(("last", "2"), self.calls)
+
+    def test_staged_stream_runs_all_but_the_last_stage_first(self):
+        paragraphs = self.pipeline.stream((3,), "en")
+        self.assertEqual("0 1", next(paragraphs))
+        self.assertIn(("first", "finish"), self.calls)
+        self.assertNotIn(("last", "2"), self.calls)
+        self.assertListEqual(["2"], list(paragraphs))
+
+    def test_stream_draws_as_run_does(self):
+        pipeline = NLGPipeline(Registry(), Planner(), Drawer(False), Drawer(True))
+        for fused in (False, True):
+            self.assertEqual(
+                pipeline.run((5,), "en", 1, fused=fused),
+                pipeline.join_paragraphs("en", list(pipeline.stream((5,), "en", 1, fused=fused))),
+            )
+        self.assertNotEqual(pipeline.run((5,), "en", 1), pipeline.run((5,), "en", 1, fused=True))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,278 @@
+import re
+import time
+from unittest import TestCase, main, mock
+
+from numpy.random import default_rng
+
+from explainer.core.cache import LRUCache
+from explainer.core.models import (
+    DocumentPlanNode,
+    Fact,
+    FactFieldSource,
+    FactParameters,
+    Literal,
+    LiteralSource,
+    Message,
+    Relation,
+    Slot,
+    Template,
+)
+from explainer.core.realize_slots import (
+    NumberRealizer,
+    RegexRealizer,
+    SlotRealizer,
+    SlotRealizerTable,
+    TypedRealizer,
+    find_tags,
+    text_before_tag,
+)
+from explainer.core.pipeline import RunContext
+from explainer.core.registry import Registry
+
+
+class TestSlotRealizer(TestCase):
+    def setUp(self):
+        self.registry = Registry()
+        self.registry.register(
+            "slot-realizers",
+            [
+                RegexRealizer(self.registry, "en", r"\[OUTER:([^\]]*)\]", 1, "[INNER:{0}] and {0}"),
+                RegexRealizer(self.registry, "en", r"\[INNER:([^\]]*)\]", 1, ["inner {}", "other {}"]),
+            ],
+        )
+        self.registry.register(
+            "slot-realizer-table",
+            {"en": SlotRealizerTable.for_language(self.registry.get("slot-realizers"), "en")},
+        )
+
+    def _message(self, *values):
+        fact = Fact("task", "name", None, 1)
+        template = Template([Literal("x")] + [Slot(LiteralSource(value), fact=fact) for value in values])
+        message = Message(fact)
+        message.template = template
+        return message
+
+    def _realize(self, document_plan, seed=0):
+        SlotRealizer().run(self.registry, default_rng(seed), "en", document_plan)
+
+    def _surface(self, message):
+        return " ".join(str(component.value) for component in message.children)
+
+    def test_realizes_slots_produced_by_other_realizers(self):
+        message = self._message("[OUTER:a]", "plain")
+        self._realize(DocumentPlanNode([message], Relation.SEQUENCE))
+        self.assertRegex(self._surface(message), r"^x (inner|other) a and a plain$")
+
+    def test_components_keep_their_parent_template(self):
+        message = self._message("[OUTER:a]")
+        self._realize(DocumentPlanNode([message], Relation.SEQUENCE))
+        self.assertIs(message.template.components, message.children)
+        self.assertEqual(5, len(message.children))
+
+    def test_unrealizable_slots_are_left_as_is(self):
+        message = self._message("[UNKNOWN:a]")
+        slot = message.children[1]
+        self._realize(DocumentPlanNode([message], Relation.SEQUENCE))
+        self.assertIs(slot, message.children[1])
+
+    def test_slot_metadata_is_updated(self):
+        message = self._message("[OUTER:a]", "plain")
+        self.assertTupleEqual((1,), message.template.slot_metadata.realizable_slots)
+        self._realize(DocumentPlanNode([message], Relation.SEQUENCE))
+        self.assertTupleEqual((), message.template.slot_metadata.realizable_slots)
+
+    def test_table_is_built_when_not_registered(self):
+        registry = Registry()
+        registry.register("slot-realizers", self.registry.get("slot-realizers"))
+        message = self._message("[OUTER:a]", "plain")
+        SlotRealizer().run(registry, default_rng(0), "en", DocumentPlanNode([message], Relation.SEQUENCE))
+        self.assertRegex(self._surface(message), r"^x (inner|other) a and a plain$")
+
+    def test_batch_realizes_each_distinct_slot_once(self):
+        registry = Registry()
+        registry.register("slot-realizers", self.registry.get("slot-realizers"))
+        documents = [[self._message("[OUTER:a]", "[INNER:b]")] for _ in range(3)]
+        contexts = [RunContext(registry, default_rng(seed), "en") for seed in range(3)]
+        with mock.patch.object(
+            RegexRealizer, "realizations", autospec=True, side_effect=RegexRealizer.realizations
+        ) as realizations:
+            outputs = SlotRealizer().run_batch(
+                contexts, [(DocumentPlanNode(messages, Relation.SEQUENCE),) for messages in documents]
+            )
+        # [OUTER:a], [INNER:b] and the [INNER:a] produced by the former, each by the realizer of its tag
+        self.assertEqual(3, realizations.call_count)
+        for seed, messages, (document_plan,) in zip(range(3), documents, outputs):
+            expected = self._message("[OUTER:a]", "[INNER:b]")
+            self._realize(DocumentPlanNode([expected], Relation.SEQUENCE), seed)
+            self.assertEqual(self._surface(expected), self._surface(messages[0]))
+            self.assertIs(messages[0], document_plan.children[0])
+
+    def test_realization_is_repeatable(self):
+        surfaces = []
+        for _ in range(2):
+            messages = [self._message("[OUTER:{}]".format(idx), "[INNER:{}]".format(idx)) for idx in range(5)]
+            self._realize(DocumentPlanNode(messages, Relation.SEQUENCE), seed=42)
+            surfaces.append([self._surface(message) for message in messages])
+        self.assertListEqual(surfaces[0], surfaces[1])
+
+
+class TestSlotRealizerTable(TestCase):
+    def setUp(self):
+        self.number = NumberRealizer()
+        self.words = RegexRealizer(None, "en", r"\[ExtractWords:UNIT:stems\]", [], "stems")
+        self.topic = RegexRealizer(
+            None, "en", r"(.*)\s?\[QueryTopicModel:NAME:([^\]]*)\]\s?(.*)", (1, 2, 3), "{} {} {}"
+        )
+        self.unknown = RegexRealizer(None, "ANY", r"UNKNOWN_TASK:(.*)", 1, "'{}'")
+        self.finnish = RegexRealizer(None, "fi", r"\[ExtractWords:UNIT:stems\]", [], "tyvet")
+        self.table = SlotRealizerTable.for_language(
+            [self.number, self.words, self.topic, self.unknown, self.finnish], "en"
+        )
+
+    def _candidates(self, value):
+        return list(self.table.candidates(Slot(LiteralSource(value))))
+
+    def test_find_tags(self):
+        self.assertSetEqual({"A", "B"}, find_tags("x [A:KEY:VALUE] [[B:KEY] [C] [:D]"))
+        self.assertSetEqual(set(), find_tags("[" * 10000 + "a" * 10000))
+
+    def test_only_alternative_realizations_draw_random(self):
+        self.assertFalse(self.number.draws_random())
+        self.assertFalse(self.words.draws_random())
+        self.assertTrue(RegexRealizer(None, "en", r"\[A:(.*)\]", 1, ["one {}", "two {}"]).draws_random())
+
+    def test_regex_tags(self):
+        self.assertEqual("ExtractWords", self.words.tag())
+        self.assertEqual("QueryTopicModel", self.topic.tag())
+        self.assertIsNone(self.unknown.tag())
+        self.assertIsNone(self.number.tag())
+
+    def test_explicit_regex_tags(self):
+        realizer = RegexRealizer(
+            None, "en", text_before_tag("A:B:") + r"\[A:B:([^\]]*)\]\s?(.*)", (1, 2, 3), "{}", tag="A"
+        )
+        self.assertEqual("A", realizer.tag())
+
+    def test_text_before_tag_matches_like_any_text(self):
+        greedy = re.compile(r"(.*)\s?\[A:B:([^\]]*)\]\s?(.*)")
+        linear = re.compile(text_before_tag("A:B:") + r"\[A:B:([^\]]*)\]\s?(.*)")
+        for value in ("[A:B:x]", "a [A:B:x] b", "[A:C:y] [A:B:x]", "[x] [A:B:x]", "[A:B:x", "a [A:C:x] b"):
+            expected = greedy.fullmatch(value)
+            actual = linear.fullmatch(value)
+            self.assertEqual(expected and expected.groups(), actual and actual.groups(), value)
+
+    def test_long_values_with_the_tag_are_matched_in_linear_time(self):
+        realizer = RegexRealizer(
+            None, "en", text_before_tag("A:B:") + r"\[A:B:([^\]]*)\]\s?(.*)", (1, 2, 3), "{} {} {}", tag="A"
+        )
+        value = "[A:B: " * 50000
+        start = time.perf_counter()
+        self.assertIsNone(realizer.realizations(Slot(LiteralSource(value))))
+        # The (.*) prefix the regex used to have took minutes on this value
+        self.assertLess(time.perf_counter() - start, 1)
+
+    def test_candidates_keep_registration_order(self):
+        self.assertListEqual([self.number, self.words, self.unknown], self._candidates("[ExtractWords:UNIT:stems]"))
+        self.assertListEqual(
+            [self.number, self.words, self.topic, self.unknown],
+            self._candidates("[QueryTopicModel:NAME:a] [ExtractWords:UNIT:stems]"),
+        )
+
+    def test_untagged_values_only_get_untagged_realizers(self):
+        self.assertListEqual([self.number, self.unknown], self._candidates("UNKNOWN_TASK:foo"))
+        self.assertListEqual([self.number, self.unknown], self._candidates("[Other:KEY:VALUE]"))
+
+
+class TestCachedRealization(TestCase):
+    def setUp(self):
+        self.cache = LRUCache(16)
+        self.realizer = RegexRealizer(
+            None, "en", r"\[Test:([^\]]*)\]", 1, ["one {}", "two {}", "three {}"], None, None, [1]
+        )
+        self.table = SlotRealizerTable.for_language([self.realizer], "en", self.cache)
+
+    def _slot(self, value, **attributes):
+        return Slot(LiteralSource(value), attributes, Fact("task", "name", value, 1))
+
+    def _tokens(self, components):
+        return [component.value for component in components]
+
+    def test_cached_realizations_match_uncached(self):
+        uncached, cached = default_rng(7), default_rng(7)
+        for _ in range(20):
+            _, expected = self.realizer.realize(self._slot("[Test:x]"), uncached)
+            self.assertListEqual(
+                self._tokens(expected), self._tokens(self.table.realize(self._slot("[Test:x]"), cached))
+            )
+        self.assertEqual(19, self.cache.hits)
+        self.assertEqual(1, self.cache.misses)
+
+    def test_realized_slots_are_fresh_copies(self):
+        slot = self._slot("[Test:x]", case="genitive")
+        first = self.table.realize(slot, default_rng(0))
+        second = self.table.realize(self._slot("[Test:x]", case="genitive"), default_rng(0))
+        self.assertIsNot(first[0], second[0])
+        self.assertIs(slot.fact, first[0].fact)
+        self.assertDictEqual({}, first[0].attributes)
+        self.assertDictEqual({"case": "genitive"}, first[1].attributes)
+
+    def test_attributes_are_part_of_the_key(self):
+        self.table.realize(self._slot("[Test:x]"), default_rng(0))
+        self.table.realize(self._slot("[Test:x]", case="genitive"), default_rng(0))
+        self.assertEqual(2, len(self.cache))
+
+    def test_unrealizable_slots_are_cached(self):
+        self.assertIsNone(self.table.realize(self._slot("[Other:x]"), default_rng(0)))
+        self.assertIsNone(self.table.realize(self._slot("[Other:x]"), default_rng(0)))
+        self.assertEqual(1, self.cache.hits)
+
+    def test_slot_requirements_disable_caching(self):
+        realizer = RegexRealizer(None, "en", r"\[Test:([^\]]*)\]", 1, "{}", slot_requirements=lambda slot: True)
+        table = SlotRealizerTable.for_language([realizer], "en", self.cache)
+        self.assertListEqual(["x"], self._tokens(table.realize(self._slot("[Test:x]"), default_rng(0))))
+        self.assertEqual(0, len(self.cache))
+
+
+class TestTypedRealizer(TestCase):
+    def setUp(self):
+        self.typed = TypedRealizer(
+            None, "en", "ExtractNames", "{max_number} most salient", lambda fields: fields["sort_by"] == "salience"
+        )
+        self.regex = RegexRealizer(None, "en", r"\[ExtractNames:salience:([^\]]*)\]", [1], "{} most salient")
+
+    def _slot(self, **fields):
+        parameters = FactParameters("ExtractNames", fields, "[ExtractNames:{sort_by}:{max_number}]")
+        return Slot(FactFieldSource("parameters"), fact=Fact("task", "ExtractNames", parameters, 1))
+
+    def _tokens(self, realizer, slot):
+        success, components = realizer.realize(slot, default_rng(0))
+        return [component.value for component in components] if success else None
+
+    def test_fields_are_used_directly(self):
+        self.assertListEqual(
+            ["10", "most", "salient"], self._tokens(self.typed, self._slot(sort_by="salience", max_number=10))
+        )
+        self.assertListEqual(
+            ["a]:b", "most", "salient"], self._tokens(self.typed, self._slot(sort_by="salience", max_number="a]:b"))
+        )
+        self.assertIsNone(self._tokens(self.typed, self._slot(sort_by="frequency", max_number=10)))
+        self.assertIsNone(self._tokens(self.typed, Slot(LiteralSource("[ExtractNames:salience:10]"))))
+
+    def test_legacy_string_form_is_still_realized(self):
+        slot = self._slot(sort_by="salience", max_number=10)
+        self.assertEqual("[ExtractNames:salience:10]", str(slot.value))
+        self.assertListEqual(self._tokens(self.typed, slot), self._tokens(self.regex, slot))
+
+    def test_table_tries_the_realizers_of_the_task(self):
+        number = NumberRealizer()
+        table = SlotRealizerTable.for_language([self.regex, self.typed, number], "en", LRUCache(16))
+        slot = self._slot(sort_by="salience", max_number=10)
+        self.assertListEqual([self.regex, self.typed, number], list(table.candidates(slot)))
+        realized = table.realize(slot, default_rng(0))
+        self.assertListEqual(["10", "most", "salient"], [component.value for component in realized])
+        table.realize(self._slot(sort_by="salience", max_number=10), default_rng(0))
+        self.assertEqual(1, table.cache.hits)
+
+
+if __name__ == "__main__":
+    main()
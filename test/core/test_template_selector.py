@@ -0,0 +1,151 @@
+from unittest import TestCase, main, mock
+
+from numpy.random import default_rng
+
+from explainer.core.models import DocumentPlanNode, Fact, Message, Relation, Template
+from explainer.core.pipeline import RunContext
+from explainer.core.registry import Registry
+from explainer.core.surface_realizer import BodyHTMLSurfaceRealizer, static_sentences
+from explainer.core.template_reader import read_templates
+from explainer.core.template_selector import TemplateIndex, TemplateMessageChecker, TemplateSelector
+
+TEMPLATES = """
+en: Task one was done.
+| type = task, name = one
+
+en: Task one was done again.
+| name = one
+
+en: Some task was done.
+| type = task
+
+en: An unknown task {name} was done.
+| name = UNKNOWN_TASK:.*
+
+en: Reason two.
+| type = reason, name = two
+"""
+
+
+class TestTemplateIndex(TestCase):
+    def setUp(self):
+        self.templates = read_templates(TEMPLATES)[0]["en"]
+        self.index = TemplateIndex(self.templates)
+
+        self.messages = [
+            Message(Fact("task", "one", None, 1)),
+            Message(Fact("task", "UNKNOWN_TASK:foo", None, 2)),
+            Message(Fact("reason", "two", None, 3)),
+            Message(Fact("reason", "three", None, 4)),
+        ]
+
+    def test_candidates_keep_original_order(self):
+        candidates = list(self.index.candidates(self.messages[0]))
+        positions = [self.templates.index(template) for template in candidates]
+        self.assertListEqual(positions, sorted(positions))
+
+    def test_candidates_exclude_templates_for_other_names(self):
+        candidates = list(self.index.candidates(self.messages[2]))
+        self.assertNotIn(self.templates[0], candidates)
+        self.assertNotIn(self.templates[1], candidates)
+        self.assertIn(self.templates[4], candidates)
+
+    def test_regex_constraints_are_always_candidates(self):
+        for message in self.messages:
+            self.assertIn(self.templates[3], list(self.index.candidates(message)))
+
+    def test_indexed_checker_agrees_with_full_scan(self):
+        scanning = TemplateMessageChecker(self.templates, self.messages)
+        indexed = TemplateMessageChecker(self.templates, self.messages, self.index)
+        for message in self.messages:
+            self.assertListEqual(
+                list(scanning.all_templates_for_message(message)), list(indexed.all_templates_for_message(message))
+            )
+
+
+class TestBatchSelection(TestCase):
+    def setUp(self):
+        self.templates = read_templates(TEMPLATES)[0]["en"]
+        self.registry = Registry()
+        self.registry.register("templates", {"en": self.templates})
+        self.registry.register("template-index", {"en": TemplateIndex(self.templates)})
+
+    def _document(self):
+        messages = [
+            Message(Fact("task", "one", None, 1)),
+            Message(Fact("task", "UNKNOWN_TASK:foo", None, 2)),
+            Message(Fact("reason", "two", None, 3)),
+        ]
+        return DocumentPlanNode([DocumentPlanNode(messages, Relation.SEQUENCE)], Relation.SEQUENCE), messages
+
+    def _text(self, document_plan):
+        return BodyHTMLSurfaceRealizer().run(self.registry, default_rng(0), "en", document_plan)
+
+    def test_batch_matches_run(self):
+        documents = [self._document() for _ in range(5)]
+        contexts = [RunContext(self.registry, default_rng(seed), "en") for seed in range(5)]
+        outputs = TemplateSelector().run_batch(contexts, documents)
+        for seed, (document_plan, _), output in zip(range(5), documents, outputs):
+            self.assertTupleEqual((document_plan,), output)
+            expected, messages = self._document()
+            TemplateSelector().run(self.registry, default_rng(seed), "en", expected, messages)
+            self.assertEqual(self._text(expected), self._text(document_plan))
+
+    def test_first_rules_are_checked_once_per_batch(self):
+        documents = [self._document() for _ in range(5)]
+        contexts = [RunContext(self.registry, default_rng(0), "en") for _ in documents]
+        with mock.patch.object(
+            Template, "matches_primary", autospec=True, side_effect=Template.matches_primary
+        ) as check:
+            TemplateSelector().run_batch(contexts, documents)
+        candidates = sum(len(list(TemplateIndex(self.templates).candidates(message))) for message in documents[0][1])
+        self.assertEqual(candidates, check.call_count)
+
+
+class TestStaticSentences(TestCase):
+    def setUp(self):
+        self.templates = read_templates(TEMPLATES)[0]["en"]
+
+    def _realize(self, static, seed, indexed=True):
+        registry = Registry()
+        registry.register("templates", {"en": self.templates})
+        if indexed:
+            registry.register("template-index", {"en": TemplateIndex(self.templates)})
+        if static is not None:
+            registry.register("static-sentences", {"en": static})
+        messages = [
+            Message(Fact("task", "one", None, 1)),
+            Message(Fact("task", "UNKNOWN_TASK:foo", None, 2)),
+            Message(Fact("reason", "two", None, 3)),
+        ]
+        document_plan = DocumentPlanNode([DocumentPlanNode(messages, Relation.SEQUENCE)], Relation.SEQUENCE)
+        random = default_rng(seed)
+        TemplateSelector().run(registry, random, "en", document_plan, messages)
+        return messages, BodyHTMLSurfaceRealizer().run(registry, random, "en", document_plan)
+
+    def test_only_templates_without_slots_are_static(self):
+        static = static_sentences(self.templates)
+        self.assertNotIn(self.templates[3], static)
+        self.assertEqual("Reason two.", static[self.templates[4]])
+
+    def test_static_sentences_match_realized_sentences(self):
+        static = static_sentences(self.templates)
+        for seed in range(10):
+            messages, text = self._realize(static, seed)
+            for message in messages:
+                # Templates with slots are still copied
+                self.assertTrue(message.template in static or message.template not in self.templates)
+            self.assertEqual(self._realize({}, seed)[1], text)
+
+    def test_static_sentences_are_optional(self):
+        for seed in range(10):
+            self.assertEqual(self._realize({}, seed)[1], self._realize(None, seed)[1])
+
+    def test_selection_without_index_matches_indexed(self):
+        static = static_sentences(self.templates)
+        for seed in range(10):
+            self.assertEqual(self._realize(static, seed)[1], self._realize(static, seed, indexed=False)[1])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,369 @@
+import io
+import json
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from unittest import TestCase, main, mock
+
+from explainer.core import models
+from explainer.core.realize_slots import RegexRealizer
+from explainer.explainer_message_generator import read_events
+from explainer.explainer_nlg_service import ExplainerNlgService, _worker_service, _worker_services
+
+EVENTS = json.dumps(
+    [
+        {
+            "id": 1,
+            "task": {"name": "ExtractWords", "parameters": {"units": "stems"}},
+            "reason": {"name": "initialization"},
+        },
+        {
+            "id": 2,
+            "task": {"name": "SplitByFacet", "parameters": {"facet": "NEWSPAPER_NAME"}},
+            "reason": {"name": "big_collection"},
+        },
+        {
+            "id": 3,
+            "task": {"name": "Comparison", "parameters": {"facet": "LANGUAGE"}},
+            "reason": {"name": "brute_force"},
+        },
+    ]
+)
+
+
+class TestExplainerNlgService(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.service = ExplainerNlgService(random_seed=4551546)
+
+    def test_cache_is_computed_once(self):
+        calls = []
+
+        def compute():
+            calls.append(1)
+            return {"en": ["template"]}
+
+        with tempfile.TemporaryDirectory() as directory:
+            cache = os.path.join(directory, "sub", "test.cache")
+            first = self.service._get_cached_or_compute(cache, compute, relative_path=False)
+            second = self.service._get_cached_or_compute(cache, compute, relative_path=False)
+            self.assertEqual(first, second)
+            self.assertEqual(1, len(calls))
+            self.assertListEqual(["test.cache"], os.listdir(os.path.dirname(cache)))
+
+    def test_corrupt_cache_is_recomputed(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = os.path.join(directory, "test.cache")
+            with open(cache, "wb") as f:
+                f.write(b"not a cache")
+            self.assertEqual(1, self.service._get_cached_or_compute(cache, lambda: 1, relative_path=False))
+            self.assertEqual(1, self.service._get_cached_or_compute(cache, lambda: 2, relative_path=False))
+
+    def test_cache_gets_default_permissions(self):
+        umask = os.umask(0o022)
+        try:
+            with tempfile.TemporaryDirectory() as directory:
+                cache = os.path.join(directory, "test.cache")
+                self.service._get_cached_or_compute(cache, lambda: 1, relative_path=False)
+                self.assertEqual(0o644, os.stat(cache).st_mode & 0o777)
+        finally:
+            os.umask(umask)
+
+    def test_stale_caches_are_pruned(self):
+        with tempfile.TemporaryDirectory() as directory:
+            for name in ("templates-old.cache", "other.cache"):
+                open(os.path.join(directory, name), "wb").close()
+            cache = os.path.join(directory, "templates-new.cache")
+            self.service._get_cached_or_compute(
+                cache, lambda: 1, relative_path=False, prune_pattern="templates-*.cache"
+            )
+            self.assertListEqual(["other.cache", "templates-new.cache"], sorted(os.listdir(directory)))
+
+    def test_templates_digest_depends_on_templates(self):
+        digest = self.service._templates_digest()
+        self.assertEqual(digest, ExplainerNlgService()._templates_digest())
+
+        resource = self.service.processor_resources[-1]
+        original = resource.templates_string
+        try:
+            resource.templates_string = lambda: original() + "\n"
+            self.assertNotEqual(digest, self.service._templates_digest())
+        finally:
+            del resource.templates_string
+
+    def test_templates_digest_depends_on_template_code(self):
+        digest = self.service._templates_digest()
+        with tempfile.NamedTemporaryFile("w", suffix=".py") as f:
+            f.write("# changed\n")
+            f.flush()
+            with mock.patch.object(models, "__file__", f.name):
+                self.assertNotEqual(digest, self.service._templates_digest())
+        self.assertEqual(digest, self.service._templates_digest())
+
+    def test_warm_up_failures_are_logged(self):
+        class FailingRealizer(object):
+            def warm_up(self):
+                raise RuntimeError("no models")
+
+        realizers = self.service.morphological_realizers
+        try:
+            self.service.morphological_realizers = {"xx": FailingRealizer()}
+            with self.assertLogs("root", "ERROR"):
+                self.assertListEqual([], self.service._warm_up_morphology())
+        finally:
+            self.service.morphological_realizers = realizers
+
+    def test_morphology_cache_is_prepopulated_only_when_persistent(self):
+        with mock.patch.object(ExplainerNlgService, "_prepopulate_morphology_cache") as prepopulate:
+            ExplainerNlgService(random_seed=4551546)
+            prepopulate.assert_not_called()
+            with tempfile.TemporaryDirectory() as directory:
+                ExplainerNlgService(random_seed=4551546, morphology_cache_path=os.path.join(directory, "cache.sqlite"))
+            prepopulate.assert_called_once()
+
+    def test_pipelines_are_reused(self):
+        pipeline = self.service._get_pipeline("ol")
+        self.service.run_pipeline("en", "ol", EVENTS)
+        self.assertIs(pipeline, self.service._get_pipeline("ol"))
+
+    def test_unknown_format_uses_unordered_pipeline(self):
+        self.assertIs(self.service._get_pipeline("headline"), self.service._get_pipeline("ul"))
+
+    def test_concurrent_runs_match_sequential_runs(self):
+        jobs = [(language, output_format) for language in ("en", "fi") for output_format in ("ol", "ul")] * 4
+        expected = [self.service.run_pipeline(language, output_format, EVENTS) for language, output_format in jobs]
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(lambda job: self.service.run_pipeline(job[0], job[1], EVENTS), jobs))
+        self.assertListEqual(expected, results)
+
+    def test_decoded_and_encoded_data_give_same_report(self):
+        expected = self.service.run_pipeline("en", "ol", EVENTS)
+        self.assertEqual(expected, self.service.run_pipeline("en", "ol", EVENTS.encode("utf-8")))
+        self.assertEqual(expected, self.service.run_pipeline("en", "ol", json.loads(EVENTS)))
+
+    def test_streamed_events_give_same_report(self):
+        expected = self.service.run_pipeline("en", "ol", EVENTS)
+        self.assertEqual(
+            expected, self.service.run_pipeline_from_stream("en", "ol", io.BytesIO(EVENTS.encode("utf-8")))
+        )
+        self.assertEqual(expected, self.service.run_pipeline_from_stream("en", "ol", io.StringIO(EVENTS)))
+
+    def test_streamed_events_report_errors(self):
+        body, error = self.service.run_pipeline_from_stream("en", "ol", io.BytesIO(b"not json"))
+        self.assertEqual(self.service.run_pipeline("en", "ol", "not json")[0], body)
+        self.assertTrue(error.startswith("JSONDecodeError"))
+
+    def test_unsorted_events_give_same_report(self):
+        self.assertEqual(
+            self.service.run_pipeline("en", "ol", EVENTS),
+            self.service.run_pipeline("en", "ol", list(reversed(json.loads(EVENTS)))),
+        )
+
+    def test_batch_matches_individual_runs(self):
+        jobs = [(language, output_format, EVENTS) for language in ("en", "fi") for output_format in ("ol", "ul")]
+        expected = [self.service.run_pipeline(*job) for job in jobs]
+        self.assertListEqual(expected, self.service.run_batch(jobs))
+
+    def test_batch_isolates_failing_jobs(self):
+        jobs = [("en", "ol", EVENTS), ("en", "ol", "not json"), ("fi", "ul", "[]")]
+        results = self.service.run_batch(jobs)
+        self.assertEqual(self.service.run_pipeline(*jobs[0]), results[0])
+        self.assertEqual(self.service.run_pipeline(*jobs[1]), results[1])
+        self.assertEqual(self.service.run_pipeline(*jobs[2]), results[2])
+        self.assertIsNone(results[0][1])
+        self.assertIsNotNone(results[1][1])
+
+    def test_fanout_matches_individual_runs(self):
+        languages = ["en", "fi", "de"]
+        for parallel in (False, True):
+            results = self.service.run_fanout(languages, "ol", EVENTS, parallel=parallel)
+            self.assertListEqual(languages, list(results))
+            for language in languages:
+                self.assertEqual(self.service.run_pipeline(language, "ol", EVENTS), results[language])
+
+    def test_fanout_reports_errors_per_language(self):
+        results = self.service.run_fanout(["en", "fi"], "ul", "[]")
+        self.assertEqual(self.service.run_pipeline("en", "ul", "[]"), results["en"])
+        self.assertEqual(self.service.run_pipeline("fi", "ul", "[]"), results["fi"])
+
+    def test_worker_pools_match_inline_runs(self):
+        expected = [self.service.run_pipeline(language, "ol", EVENTS) for language in ("en", "fi")]
+        for concurrency in ExplainerNlgService.CONCURRENCY_MODES:
+            service = ExplainerNlgService(random_seed=4551546, concurrency=concurrency, max_workers=2)
+            try:
+                results = [service.run_pipeline(language, "ol", EVENTS) for language in ("en", "fi")]
+            finally:
+                service.close()
+            self.assertListEqual(expected, results, concurrency)
+
+    def test_process_workers_are_built_with_all_options(self):
+        service = ExplainerNlgService(
+            random_seed=4551546, concurrency="process", max_workers=1, paragraph_seeding=True, session_idle_timeout=5
+        )
+        try:
+            options = service._run_in_pool("__getattribute__", "_worker_options")
+            seeding = service._run_in_pool("__getattribute__", "paragraph_seeding")
+        finally:
+            service.close()
+        self.assertDictEqual(service._worker_options, options)
+        self.assertEqual(5, options["session_idle_timeout"])
+        self.assertTrue(seeding)
+
+    def test_workers_leave_morphology_to_the_parent(self):
+        with mock.patch.dict(_worker_services, clear=True), mock.patch.object(
+            ExplainerNlgService, "_warm_up_morphology"
+        ) as warm_up:
+            service = _worker_service(self.service._worker_options)
+            self.assertIs(service, _worker_service(dict(self.service._worker_options)))
+        warm_up.assert_not_called()
+
+    def test_fusing_requires_single_realizations(self):
+        self.assertTrue(ExplainerNlgService(random_seed=4551546, fused=True).fused)
+        with mock.patch.object(RegexRealizer, "draws_random", return_value=True):
+            self.assertFalse(ExplainerNlgService(random_seed=4551546, fused=True).fused)
+
+    def test_fused_runs_match_staged_runs(self):
+        for output_format in ExplainerNlgService.OUTPUT_FORMATS:
+            pipeline = self.service._get_pipeline(output_format)
+            for language in ("en", "fi", "de"):
+                for seed in range(10):
+                    self.assertEqual(
+                        pipeline.run((EVENTS,), language, seed),
+                        pipeline.run((EVENTS,), language, seed, fused=True),
+                        (output_format, language, seed),
+                    )
+
+    def test_seeded_paragraphs_do_not_depend_on_later_events(self):
+        service = ExplainerNlgService(random_seed=4551546, paragraph_seeding=True)
+        events = json.loads(EVENTS)
+        for language in ("en", "fi"):
+            full, error = service.run_pipeline(language, "ol", events)
+            self.assertIsNone(error)
+            for end in range(1, len(events)):
+                prefix, _ = service.run_pipeline(language, "ol", events[:end])
+                self.assertTrue(full.startswith(prefix), (language, end))
+
+    def test_seeded_paragraphs_are_cached(self):
+        service = ExplainerNlgService(random_seed=4551546, paragraph_seeding=True)
+        expected = service.run_pipeline("en", "ul", EVENTS)
+        self.assertEqual(3, service.paragraph_cache.misses)
+        self.assertEqual(expected, service.run_pipeline("en", "ul", EVENTS))
+        self.assertEqual(3, service.paragraph_cache.hits)
+        self.assertEqual(
+            expected, ExplainerNlgService(random_seed=4551546, paragraph_seeding=True).run_pipeline("en", "ul", EVENTS)
+        )
+
+    def test_streamed_paragraphs_match_run(self):
+        for service in (self.service, ExplainerNlgService(random_seed=4551546, paragraph_seeding=True)):
+            for language in ("en", "fi"):
+                for output_format in ("ol", "ul"):
+                    chunks = list(service.stream_pipeline(language, output_format, EVENTS))
+                    self.assertEqual(3, len(chunks))
+                    self.assertTrue(all(err is None for _, err in chunks))
+                    self.assertEqual(
+                        service.run_pipeline(language, output_format, EVENTS)[0], "".join(body for body, _ in chunks)
+                    )
+
+    def test_streamed_paragraphs_match_staged_run(self):
+        original_init = RegexRealizer.__init__
+
+        def init_with_alternatives(realizer, *args, **kwargs):
+            original_init(realizer, *args, **kwargs)
+            realizer.templates = [
+                alternative for template in realizer.templates for alternative in (template, "x " + template)
+            ]
+
+        with mock.patch.object(RegexRealizer, "__init__", init_with_alternatives):
+            service = ExplainerNlgService(random_seed=4551546, fused=True)
+        self.assertFalse(service.fused)
+        for language in ("en", "fi"):
+            chunks = list(service.stream_pipeline(language, "ol", EVENTS))
+            self.assertEqual(service.run_pipeline(language, "ol", EVENTS)[0], "".join(body for body, _ in chunks))
+            pipeline = service._get_pipeline("ol")
+            for seed in range(10):
+                self.assertEqual(
+                    pipeline.run((EVENTS,), language, seed),
+                    pipeline.join_paragraphs(language, list(pipeline.stream((EVENTS,), language, seed))),
+                    (language, seed),
+                )
+
+    def test_stream_ends_with_error(self):
+        self.assertListEqual(
+            [self.service.run_pipeline("en", "ol", "[]")], list(self.service.stream_pipeline("en", "ol", "[]"))
+        )
+
+    def test_session_matches_run_by_paragraph(self):
+        service = ExplainerNlgService(random_seed=4551546, paragraph_seeding=True)
+        events = json.loads(EVENTS)
+        for language in ("en", "fi"):
+            for output_format in ("ol", "ul"):
+                session_id = service.open_session(language, output_format)
+                for event in events:
+                    _, _, error = service.append_to_session(session_id, [event])
+                    self.assertIsNone(error)
+                self.assertEqual(
+                    service.run_pipeline(language, output_format, events)[0], service.get_session_document(session_id)
+                )
+                service.close_session(session_id)
+
+    def test_session_returns_only_new_paragraphs(self):
+        events = json.loads(EVENTS)
+        session_id = self.service.open_session("en", "ul")
+        first, paragraphs, error = self.service.append_to_session(session_id, events[:2])
+        self.assertIsNone(error)
+        self.assertEqual(0, first)
+        self.assertEqual(2, len(paragraphs))
+        first, paragraphs, error = self.service.append_to_session(session_id, json.dumps(events[2:]))
+        self.assertEqual((2, 1), (first, len(paragraphs)))
+        self.assertEqual((3, [], None), self.service.append_to_session(session_id, []))
+
+    def test_session_is_rebuilt_for_out_of_order_events(self):
+        events = json.loads(EVENTS)
+        session_id = self.service.open_session("en", "ol")
+        self.service.append_to_session(session_id, [events[0], events[2]])
+        first, paragraphs, error = self.service.append_to_session(session_id, [events[1]])
+        self.assertIsNone(error)
+        self.assertEqual((0, 3), (first, len(paragraphs)))
+        self.assertEqual(
+            self.service._get_pipeline("ol").join_paragraphs("en", paragraphs),
+            self.service.get_session_document(session_id),
+        )
+
+    def test_failed_append_leaves_session_as_is(self):
+        session_id = self.service.open_session("en", "ol")
+        self.service.append_to_session(session_id, EVENTS)
+        document = self.service.get_session_document(session_id)
+        _, paragraphs, error = self.service.append_to_session(session_id, "not json")
+        self.assertIsNotNone(error)
+        self.assertListEqual([], paragraphs)
+        self.assertEqual(document, self.service.get_session_document(session_id))
+
+    def test_sessions_accept_parsed_events(self):
+        session_id = self.service.open_session("en", "ol")
+        first, paragraphs, error = self.service.append_to_session(session_id, read_events(io.StringIO(EVENTS)))
+        self.assertIsNone(error)
+        self.assertEqual((0, 3), (first, len(paragraphs)))
+
+    def test_least_recently_used_sessions_are_evicted(self):
+        service = ExplainerNlgService(random_seed=4551546, max_sessions=2)
+        first, second = service.open_session("en", "ol"), service.open_session("en", "ol")
+        service.get_session_document(first)
+        service.open_session("en", "ol")
+        self.assertEqual(2, len(service.sessions))
+        service.get_session_document(first)
+        with self.assertRaises(KeyError):
+            service.get_session_document(second)
+
+    def test_idle_sessions_are_evicted(self):
+        service = ExplainerNlgService(random_seed=4551546, session_idle_timeout=0)
+        session_id = service.open_session("en", "ol")
+        with self.assertRaises(KeyError):
+            service.append_to_session(session_id, EVENTS)
+
+    def test_unknown_concurrency_mode_raises(self):
+        with self.assertRaises(ValueError):
+            ExplainerNlgService(concurrency="fibers")
+
+
+if __name__ == "__main__":
+    main()